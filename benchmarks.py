@@ -0,0 +1,890 @@
+"""Performance benchmarks for the fertilizer billing app.
+
+Run one benchmark at a time, e.g.
+
+    python benchmarks.py startup --runs 5
+    python benchmarks.py forecast --items 10000 --years 5
+    python benchmarks.py analytics --db fertilizer_shop.db
+    python benchmarks.py gstr1 --bills 100000
+    python benchmarks.py api --clients 16 --seconds 10
+    python benchmarks.py sync --bills 100000 --changes 100 1000
+    python benchmarks.py delete --bills 20000 --delete 100 500 2000
+    python benchmarks.py scan --items 5000 --bursts 50 --burst 10
+    python benchmarks.py pdf --bills 20000 --workers 1 2 4
+    python benchmarks.py receipt --lines 5 60 --device /dev/usb/lp0
+    python benchmarks.py draft --lines 10 100 1000
+    python benchmarks.py prices --items 10000 --changes 52
+    python benchmarks.py revise --items 1000 10000
+    python benchmarks.py lots --lots 1 10 100
+    python benchmarks.py valuation --items 10000 100000
+
+Every benchmark works on a scratch database in a temporary directory, so the
+shop's own fertilizer_shop.db is never touched.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(HERE, 'fertilizer_billing.py')
+
+
+def scratch_copy(path, workdir):
+    """Copy a database given with --db into workdir so benchmarks never write to the original"""
+    import sqlite3
+    copy = os.path.join(workdir, os.path.basename(path))
+    src, dst = sqlite3.connect(path), sqlite3.connect(copy)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+    return copy
+
+
+def report(title, samples_ms):
+    samples_ms = sorted(samples_ms)
+    print(f"{title}: n={len(samples_ms)} min={samples_ms[0]:.1f}ms "
+          f"median={statistics.median(samples_ms):.1f}ms max={samples_ms[-1]:.1f}ms")
+
+
+# ============ STARTUP ============
+def bench_startup(args):
+    """Process spawn -> first interactive frame, cold (fresh DB) and warm"""
+    env = dict(os.environ, FERTILIZER_STARTUP_BENCH='1')
+    with tempfile.TemporaryDirectory() as workdir:
+        spawn_ms, in_process_ms = [], []
+        for run in range(args.runs + 1):
+            start = time.perf_counter()
+            proc = subprocess.Popen([sys.executable, APP], cwd=workdir, env=env,
+                                    stdout=subprocess.PIPE, text=True)
+            first_frame = None
+            for line in proc.stdout:
+                if line.startswith('FIRST_FRAME_MS'):
+                    first_frame = float(line.split()[1])
+                    elapsed = (time.perf_counter() - start) * 1000.0
+                    break
+            proc.wait()
+            if first_frame is None:
+                sys.exit("app exited without reporting a frame (is a display available?)")
+            if run == 0:
+                print(f"cold start (creates schema): {elapsed:.1f}ms spawn->frame, {first_frame:.1f}ms import->frame")
+                continue
+            spawn_ms.append(elapsed)
+            in_process_ms.append(first_frame)
+        report("warm start spawn->frame", spawn_ms)
+        report("warm start import->frame", in_process_ms)
+
+
+# ============ FORECAST ============
+def bench_forecast(args):
+    """Vectorized demand forecast over synthetic daily sales (needs NumPy)"""
+    import numpy as np
+    from datetime import date, timedelta
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    today = date.today()
+    start_day = today - timedelta(days=365 * args.years + args.years // 4)
+    horizon = (today - start_day).days + 1
+    rng = np.random.default_rng(7)
+    # each item sells on a random subset of days, like a real catalogue
+    n_points = int(args.items * horizon * args.density)
+    items = rng.integers(0, args.items, n_points)
+    days = rng.integers(0, horizon, n_points)
+    qty = rng.integers(1, 20, n_points).astype(np.float64)
+    stock = rng.integers(0, 500, args.items)
+    names = [f"Item {i}" for i in range(args.items)]
+    print(f"{args.items} items x {horizon} days, {n_points} item-days with sales")
+
+    samples = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        stats = fb.forecast_demand(names, stock, items, days, qty, start_day, today)
+        samples.append((time.perf_counter() - start) * 1000.0)
+    report("forecast_demand", samples)
+    print(f"items to reorder: {int((stats['reorder'] > 0).sum())}")
+
+    if args.db:
+        with tempfile.TemporaryDirectory() as workdir:
+            conn = fb.open_database(scratch_copy(args.db, workdir))
+            samples = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                rows = fb.reorder_suggestions(conn)
+                samples.append((time.perf_counter() - start) * 1000.0)
+            conn.close()
+        report(f"reorder_suggestions on {args.db} (load + forecast, {len(rows)} rows)", samples)
+
+
+# ============ ANALYTICS ============
+def bench_analytics(args):
+    """Top items and category share from sales_daily versus aggregating bill_items"""
+    from datetime import date, timedelta
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    workdir = tempfile.TemporaryDirectory()
+    conn = fb.open_database(scratch_copy(args.db, workdir.name))
+    end = date.today() + timedelta(days=1)
+    start = end - timedelta(days=args.days)
+    raw_sql = '''
+        SELECT bi.item_name, SUM(bi.quantity), SUM(bi.total)
+        FROM bills b JOIN bill_items bi ON bi.bill_id = b.id
+        WHERE b.created_at >= ? AND b.created_at < ?
+        GROUP BY bi.item_name ORDER BY 3 DESC LIMIT 10
+    '''
+    raw, rollup = [], []
+    for _ in range(args.runs):
+        began = time.perf_counter()
+        conn.execute(raw_sql, (start.isoformat(), end.isoformat())).fetchall()
+        raw.append((time.perf_counter() - began) * 1000.0)
+        began = time.perf_counter()
+        fb.item_sales(conn, start, end, 10)
+        fb.category_sales(conn, start, end)
+        rollup.append((time.perf_counter() - began) * 1000.0)
+    conn.close()
+    workdir.cleanup()
+    report(f"bill_items aggregate, {args.days} days", raw)
+    report(f"sales_daily top-10 + categories + previous period, {args.days} days", rollup)
+
+
+# ============ GSTR-1 ============
+def synthetic_year(fb, path, bills, lines, b2b_share):
+    """A year of bills ending today with per-line GST, some customers GST registered"""
+    import random
+    from datetime import datetime, timedelta
+    rnd = random.Random(7)
+    conn = fb.open_database(path)
+    conn.execute("UPDATE settings SET gst_number = '33ABCDE1234F1Z5' WHERE id = 1")
+    customers = 2000
+    conn.executemany('INSERT INTO customers (id, name, phone, gstin) VALUES (?, ?, ?, ?)',
+                     [(i, f'Customer {i}', f'9{i:09d}',
+                       f'33AAAAA{i:04d}A1Z5' if i <= customers * b2b_share else '')
+                      for i in range(1, customers + 1)])
+    items = conn.execute('SELECT name, price, COALESCE(gst_rate, 5), hsn FROM inventory').fetchall()
+    end = datetime.utcnow()
+    step = timedelta(days=365) / bills
+    bill_rows, item_rows = [], []
+    for i in range(1, bills + 1):
+        total = 0.0
+        for name, price, rate, hsn in rnd.sample(items, lines):
+            qty = rnd.randint(1, 10)
+            taxable = qty * price
+            item_rows.append((i, name, qty, price, taxable, rate, hsn, taxable, taxable * rate / 100))
+            total += taxable * (1 + rate / 100)
+        bill_rows.append((i, f'INV{i:08d}', rnd.randint(1, customers), total, total,
+                          (end - step * (bills - i)).strftime('%Y-%m-%d %H:%M:%S')))
+    conn.executemany('INSERT INTO bills (id, invoice_number, customer_id, subtotal, total_amount, created_at)'
+                     ' VALUES (?, ?, ?, ?, ?, ?)', bill_rows)
+    conn.executemany('INSERT INTO bill_items (bill_id, item_name, quantity, price, total, gst_rate, hsn,'
+                     ' taxable, tax) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', item_rows)
+    conn.commit()
+    return conn
+
+
+def bench_gstr1(args):
+    """Streaming GSTR-1 export (JSON and CSV) over a year of bills"""
+    import tracemalloc
+    from datetime import date
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.db:
+            conn = fb.open_database(scratch_copy(args.db, workdir))
+        else:
+            conn = synthetic_year(fb, os.path.join(workdir, 'gstr1.db'), args.bills, args.lines, args.b2b)
+        today = date.today()
+        first = f"{today.year - 1:04d}-{today.month:02d}"
+        last = f"{today.year:04d}-{today.month:02d}"
+        for fmt in ('json', 'csv'):
+            out = os.path.join(workdir, 'gstr1.json' if fmt == 'json' else 'gstr1_csv')
+            samples = []
+            for _ in range(args.runs):
+                stats = fb.export_gstr1(conn, out, first, last, fmt, args.chunk)
+                samples.append(stats['seconds'] * 1000.0)
+            report(f"gstr1 {fmt} {first}..{last}", samples)
+            best = min(samples) / 1000.0
+            print(f"  {stats['invoices']} invoices ({stats['b2b']} B2B), {stats['lines']} lines: "
+                  f"{stats['invoices'] / best:,.0f} bills/s, {stats['lines'] / best:,.0f} lines/s")
+            tracemalloc.start()
+            fb.export_gstr1(conn, out, first, last, fmt, args.chunk)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  peak Python memory {peak / 1024:.0f} KB (chunk {args.chunk} rows)")
+        conn.close()
+
+
+# ============ COUNTER API ============
+async def api_call(reader, writer, method, path, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        if key.lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def api_load(port, args, fb):
+    """Keep-alive clients issuing a lookup/price/save mix for args.seconds"""
+    import random
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    _, body = await api_call(reader, writer, 'GET', '/inventory?q=')
+    writer.close()
+    names = [item['name'] for item in body['items']]
+    histograms = {kind: fb.LatencyHistogram() for kind in ('lookup', 'price', 'save')}
+    errors = {}
+    deadline = time.perf_counter() + args.seconds
+
+    async def client(seed):
+        rnd = random.Random(seed)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            while time.perf_counter() < deadline:
+                cart = {'items': [{'name': name, 'quantity': rnd.randint(1, 3)}
+                                  for name in rnd.sample(names, min(len(names), rnd.randint(1, 4)))]}
+                pick = rnd.random()
+                if pick < args.save_share:
+                    kind, method, path = 'save', 'POST', '/bills'
+                    cart['payment_method'] = 'Cash'
+                elif pick < args.save_share + 0.35:
+                    kind, method, path = 'price', 'POST', '/cart/price'
+                else:
+                    kind, method, path, cart = 'lookup', 'GET', '/inventory?q=' + rnd.choice(names)[:2], None
+                began = time.perf_counter()
+                status, _ = await api_call(reader, writer, method, path, cart)
+                histograms[kind].record((time.perf_counter() - began) * 1e6)
+                if status != 200:
+                    errors[status] = errors.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    began = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(args.clients)))
+    return histograms, errors, time.perf_counter() - began
+
+
+def bench_api(args):
+    """Load test of the counter API server: requests/s and tail latency per endpoint"""
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = scratch_copy(args.db, workdir) if args.db else os.path.join(workdir, 'api.db')
+        conn = fb.open_database(path)
+        # plenty of stock so saves never run out during the run
+        conn.execute('UPDATE inventory SET stock = 1000000')
+        conn.commit()
+        bills_before = conn.execute('SELECT COUNT(*) FROM bills').fetchone()[0]
+        conn.close()
+        server = subprocess.Popen([sys.executable, APP, '--db', path, 'serve', '--port', '0'],
+                                  stdout=subprocess.PIPE, text=True)
+        try:
+            line = server.stdout.readline()
+            if 'http://' not in line:
+                sys.exit(f"server did not start: {line!r}")
+            port = int(line.rsplit(':', 1)[1])
+            histograms, errors, elapsed = asyncio.run(api_load(port, args, fb))
+        finally:
+            server.terminate()
+            server.wait()
+        conn = fb.open_database(path)
+        bills = conn.execute('SELECT COUNT(*) FROM bills').fetchone()[0] - bills_before
+        conn.close()
+
+    total = sum(h.count for h in histograms.values())
+    print(f"{args.clients} clients, {elapsed:.1f}s: {total} requests, {total / elapsed:,.0f} req/s, "
+          f"{bills} bills saved ({bills / elapsed:,.0f}/s)")
+    for kind, hist in histograms.items():
+        s = hist.summary()
+        print(f"  {kind:<6} n={s['count']:<7} p50={s['p50_ms']:.2f}ms p95={s['p95_ms']:.2f}ms "
+              f"p99={s['p99_ms']:.2f}ms p99.9={hist.percentile(99.9) / 1000.0:.2f}ms max={s['max_ms']:.2f}ms")
+    if errors:
+        print(f"  non-200 responses: {errors}")
+
+
+# ============ BRANCH SYNC ============
+def bench_sync(args):
+    """Delta export/apply size and time against the number of changes and the database size"""
+    import random
+    import shutil
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    rnd = random.Random(7)
+    print(f"{'history':>8} {'changes':>8} {'bytes':>9} {'save/bill':>10} {'export':>9} {'apply':>9}")
+    for history in (args.bills // 10, args.bills):
+        with tempfile.TemporaryDirectory() as workdir:
+            a_path, b_path = os.path.join(workdir, 'a.db'), os.path.join(workdir, 'b.db')
+            conn = synthetic_year(fb, a_path, history, 3, 0.1)
+            conn.execute('UPDATE inventory SET stock = 1000000')
+            conn.commit()
+            conn.close()
+            shutil.copy(a_path, b_path)
+            a, b = fb.open_database(a_path), fb.open_database(b_path)
+            fb.init_sync_node(a, 'A')
+            fb.init_sync_node(b, 'B')
+            names = [row[0] for row in a.execute('SELECT name FROM inventory')]
+            for n, changes in enumerate(args.changes):
+                cur = a.cursor()
+                began = time.perf_counter()
+                for _ in range(changes):
+                    lines = fb.cart_lines(cur, [{'name': name, 'quantity': rnd.randint(1, 5)}
+                                                for name in rnd.sample(names, 3)])
+                    fb.save_bill(cur, lines, fb.price_bill(lines, 0, 18), 'Cash')
+                    a.commit()
+                save_ms = (time.perf_counter() - began) * 1000.0 / changes
+                path = os.path.join(workdir, f'a_to_b_{n}.json')
+                exported = fb.export_changes(a, 'B', path)
+                applied = fb.apply_changes(b, path)
+                print(f"{history:>8} {changes:>8} {exported['bytes']:>9} {save_ms:>8.2f}ms "
+                      f"{exported['seconds'] * 1000:>7.1f}ms {applied['seconds'] * 1000:>7.1f}ms")
+            a.close()
+            b.close()
+
+
+# ============ BILL DELETE ============
+def delete_one_by_one(fb, cur, invoices):
+    """The per-bill loop the bill windows used before delete_saved_bills, for comparison"""
+    for invoice in invoices:
+        cur.execute('SELECT id FROM bills WHERE invoice_number = ?', (invoice,))
+        row = cur.fetchone()
+        if not row:
+            continue
+        bill_id = row[0]
+        cur.execute('SELECT item_name, quantity FROM bill_items WHERE bill_id = ?', (bill_id,))
+        for item_name, qty in cur.fetchall():
+            cur.execute('UPDATE inventory SET stock = stock + ? WHERE name = ?', (qty, item_name))
+        fb.sync_bill_credit(cur, bill_id, None, None, 0)
+        fb.rollup_bill(cur, bill_id, -1)
+        cur.execute('DELETE FROM bill_items WHERE bill_id = ?', (bill_id,))
+        cur.execute('DELETE FROM bills WHERE id = ?', (bill_id,))
+
+
+def bench_delete(args):
+    """Deleting hundreds of selected bills: per-bill loop against the set-based delete"""
+    import random
+    import shutil
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'delete.db')
+        conn = synthetic_year(fb, path, args.bills, args.lines, 0.1)
+        conn.execute('UPDATE inventory SET stock = 1000000')
+        cur = conn.cursor()
+        # every fifth bill on credit, so balances and the ledger are restored too
+        for bill_id, customer_id, total in conn.execute(
+                'SELECT id, customer_id, total_amount FROM bills WHERE id % 5 = 0').fetchall():
+            cur.execute("UPDATE bills SET payment_method = 'Credit' WHERE id = ?", (bill_id,))
+            fb.sync_bill_credit(cur, bill_id, customer_id, 'Credit', total)
+        conn.commit()
+        fb.rebuild_sales_rollup(conn)
+        invoices = [row[0] for row in conn.execute('SELECT invoice_number FROM bills')]
+        conn.close()
+
+        def state(conn):
+            return [conn.execute(sql).fetchall() for sql in (
+                'SELECT name, stock FROM inventory ORDER BY name',
+                'SELECT id, ROUND(balance, 4) FROM customers ORDER BY id',
+                'SELECT COUNT(*), COUNT(DISTINCT bill_id) FROM ledger',
+                'SELECT COUNT(*) FROM bill_items',
+                'SELECT day, item_name, quantity, ROUND(amount, 4) FROM sales_daily ORDER BY 1, 2',
+                'SELECT month, gst_rate, ROUND(taxable, 4), ROUND(tax, 4) FROM tax_monthly ORDER BY 1, 2')]
+
+        rnd = random.Random(7)
+        print(f"{'bills':>6} {'per-bill loop':>14} {'set-based':>10} {'speed-up':>9}")
+        for count in args.delete:
+            picked = rnd.sample(invoices, count)
+            timings, states = {}, {}
+            for name, delete in (('loop', lambda cur: delete_one_by_one(fb, cur, picked)),
+                                 ('set', lambda cur: fb.delete_saved_bills(cur, picked))):
+                samples = []
+                for run in range(args.runs):
+                    copy = os.path.join(workdir, f'{name}{run}.db')
+                    shutil.copy(path, copy)
+                    conn = fb.open_database(copy)
+                    began = time.perf_counter()
+                    delete(conn.cursor())
+                    conn.commit()
+                    samples.append(time.perf_counter() - began)
+                    states[name] = state(conn)
+                    conn.close()
+                    os.remove(copy)
+                timings[name] = min(samples)
+            assert states['loop'] == states['set'], "set-based delete left a different database"
+            print(f"{count:>6} {timings['loop'] * 1000:>12.1f}ms {timings['set'] * 1000:>8.1f}ms "
+                  f"{timings['loop'] / timings['set']:>8.1f}x")
+
+
+# ============ BARCODE SCAN ============
+def bench_scan(args):
+    """Keyboard-wedge scan bursts into the billing screen: scan-to-cart latency and lost scans (needs a display)"""
+    import random
+    import tkinter as tk
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    rnd = random.Random(7)
+    with tempfile.TemporaryDirectory() as workdir:
+        fb.DB_PATH = os.path.join(workdir, 'scan.db')
+        conn = fb.open_database(fb.DB_PATH)
+        conn.execute('UPDATE inventory SET stock = 1000000')
+        conn.executemany("INSERT INTO inventory (name, price, stock, category, barcode) VALUES (?, ?, 1000000, 'Other', ?)",
+                         [(f'Item {n:05d}', 10 + n % 500, f'890{n:010d}') for n in range(args.items)])
+        conn.commit()
+        conn.close()
+        try:
+            root = tk.Tk()
+        except tk.TclError:
+            sys.exit("the scan benchmark drives the real window; no display available")
+        app = fb.FertilizerBillingApp(root)
+        codes = sorted(app.barcode_index)
+        root.update()
+        app.scan_entry.focus_force()
+        root.update()
+
+        burst_ms, lost = [], 0
+        for _ in range(args.bursts):
+            picks = [rnd.choice(codes) for _ in range(args.burst)]
+            start = time.perf_counter()
+            # queue the whole burst first, the way a scanner outruns the event loop
+            for code in picks:
+                for ch in code:
+                    app.scan_entry.event_generate('<KeyPress>', keysym=ch, when='tail')
+                app.scan_entry.event_generate('<KeyPress>', keysym='Return', when='tail')
+            root.update()
+            burst_ms.append((time.perf_counter() - start) * 1000.0)
+            expected = {}
+            for code in picks:
+                name = app.barcode_index[code]
+                expected[name] = expected.get(name, 0) + 1
+            got = {item['name']: item['quantity'] for item in app.cart_items}
+            lost += sum(max(0, n - got.get(name, 0)) for name, n in expected.items())
+            app.cart_tree.delete(*app.cart_tree.get_children())
+            app.cart_items.clear()
+            app.update_bill_preview()
+        root.destroy()
+
+    s = app.scan_latency.summary()
+    print(f"{len(codes)} barcoded items, {args.bursts} bursts of {args.burst} scans")
+    print(f"scan-to-cart: n={s['count']} p50={s['p50_ms']:.2f}ms p95={s['p95_ms']:.2f}ms "
+          f"p99={s['p99_ms']:.2f}ms max={s['max_ms']:.2f}ms")
+    report(f"burst of {args.burst} -> cart and bill drawn", burst_ms)
+    print(f"scans lost: {lost}")
+
+
+# ============ PDF INVOICES ============
+def bench_pdf(args):
+    """PDF invoice rendering: one bill with and without the cached heading, then batch reprint pages/s"""
+    from datetime import datetime, timedelta
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'pdf.db')
+        conn = synthetic_year(fb, path, args.bills, args.lines, 0.1)
+        shop = fb.shop_settings(conn.cursor())
+        bill = next(fb.saved_bills(conn, 'main', [1]))
+        conn.close()
+
+        for label, clear in (("cold heading", True), ("cached heading", False)):
+            samples = []
+            for _ in range(args.runs * 100):
+                if clear:
+                    fb.pdf_heading_template.cache_clear()
+                began = time.perf_counter()
+                fb.invoice_pdf(shop, [bill])
+                samples.append((time.perf_counter() - began) * 1000.0)
+            print(f"one invoice, {label}: median {statistics.median(samples) * 1000:.0f}us")
+
+        start_at = (datetime.utcnow() - timedelta(days=400)).strftime('%Y-%m-%d %H:%M:%S')
+        end_at = (datetime.utcnow() + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"{'workers':>8} {'bills':>7} {'pages':>7} {'seconds':>8} {'pages/s':>9} {'KB/page':>8}")
+        for workers in args.workers:
+            best = None
+            for run in range(args.runs):
+                stats = fb.reprint_bills_pdf(path, os.path.join(workdir, f'out{workers}_{run}'),
+                                             start_at, end_at, workers, args.chunk)
+                if best is None or stats['seconds'] < best['seconds']:
+                    best = stats
+            print(f"{best['workers']:>8} {best['bills']:>7} {best['pages']:>7} {best['seconds']:>8.2f} "
+                  f"{best['pages'] / best['seconds']:>9,.0f} {best['bytes'] / best['pages'] / 1024:>8.2f}")
+
+
+# ============ ESC/POS RECEIPTS ============
+def bench_receipt(args):
+    """ESC/POS receipt build and write time on 58mm and 80mm rolls"""
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    with tempfile.TemporaryDirectory() as workdir:
+        conn = fb.open_database(os.path.join(workdir, 'receipt.db'))
+        shop = fb.shop_settings(conn.cursor())
+        stock = conn.execute('SELECT name, price, gst_rate, hsn FROM inventory').fetchall()
+        conn.close()
+        target = args.device or os.path.join(workdir, 'receipts.bin')
+        receipts = fb.ReceiptBuffer()
+        print(f"writing to {target}")
+        for lines in args.lines:
+            items = [{'name': name, 'quantity': n % 9 + 1, 'price': price, 'total': (n % 9 + 1) * price,
+                      'gst_rate': rate, 'hsn': hsn or ''}
+                     for n, (name, price, rate, hsn) in ((n, stock[n % len(stock)]) for n in range(lines))]
+            values = fb.price_bill(items, 5, 18)
+            bill = {'date': '01-04-2026 10:15:00', 'invoice': 'INV-20260401-0001', 'customer': 'Farmer',
+                    'payment': 'Cash'}
+            for width in fb.RECEIPT_WIDTHS:
+                built, layout, written = fb.LatencyHistogram(), fb.LatencyHistogram(), fb.LatencyHistogram()
+                for _ in range(args.runs):
+                    began = time.perf_counter()
+                    with receipts.build(shop, bill, items, values, width) as receipt:
+                        size = len(receipt)
+                        built.record((time.perf_counter() - began) * 1e6)
+                        written.record(fb.write_receipt(receipt, target) * 1e6)
+                    # the layout alone, to show what the encoding adds on top
+                    began = time.perf_counter()
+                    fb.bill_body(shop, bill, items, values, width)
+                    layout.record((time.perf_counter() - began) * 1e6)
+                print(f"{lines:>3} lines, {width} cols, {size} bytes: build p50={built.percentile(50)}us "
+                      f"p99={built.percentile(99)}us (layout alone {layout.percentile(50)}us), "
+                      f"write p50={written.percentile(50)}us p99={written.percentile(99)}us")
+
+
+# ============ CART DRAFTS ============
+def bench_draft(args):
+    """Cost of keeping the cart draft per change, by cart size, and of restoring it"""
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'draft.db')
+        fb.open_database(path).close()
+        for lines in args.lines:
+            drafts = fb.DraftLog(path)
+            drafts.start()
+            journal = fb.CartJournal(listener=drafts.log)
+            cart = []
+
+            def change(step):
+                journal.record(step)
+                return fb.apply_cart_edits(cart, fb.cart_step_edits(step))
+
+            for n in range(lines):
+                cart = change(('lines', True, [(n, {'name': f'Item {n}', 'quantity': 1, 'price': 100.0,
+                                                    'total': 100.0, 'gst_rate': 5, 'hsn': '3105'})]))
+            drafts.flush(60)
+            per_change = fb.LatencyHistogram()
+            middle = lines // 2
+            for n in range(args.changes):
+                began = time.perf_counter()
+                line = cart[middle]
+                cart = change(('set', middle, (line['quantity'], line['total']),
+                               (line['quantity'] + 1, (line['quantity'] + 1) * line['price'])))
+                per_change.record((time.perf_counter() - began) * 1e6)
+            began = time.perf_counter()
+            drafts.flush(60)
+            flushed = time.perf_counter() - began
+            drafts.close()
+
+            conn = fb.open_database(path)
+            _, records = fb.load_draft(conn.cursor())
+            conn.close()
+            began = time.perf_counter()
+            restored, _ = fb.replay_draft([], records)
+            replayed = time.perf_counter() - began
+            assert [l['quantity'] for l in restored] == [l['quantity'] for l in cart]
+            print(f"{lines:>5} lines: per change p50={per_change.percentile(50)}us "
+                  f"p99={per_change.percentile(99)}us, last batch committed in {flushed * 1000:.1f}ms, "
+                  f"restore of {len(records)} rows {replayed * 1000:.1f}ms")
+
+
+# ============ PRICE HISTORY ============
+def bench_prices(args):
+    """Price-at-time lookups by history size, and the margin report over a year of bills"""
+    import random
+    from datetime import date, datetime, timedelta
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    rnd = random.Random(7)
+    with tempfile.TemporaryDirectory() as workdir:
+        conn = synthetic_year(fb, os.path.join(workdir, 'prices.db'), args.bills, args.lines, 0.1)
+        cur = conn.cursor()
+        names = [row[0] for row in cur.execute('SELECT name FROM inventory')]
+        names += [f'Item {n:05d}' for n in range(args.items - len(names))]
+        start = datetime.utcnow() - timedelta(days=365)
+        step = timedelta(days=365) / args.changes
+        # a revision of every item each step back over the year, costs at 80-95% of price
+        rows = []
+        for name in names:
+            price = rnd.uniform(50, 2000)
+            for n in range(args.changes):
+                price *= rnd.uniform(0.97, 1.05)
+                rows.append((name, (start + step * n).strftime('%Y-%m-%d %H:%M:%S'), round(price, 2),
+                             round(price * rnd.uniform(0.8, 0.95), 2)))
+        cur.executemany('INSERT OR REPLACE INTO price_history (item_name, effective_from, price, cost)'
+                        ' VALUES (?, ?, ?, ?)', rows)
+        conn.commit()
+        print(f"{len(rows):,} history rows for {len(names):,} items")
+        plan = cur.execute('EXPLAIN QUERY PLAN ' + fb.PRICE_AT_SQL, (names[0], '')).fetchall()
+        print(f"  plan: {plan[0][-1]}")
+        lookups = fb.LatencyHistogram()
+        for _ in range(args.lookups):
+            at = (start + timedelta(seconds=rnd.uniform(0, 365 * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+            began = time.perf_counter()
+            fb.price_at(cur, rnd.choice(names), at)
+            lookups.record((time.perf_counter() - began) * 1e6)
+        print(f"  price_at: p50={lookups.percentile(50)}us p99={lookups.percentile(99)}us")
+
+        today = date.today()
+        bounds = fb.month_bounds(f"{today.year - 1:04d}-{today.month:02d}", f"{today.year:04d}-{today.month:02d}")
+        samples = []
+        for _ in range(args.runs):
+            began = time.perf_counter()
+            report_rows = fb.margin_report(conn, *bounds)
+            samples.append((time.perf_counter() - began) * 1000.0)
+        report(f"margin report, {args.bills:,} bills x {args.lines} lines", samples)
+        print(f"  {len(report_rows)} item-months, {sum(r[6] for r in report_rows)} units without a cost")
+        conn.close()
+
+
+# ============ BULK PRICE REVISION ============
+def bench_revise(args):
+    """Bulk repricing of whole catalogues, by category, name match and selection"""
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for items in args.items:
+            conn = fb.open_database(os.path.join(workdir, f'revise{items}.db'))
+            cur = conn.cursor()
+            cur.executemany('INSERT INTO inventory (name, price, stock, category, unit) VALUES (?, ?, ?, ?, ?)',
+                            [(f'Bulk {n:06d}', 100.0 + n % 500, 10, 'Bulk', 'kg') for n in range(items)])
+            conn.commit()
+            names = [f'Bulk {n:06d}' for n in range(items)]
+            for label, target in (('category', {'category': 'Bulk'}), ('name match', {'contains': 'Bulk'}),
+                                  ('selection', {'names': names})):
+                began = time.perf_counter()
+                rows = fb.preview_price_revision(cur, 'percent', 5, **target)
+                previewed = time.perf_counter() - began
+                samples = []
+                for run in range(args.runs):
+                    began = time.perf_counter()
+                    revised = fb.apply_price_revision(cur, 'percent', 1 if run % 2 else -1, **target)
+                    conn.commit()
+                    samples.append((time.perf_counter() - began) * 1000.0)
+                assert revised == len(rows) == items
+                report(f"{items:,} items by {label}", samples)
+                print(f"  preview {previewed * 1000:.0f}ms")
+            conn.close()
+
+
+# ============ STOCK LOTS ============
+def bench_lots(args):
+    """FEFO allocation per bill line by lots per item, and the expiring-soon report"""
+    import random
+    from datetime import date, timedelta
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    rnd = random.Random(7)
+    today = date.today()
+    with tempfile.TemporaryDirectory() as workdir:
+        for per_item in args.lots:
+            conn = fb.open_database(os.path.join(workdir, f'lots{per_item}.db'))
+            cur = conn.cursor()
+            cur.executemany('INSERT INTO inventory (name, price, stock, category, unit) VALUES (?, ?, 0, ?, ?)',
+                            [(f'Item {n:05d}', 100.0, 'Bulk', 'kg') for n in range(args.items)])
+            # lots expiring from a month ago to three years out, a tenth already past
+            for n in range(args.items):
+                for _ in range(per_item):
+                    expiry = (today + timedelta(days=rnd.randint(-30, 1100))).isoformat()
+                    fb.receive_stock(cur, f'Item {n:05d}', 1000, 'B', expiry)
+            conn.commit()
+            lines = fb.LatencyHistogram()
+            for bill_id in range(1, args.sales + 1):
+                began = time.perf_counter()
+                fb.take_from_lots(cur, f'Item {rnd.randrange(args.items):05d}', rnd.randint(1, 1500), bill_id)
+                lines.record((time.perf_counter() - began) * 1e6)
+            conn.commit()
+            samples = []
+            for _ in range(args.runs):
+                began = time.perf_counter()
+                rows = fb.expiring_lots(cur, 30)
+                samples.append((time.perf_counter() - began) * 1000.0)
+            print(f"{args.items * per_item:,} lots ({per_item} per item): "
+                  f"allocate p50={lines.percentile(50)}us p99={lines.percentile(99)}us")
+            report(f"  expiring within 30 days ({len(rows):,} lots)", samples)
+            conn.close()
+
+
+# ============ FIFO COSTING ============
+def bench_valuation(args):
+    """Stock valuation from the running totals against summing every item, and FIFO costing per bill line"""
+    import random
+    sys.path.insert(0, HERE)
+    import fertilizer_billing as fb
+
+    rnd = random.Random(11)
+    with tempfile.TemporaryDirectory() as workdir:
+        for items in args.items:
+            conn = fb.open_database(os.path.join(workdir, f'valuation{items}.db'))
+            cur = conn.cursor()
+            cur.executemany('INSERT INTO inventory (name, price, stock, category, unit, cost) VALUES (?, ?, 0, ?, ?, ?)',
+                            [(f'Item {n:06d}', 100.0, 'Bulk', 'kg', 80.0) for n in range(items)])
+            for _ in range(args.layers):
+                for n in range(items):
+                    fb.receive_stock(cur, f'Item {n:06d}', 100, unit_cost=rnd.uniform(60, 90))
+            cur.execute("INSERT INTO bills (invoice_number, subtotal, total_amount) VALUES ('BENCH', 0, 0)")
+            bill_id = cur.lastrowid
+            conn.commit()
+            scans = {'SUM over inventory': 'SELECT COUNT(*), SUM(stock), SUM(price * stock) FROM inventory',
+                     'SUM over cost layers': 'SELECT SUM(quantity * unit_cost) FROM cost_layers'}
+            for title, sql in scans.items():
+                samples = []
+                for _ in range(args.runs):
+                    began = time.perf_counter()
+                    cur.execute(sql).fetchone()
+                    samples.append((time.perf_counter() - began) * 1000.0)
+                report(f"{items:,} items: {title}", samples)
+            samples = []
+            for _ in range(args.runs):
+                began = time.perf_counter()
+                fb.stock_valuation(cur)
+                samples.append((time.perf_counter() - began) * 1000.0)
+            report(f"{items:,} items: stock_totals", samples)
+            lines = fb.LatencyHistogram()
+            for _ in range(args.sales):
+                began = time.perf_counter()
+                fb.consume_layers(cur, f'Item {rnd.randrange(items):06d}', rnd.randint(1, 150), bill_id)
+                lines.record((time.perf_counter() - began) * 1e6)
+            conn.commit()
+            print(f"  FIFO cost per line ({args.layers} layers per item): "
+                  f"p50={lines.percentile(50)}us p99={lines.percentile(99)}us")
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('startup', help=bench_startup.__doc__)
+    p.add_argument('--runs', type=int, default=5)
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser('forecast', help=bench_forecast.__doc__)
+    p.add_argument('--items', type=int, default=10000)
+    p.add_argument('--years', type=int, default=5)
+    p.add_argument('--density', type=float, default=0.2, help='fraction of item-days with a sale')
+    p.add_argument('--runs', type=int, default=5)
+    p.add_argument('--db', help='also time the full report against a copy of this database')
+    p.set_defaults(func=bench_forecast)
+
+    p = sub.add_parser('analytics', help=bench_analytics.__doc__)
+    p.add_argument('--db', required=True, help='database to measure (a temporary copy is used)')
+    p.add_argument('--days', type=int, default=365)
+    p.add_argument('--runs', type=int, default=5)
+    p.set_defaults(func=bench_analytics)
+
+    p = sub.add_parser('gstr1', help=bench_gstr1.__doc__)
+    p.add_argument('--bills', type=int, default=100000, help='bills in the synthetic year')
+    p.add_argument('--lines', type=int, default=3, help='items per bill')
+    p.add_argument('--b2b', type=float, default=0.1, help='share of customers with a GSTIN')
+    p.add_argument('--chunk', type=int, default=5000, help='rows fetched per round trip')
+    p.add_argument('--runs', type=int, default=3)
+    p.add_argument('--db', help='export from a copy of this database instead')
+    p.set_defaults(func=bench_gstr1)
+
+    p = sub.add_parser('api', help=bench_api.__doc__)
+    p.add_argument('--clients', type=int, default=16, help='concurrent keep-alive connections')
+    p.add_argument('--seconds', type=float, default=10)
+    p.add_argument('--save-share', type=float, default=0.15, help='fraction of requests that save a bill')
+    p.add_argument('--db', help='serve a copy of this database instead of a fresh one')
+    p.set_defaults(func=bench_api)
+
+    p = sub.add_parser('sync', help=bench_sync.__doc__)
+    p.add_argument('--bills', type=int, default=100000, help='bills already in the larger database')
+    p.add_argument('--changes', type=int, nargs='+', default=[100, 1000], help='new bills per delta')
+    p.set_defaults(func=bench_sync)
+
+    p = sub.add_parser('delete', help=bench_delete.__doc__)
+    p.add_argument('--bills', type=int, default=20000, help='bills in the synthetic year')
+    p.add_argument('--lines', type=int, default=3, help='items per bill')
+    p.add_argument('--delete', type=int, nargs='+', default=[100, 500, 2000], help='bills deleted at once')
+    p.add_argument('--runs', type=int, default=3)
+    p.set_defaults(func=bench_delete)
+
+    p = sub.add_parser('scan', help=bench_scan.__doc__)
+    p.add_argument('--items', type=int, default=5000, help='barcoded items added to the catalogue')
+    p.add_argument('--bursts', type=int, default=50)
+    p.add_argument('--burst', type=int, default=10, help='scans queued back to back')
+    p.set_defaults(func=bench_scan)
+
+    p = sub.add_parser('pdf', help=bench_pdf.__doc__)
+    p.add_argument('--bills', type=int, default=20000, help='bills in the synthetic year')
+    p.add_argument('--lines', type=int, default=3, help='items per bill')
+    p.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='process counts to compare')
+    p.add_argument('--chunk', type=int, default=200, help='bills per pool task')
+    p.add_argument('--runs', type=int, default=3)
+    p.set_defaults(func=bench_pdf)
+
+    p = sub.add_parser('receipt', help=bench_receipt.__doc__)
+    p.add_argument('--lines', type=int, nargs='+', default=[5, 60], help='items per receipt')
+    p.add_argument('--device', help='printer device to write to (default: a scratch file)')
+    p.add_argument('--runs', type=int, default=2000)
+    p.set_defaults(func=bench_receipt)
+
+    p = sub.add_parser('draft', help=bench_draft.__doc__)
+    p.add_argument('--lines', type=int, nargs='+', default=[10, 100, 1000], help='lines in the cart')
+    p.add_argument('--changes', type=int, default=5000, help='quantity changes timed per cart')
+    p.set_defaults(func=bench_draft)
+
+    p = sub.add_parser('prices', help=bench_prices.__doc__)
+    p.add_argument('--items', type=int, default=10000, help='items with a price history')
+    p.add_argument('--changes', type=int, default=52, help='price revisions per item over the year')
+    p.add_argument('--bills', type=int, default=20000, help='bills in the synthetic year')
+    p.add_argument('--lines', type=int, default=3, help='items per bill')
+    p.add_argument('--lookups', type=int, default=20000)
+    p.add_argument('--runs', type=int, default=3)
+    p.set_defaults(func=bench_prices)
+
+    p = sub.add_parser('revise', help=bench_revise.__doc__)
+    p.add_argument('--items', type=int, nargs='+', default=[1000, 10000], help='items in the catalogue')
+    p.add_argument('--runs', type=int, default=3)
+    p.set_defaults(func=bench_revise)
+
+    p = sub.add_parser('lots', help=bench_lots.__doc__)
+    p.add_argument('--items', type=int, default=1000)
+    p.add_argument('--lots', type=int, nargs='+', default=[1, 10, 100], help='lots per item')
+    p.add_argument('--sales', type=int, default=5000, help='bill lines allocated')
+    p.add_argument('--runs', type=int, default=5)
+    p.set_defaults(func=bench_lots)
+
+    p = sub.add_parser('valuation', help=bench_valuation.__doc__)
+    p.add_argument('--items', type=int, nargs='+', default=[10000, 100000], help='items in the catalogue')
+    p.add_argument('--layers', type=int, default=3, help='cost layers received per item')
+    p.add_argument('--sales', type=int, default=5000, help='bill lines costed')
+    p.add_argument('--runs', type=int, default=5)
+    p.set_defaults(func=bench_valuation)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,63 +1,364 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import sqlite3
 import os
+import sys
+import re
+import json
+import csv
+import time
+import functools
+import logging
+import logging.handlers
+import threading
+import queue
+import asyncio
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import parse_qs
 
-class FertilizerBillingApp:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("🌱 Fertilizer Shop Billing System")
-        self.root.geometry("1300x850")
-        self.root.configure(bg="#1a1a2e")
-        
-        # Initialize database
-        self.init_database()
-        
-        # Variables
-        self.cart_items = []
-        self.invoice_number = self.generate_invoice_number()
-        self.calculated_values = {
-            'subtotal': 0, 'discount_rate': 0, 'discount_amount': 0,
-            'tax_rate': 18, 'tax_amount': 0, 'total': 0
-        }
-        
-        # Colors
-        self.colors = {
-            'primary': '#4CAF50',
-            'secondary': '#2196F3',
-            'danger': '#f44336',
-            'warning': '#ff9800',
-            'dark': '#1a1a2e',
-            'light': '#eaeaea',
-            'card': '#16213e',
-            'text': '#ffffff',
-            'success': '#00c853',
-            'purple': '#9c27b0'
+# Taken at import for the startup benchmark; benchmarks.py also times from process spawn
+PROCESS_START = time.perf_counter()
+
+DB_PATH = 'fertilizer_shop.db'
+LATENCY_DUMP_PATH = 'latency_histograms.json'
+SLOW_QUERY_LOG_PATH = 'slow_queries.log'
+BG_POLL_MS = 50
+
+# Today's bills as a range on created_at so idx_bills_created_at is used
+TODAY_RANGE = "created_at >= DATE('now') AND created_at < DATE('now', '+1 day')"
+TODAY_TOTALS_SQL = f'SELECT COUNT(*), COALESCE(SUM(total_amount), 0) FROM bills WHERE {TODAY_RANGE}'
+
+
+# ============ INSTRUMENTATION ============
+# Opt-in: set FERTILIZER_INSTRUMENT=1 before launching to time UI handlers
+# and DB calls. When disabled nothing is wrapped, so the hot paths run untouched.
+class LatencyHistogram:
+    """Log-linear (HDR-style) histogram of latencies in microseconds.
+
+    Values below 128us get one bucket each; above that every power of two is
+    split into 64 linear sub-buckets, giving ~1.5% relative precision with a
+    fixed, small array regardless of how many samples are recorded.
+    """
+    SUB_BUCKET_BITS = 7
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    HALF = SUB_BUCKETS // 2
+    MAX_SHIFT = 40
+
+    def __init__(self):
+        self.counts = [0] * (self.SUB_BUCKETS + self.MAX_SHIFT * self.HALF)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        if value < self.SUB_BUCKETS:
+            return value
+        shift = min(value.bit_length() - self.SUB_BUCKET_BITS, self.MAX_SHIFT)
+        return self.SUB_BUCKETS + (shift - 1) * self.HALF + min((value >> shift) - self.HALF, self.HALF - 1)
+
+    def _value_at(self, index):
+        """Highest value that maps to the bucket (conservative for percentiles)"""
+        if index < self.SUB_BUCKETS:
+            return index
+        shift = (index - self.SUB_BUCKETS) // self.HALF + 1
+        sub = (index - self.SUB_BUCKETS) % self.HALF + self.HALF
+        return ((sub + 1) << shift) - 1
+
+    def record(self, micros):
+        micros = max(0, int(micros))
+        self.counts[self._index(micros)] += 1
+        self.count += 1
+        self.total += micros
+        if self.min is None or micros < self.min:
+            self.min = micros
+        if micros > self.max:
+            self.max = micros
+
+    def percentile(self, pct):
+        if not self.count:
+            return 0
+        target = max(1, int(round(self.count * pct / 100.0)))
+        running = 0
+        for index, n in enumerate(self.counts):
+            if n:
+                running += n
+                if running >= target:
+                    return min(self._value_at(index), self.max)
+        return self.max
+
+    def summary(self):
+        """Return a JSON-friendly summary in milliseconds"""
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count / 1000.0, 3) if self.count else 0,
+            'min_ms': round((self.min or 0) / 1000.0, 3),
+            'p50_ms': round(self.percentile(50) / 1000.0, 3),
+            'p95_ms': round(self.percentile(95) / 1000.0, 3),
+            'p99_ms': round(self.percentile(99) / 1000.0, 3),
+            'max_ms': round(self.max / 1000.0, 3),
         }
-        
-        # Create UI
-        self.create_header()
-        self.create_main_content()
-        self.create_footer()
-        
-        # Load inventory
-        self.load_inventory()
-        
-        # Shortcuts
-        self.root.bind('<Control-n>', lambda e: self.new_bill())
-        self.root.bind('<Control-s>', lambda e: self.save_bill_to_db())
-        self.root.bind('<F5>', lambda e: self.load_inventory())
-        # editing state for bills
-        self.editing_bill_id = None
-    
-    def init_database(self):
-        """Initialize SQLite database"""
-        self.conn = sqlite3.connect('fertilizer_shop.db')
-        self.cursor = self.conn.cursor()
-        
+
+
+@functools.lru_cache(maxsize=512)
+def normalize_sql(sql):
+    """Collapse whitespace and replace literals so equivalent statements group together"""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.split())
+
+
+class Instrumentation:
+    """Per-handler latency histograms for UI callbacks and DB calls"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+
+    def record(self, name, micros):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = LatencyHistogram()
+        hist.record(micros)
+
+    def wrap(self, name, fn):
+        """Return fn wrapped with a timer, or fn itself when disabled"""
+        if not self.enabled:
+            return fn
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(name, (time.perf_counter() - start) * 1e6)
+        return timed
+
+    def wrap_cursor(self, cursor):
+        return InstrumentedCursor(cursor, self) if self.enabled else cursor
+
+    def reset(self):
+        self.histograms.clear()
+
+    def summary(self):
+        return {name: hist.summary() for name, hist in sorted(self.histograms.items())}
+
+    def dump(self, path=LATENCY_DUMP_PATH):
+        if not self.enabled or not self.histograms:
+            return
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generated_at': datetime.now().isoformat(timespec='seconds'),
+                'handlers': self.summary(),
+            }, f, indent=2)
+
+
+class InstrumentedCursor:
+    """Thin proxy over sqlite3.Cursor that times execute and fetch calls.
+
+    Fetch time is charged to the statement that produced the rows, so a
+    SELECT's cost shows up under one key even when most work happens in
+    fetchall().
+    """
+
+    def __init__(self, cursor, instr):
+        self._cursor = cursor
+        self._instr = instr
+        self._last_key = 'db:?'
+
+    def _timed(self, key, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self._instr.record(key, (time.perf_counter() - start) * 1e6)
+
+    def execute(self, sql, params=()):
+        self._last_key = 'db:' + normalize_sql(sql)[:80]
+        self._timed(self._last_key, self._cursor.execute, sql, params)
+        return self
+
+    def executemany(self, sql, seq):
+        self._last_key = 'db:' + normalize_sql(sql)[:80]
+        self._timed(self._last_key, self._cursor.executemany, sql, seq)
+        return self
+
+    def fetchone(self):
+        return self._timed(self._last_key, self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._timed(self._last_key, self._cursor.fetchall)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._timed(self._last_key, self._cursor.fetchmany)
+        return self._timed(self._last_key, self._cursor.fetchmany, size)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        # lastrowid, rowcount, description, close ...
+        return getattr(self._cursor, name)
+
+
+class QueryProfiler:
+    """Slow-query log driven by sqlite3 trace and progress callbacks.
+
+    The trace callback marks the start of every statement the connection
+    runs (including implicit BEGIN/COMMIT); the progress handler fires every
+    `progress_steps` VM instructions and stamps the last moment the statement
+    was doing work. A statement's time is therefore start -> last tick, which
+    excludes the idle gap before the next statement, at a resolution of one
+    tick. Enable with FERTILIZER_QUERY_LOG=1.
+    """
+
+    def __init__(self, conn, log_path=SLOW_QUERY_LOG_PATH, slow_ms=50.0, progress_steps=100):
+        self.conn = conn
+        self.slow_ms = slow_ms
+        self.progress_steps = progress_steps
+        self.stats = {}
+        self._plans = {}
+        self._current = None
+        self._sample = None
+        self._started = 0.0
+        self._last_tick = 0.0
+        self._steps = 0
+        self._explaining = False
+
+        self.log = logging.getLogger('fertilizer_billing.queries')
+        self.log.setLevel(logging.INFO)
+        self.log.propagate = False
+        if not self.log.handlers:
+            handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=1024 * 1024,
+                                                           backupCount=3, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self.log.addHandler(handler)
+
+        conn.set_trace_callback(self._on_trace)
+        conn.set_progress_handler(self._on_progress, progress_steps)
+
+    def _on_trace(self, sql):
+        if self._explaining or sql.startswith('--'):
+            # our own EXPLAINs, or trigger sub-programs of the running statement
+            return
+        self._finish()
+        now = time.perf_counter()
+        self._current = normalize_sql(sql)
+        self._sample = sql
+        self._started = now
+        self._last_tick = now
+        self._steps = 0
+
+    def _on_progress(self):
+        self._last_tick = time.perf_counter()
+        self._steps += self.progress_steps
+        return 0
+
+    def _finish(self):
+        if self._current is None:
+            return
+        elapsed_ms = (self._last_tick - self._started) * 1000.0
+        st = self.stats.get(self._current)
+        if st is None:
+            st = self.stats[self._current] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                              'vm_steps': 0, 'sample': self._sample}
+        st['count'] += 1
+        st['total_ms'] += elapsed_ms
+        st['vm_steps'] += self._steps
+        if elapsed_ms > st['max_ms']:
+            st['max_ms'] = elapsed_ms
+        if elapsed_ms >= self.slow_ms:
+            self.log.info('SLOW %.1fms steps=%d %s', elapsed_ms, self._steps, self._sample)
+        self._current = None
+
+    def full_scan(self, statement):
+        """True if EXPLAIN QUERY PLAN for the statement shows a SCAN without an index"""
+        if statement in self._plans:
+            return self._plans[statement]
+        st = self.stats.get(statement)
+        flagged = False
+        if st and statement.split(' ', 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH'):
+            self._explaining = True
+            try:
+                plan = self.conn.execute('EXPLAIN QUERY PLAN ' + st['sample']).fetchall()
+                flagged = any(row[3].startswith('SCAN') and 'USING' not in row[3]
+                              and 'CONSTANT ROW' not in row[3] for row in plan)
+            except sqlite3.Error:
+                pass
+            finally:
+                self._explaining = False
+        self._plans[statement] = flagged
+        return flagged
+
+    def ranked(self, limit=None):
+        """Statements ordered by total time, heaviest first"""
+        self._finish()
+        rows = []
+        for statement, st in self.stats.items():
+            rows.append({
+                'statement': statement,
+                'count': st['count'],
+                'total_ms': round(st['total_ms'], 3),
+                'mean_ms': round(st['total_ms'] / st['count'], 3),
+                'max_ms': round(st['max_ms'], 3),
+                'vm_steps': st['vm_steps'],
+                'full_scan': self.full_scan(statement),
+            })
+        rows.sort(key=lambda r: (r['total_ms'], r['vm_steps']), reverse=True)
+        return rows[:limit] if limit else rows
+
+    def write_summary(self):
+        rows = self.ranked()
+        if not rows:
+            return
+        lines = ['Query summary (ranked by total time)',
+                 f"{'total_ms':>10} {'count':>7} {'mean_ms':>9} {'max_ms':>9} {'vm_steps':>10} scan statement"]
+        for r in rows:
+            lines.append(f"{r['total_ms']:>10.1f} {r['count']:>7} {r['mean_ms']:>9.3f} {r['max_ms']:>9.2f} "
+                         f"{r['vm_steps']:>10} {'SCAN' if r['full_scan'] else '    '} {r['statement']}")
+        self.log.info('\n'.join(lines))
+
+    def close(self):
+        self.write_summary()
+        self.conn.set_trace_callback(None)
+        self.conn.set_progress_handler(None, 0)
+
+
+# Handlers timed when instrumentation is enabled
+INSTRUMENTED_HANDLERS = (
+    'add_to_cart', 'add_custom_item', 'remove_from_cart', 'clear_cart',
+    'update_bill_preview', 'generate_bill', 'save_bill_to_db', 'save_and_print',
+    'new_bill', 'load_inventory', 'search_customer', 'scan_barcode', 'print_receipt',
+    'undo_cart', 'redo_cart',
+)
+
+
+# ============ DATABASE SCHEMA ============
+# Bump SCHEMA_VERSION and add an `if version < N:` step to migrate_schema
+# whenever a table, column or index is added.
+SCHEMA_VERSION = 19
+
+
+def ensure_schema(conn):
+    """Bring the database up to SCHEMA_VERSION; a single PRAGMA when already current"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version < SCHEMA_VERSION:
+        migrate_schema(conn, version)
+
+
+def migrate_schema(conn, version):
+    """Apply every migration step newer than `version`, then stamp user_version"""
+    cur = conn.cursor()
+    # steps that change what the rollups are built from ask for one rebuild at the end
+    rebuild_rollups = False
+    if version < 1:
         # Create tables
-        self.cursor.execute('''
+        cur.execute('''
             CREATE TABLE IF NOT EXISTS inventory (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT UNIQUE NOT NULL,
@@ -69,7 +370,7 @@ class FertilizerBillingApp:
             )
         ''')
         
-        self.cursor.execute('''
+        cur.execute('''
             CREATE TABLE IF NOT EXISTS customers (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT NOT NULL,
@@ -78,7 +379,7 @@ class FertilizerBillingApp:
             )
         ''')
         
-        self.cursor.execute('''
+        cur.execute('''
             CREATE TABLE IF NOT EXISTS bills (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 invoice_number TEXT UNIQUE NOT NULL,
@@ -94,7 +395,7 @@ class FertilizerBillingApp:
             )
         ''')
         
-        self.cursor.execute('''
+        cur.execute('''
             CREATE TABLE IF NOT EXISTS bill_items (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 bill_id INTEGER,
@@ -105,7 +406,7 @@ class FertilizerBillingApp:
             )
         ''')
         
-        self.cursor.execute('''
+        cur.execute('''
             CREATE TABLE IF NOT EXISTS settings (
                 id INTEGER PRIMARY KEY,
                 shop_name TEXT DEFAULT 'Fertilizer Shop',
@@ -119,25 +420,25 @@ class FertilizerBillingApp:
         ''')
         
         # Insert default settings
-        self.cursor.execute('SELECT COUNT(*) FROM settings')
-        if self.cursor.fetchone()[0] == 0:
-            self.cursor.execute('''
+        cur.execute('SELECT COUNT(*) FROM settings')
+        if cur.fetchone()[0] == 0:
+            cur.execute('''
                 INSERT INTO settings (id, shop_name, shop_address, shop_phone, default_tax, currency, gst_number, licence_number)
                 VALUES (1, 'Green Valley Fertilizers', '123 Farm Road, City', '+91 9876543210', 18.0, 'Rs.', '', '')
             ''')
 
         # Ensure settings table has gst_number and licence_number columns (migrate older DBs)
         try:
-            self.cursor.execute("PRAGMA table_info('settings')")
-            scols = [row[1] for row in self.cursor.fetchall()]
+            cur.execute("PRAGMA table_info('settings')")
+            scols = [row[1] for row in cur.fetchall()]
             if 'gst_number' not in scols:
                 try:
-                    self.cursor.execute("ALTER TABLE settings ADD COLUMN gst_number TEXT DEFAULT ''")
+                    cur.execute("ALTER TABLE settings ADD COLUMN gst_number TEXT DEFAULT ''")
                 except sqlite3.OperationalError:
                     pass
             if 'licence_number' not in scols:
                 try:
-                    self.cursor.execute("ALTER TABLE settings ADD COLUMN licence_number TEXT DEFAULT ''")
+                    cur.execute("ALTER TABLE settings ADD COLUMN licence_number TEXT DEFAULT ''")
                 except sqlite3.OperationalError:
                     pass
         except Exception:
@@ -145,11 +446,11 @@ class FertilizerBillingApp:
 
         # Ensure inventory table has 'description' column (migrate older DBs)
         try:
-            self.cursor.execute("PRAGMA table_info('inventory')")
-            cols = [row[1] for row in self.cursor.fetchall()]
+            cur.execute("PRAGMA table_info('inventory')")
+            cols = [row[1] for row in cur.fetchall()]
             if 'description' not in cols:
                 try:
-                    self.cursor.execute("ALTER TABLE inventory ADD COLUMN description TEXT")
+                    cur.execute("ALTER TABLE inventory ADD COLUMN description TEXT")
                 except sqlite3.OperationalError:
                     # If ALTER fails for any reason, ignore - insertion will fail later with clear error
                     pass
@@ -158,8 +459,8 @@ class FertilizerBillingApp:
             pass
         
         # Insert sample inventory if empty
-        self.cursor.execute('SELECT COUNT(*) FROM inventory')
-        if self.cursor.fetchone()[0] == 0:
+        cur.execute('SELECT COUNT(*) FROM inventory')
+        if cur.fetchone()[0] == 0:
             sample_items = [
                 ('Urea (46-0-0)', 350.00, 100, 'Nitrogen', 'kg', 'High nitrogen fertilizer'),
                 ('DAP (18-46-0)', 1350.00, 80, 'Phosphorus', 'kg', 'Diammonium phosphate'),
@@ -172,18 +473,3496 @@ class FertilizerBillingApp:
                 ('Neem Cake', 25.00, 100, 'Organic', 'kg', 'Natural pesticide'),
                 ('Calcium Nitrate', 65.00, 45, 'Calcium', 'kg', 'Calcium supplement'),
             ]
-            self.cursor.executemany('''
+            cur.executemany('''
                 INSERT INTO inventory (name, price, stock, category, unit, description)
                 VALUES (?, ?, ?, ?, ?, ?)
             ''', sample_items)
-        
-        self.conn.commit()
-    
+
+    if version < 2:
+        # Sargable date-range lookups (today's bills, invoice numbering, reports)
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_bills_created_at ON bills(created_at)')
+
+    if version < 3:
+        # Per-bill item lookups (edit, delete, archival) without scanning bill_items
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_bill_items_bill_id ON bill_items(bill_id)')
+        # Registry of fiscal years moved out to archive files
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS archives (
+                fiscal_year INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                start_at TEXT NOT NULL,
+                end_at TEXT NOT NULL,
+                bill_count INTEGER DEFAULT 0,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+    if version < 4:
+        # Bill search: equality filters that still return rows in created_at order
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_bills_customer ON bills(customer_id, created_at)')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_bills_payment ON bills(payment_method, created_at)')
+        # NOCASE so the case-insensitive LIKE 'prefix%' can seek the index
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_customers_name ON customers(name COLLATE NOCASE)')
+
+    if version < 5:
+        # Credit (udhaar) ledger; customers.balance is its running total
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL,
+                bill_id INTEGER,
+                kind TEXT NOT NULL,
+                amount REAL NOT NULL,
+                note TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (customer_id) REFERENCES customers (id)
+            )
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_ledger_customer ON ledger(customer_id, kind, created_at)')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_ledger_bill ON ledger(bill_id) WHERE bill_id IS NOT NULL')
+        if 'balance' not in table_columns(conn, 'customers'):
+            cur.execute('ALTER TABLE customers ADD COLUMN balance REAL NOT NULL DEFAULT 0')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_customers_owing ON customers(balance) WHERE balance > 0.005')
+        # Credit bills saved before the ledger existed open each customer's account
+        cur.execute('''
+            INSERT INTO ledger (customer_id, bill_id, kind, amount, created_at)
+            SELECT customer_id, id, 'sale', total_amount, created_at FROM bills
+            WHERE payment_method = 'Credit' AND customer_id IS NOT NULL
+              AND id NOT IN (SELECT bill_id FROM ledger WHERE bill_id IS NOT NULL)
+        ''')
+        cur.execute('''
+            UPDATE customers SET balance = COALESCE(
+                (SELECT SUM(amount) FROM ledger WHERE ledger.customer_id = customers.id), 0)
+        ''')
+
+    if version < 6:
+        # Per-item reorder levels replace the fixed low-stock limit of 20
+        if 'reorder_level' not in table_columns(conn, 'inventory'):
+            cur.execute(f'ALTER TABLE inventory ADD COLUMN reorder_level INTEGER NOT NULL DEFAULT {DEFAULT_REORDER_LEVEL}')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_inventory_low ON inventory(name) WHERE stock < reorder_level')
+
+    if version < 7:
+        # Per-day, per-item sales kept current by every bill write
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sales_daily (
+                day TEXT NOT NULL,
+                item_name TEXT NOT NULL,
+                category TEXT,
+                quantity REAL NOT NULL DEFAULT 0,
+                amount REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, item_name)
+            ) WITHOUT ROWID
+        ''')
+        rebuild_rollups = True
+
+    if version < 8:
+        # Per-item GST slab and HSN, snapshotted per bill line, with monthly tax totals
+        inventory_columns = table_columns(conn, 'inventory')
+        if 'gst_rate' not in inventory_columns:
+            cur.execute('ALTER TABLE inventory ADD COLUMN gst_rate REAL')
+        if 'hsn' not in inventory_columns:
+            cur.execute("ALTER TABLE inventory ADD COLUMN hsn TEXT DEFAULT ''")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS tax_monthly (
+                month TEXT NOT NULL,
+                gst_rate REAL NOT NULL,
+                taxable REAL NOT NULL DEFAULT 0,
+                tax REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (month, gst_rate)
+            ) WITHOUT ROWID
+        ''')
+        for schema in ['main'] + attach_archives(conn):
+            backfill_line_tax(conn, schema)
+        rebuild_rollups = True
+
+    if version < 9:
+        # Recipient GSTIN, so bills to registered dealers go out as B2B in GSTR-1
+        if 'gstin' not in table_columns(conn, 'customers'):
+            cur.execute("ALTER TABLE customers ADD COLUMN gstin TEXT DEFAULT ''")
+
+    if version < 10:
+        # Change capture for syncing branches; idle until `sync init` names this node
+        if 'origin' not in table_columns(conn, 'bills'):
+            cur.execute('ALTER TABLE bills ADD COLUMN origin TEXT')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sync_node (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                node TEXT NOT NULL,
+                seq INTEGER NOT NULL DEFAULT 0,
+                capture INTEGER NOT NULL DEFAULT 1
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS changelog (
+                origin TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                tbl TEXT NOT NULL,
+                key TEXT NOT NULL,
+                at TEXT NOT NULL,
+                PRIMARY KEY (origin, seq)
+            ) WITHOUT ROWID
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_changelog_key ON changelog(tbl, key, at, origin)')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sync_seen (
+                origin TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sync_peers (
+                peer TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                PRIMARY KEY (peer, origin)
+            ) WITHOUT ROWID
+        ''')
+        install_sync_triggers(conn)
+
+    if version < 11:
+        # Barcodes for the scanner; items without one stay NULL and out of the index
+        if 'barcode' not in table_columns(conn, 'inventory'):
+            cur.execute('ALTER TABLE inventory ADD COLUMN barcode TEXT')
+        cur.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_barcode
+            ON inventory(barcode) WHERE barcode IS NOT NULL
+        ''')
+        # the barcode travels with the rest of the item between branches
+        for name in ('inventory_upd', 'inventory_rekey'):
+            cur.execute(f'DROP TRIGGER IF EXISTS sync_{name}')
+        install_sync_triggers(conn)
+
+    if version < 12:
+        # Thermal receipt printer: device or file path, and characters per line
+        scols = table_columns(conn, 'settings')
+        if 'receipt_printer' not in scols:
+            cur.execute("ALTER TABLE settings ADD COLUMN receipt_printer TEXT DEFAULT ''")
+        if 'receipt_width' not in scols:
+            cur.execute('ALTER TABLE settings ADD COLUMN receipt_width INTEGER DEFAULT 48')
+
+    if version < 13:
+        # Crash-safe copy of the cart being billed, see CART DRAFTS
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS draft_cart (
+                seq INTEGER PRIMARY KEY,
+                record TEXT NOT NULL
+            )
+        ''')
+
+    if version < 14:
+        # Effective-dated prices and purchase costs, see PRICE HISTORY
+        if 'cost' not in table_columns(conn, 'inventory'):
+            cur.execute('ALTER TABLE inventory ADD COLUMN cost REAL')
+        if 'prices_applied_at' not in table_columns(conn, 'settings'):
+            cur.execute('ALTER TABLE settings ADD COLUMN prices_applied_at TEXT')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS price_history (
+                item_name TEXT NOT NULL,
+                effective_from TEXT NOT NULL,
+                price REAL NOT NULL,
+                cost REAL,
+                PRIMARY KEY (item_name, effective_from)
+            ) WITHOUT ROWID
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_price_history_from ON price_history(effective_from)')
+        # history starts with today's prices; older bills have no cost on record
+        cur.execute('''
+            INSERT OR IGNORE INTO price_history (item_name, effective_from, price, cost)
+            SELECT name, CURRENT_TIMESTAMP, price, cost FROM inventory
+        ''')
+        install_price_history_triggers(conn)
+
+    if version < 15:
+        # Lots with batch and expiry, and which lots each bill took; see STOCK LOTS
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS stock_lots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                item_name TEXT NOT NULL,
+                batch TEXT NOT NULL DEFAULT '',
+                expiry TEXT,
+                quantity INTEGER NOT NULL,
+                received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_lots_fefo ON stock_lots(item_name, {LOT_ORDER}, id)
+            WHERE quantity > 0
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_lots_expiry ON stock_lots(expiry)
+            WHERE quantity > 0 AND expiry IS NOT NULL
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS lot_allocations (
+                bill_id INTEGER NOT NULL,
+                lot_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                PRIMARY KEY (bill_id, lot_id)
+            ) WITHOUT ROWID
+        ''')
+        # stock already on hand becomes an opening lot, as does a new item's first stock
+        cur.execute('INSERT INTO stock_lots (item_name, quantity) SELECT name, stock FROM inventory WHERE stock > 0')
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS stock_lots_opening AFTER INSERT ON inventory WHEN NEW.stock > 0
+            BEGIN
+                INSERT INTO stock_lots (item_name, quantity) VALUES (NEW.name, NEW.stock);
+            END
+        ''')
+
+    if version < 16:
+        # FIFO cost layers and running valuation/COGS totals, see FIFO COSTING
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS cost_layers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                item_name TEXT NOT NULL,
+                unit_cost REAL,
+                quantity INTEGER NOT NULL,
+                received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_layers_fifo ON cost_layers(item_name, id) WHERE quantity > 0')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS cogs_entries (
+                bill_id INTEGER NOT NULL,
+                layer_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                PRIMARY KEY (bill_id, layer_id)
+            ) WITHOUT ROWID
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS cogs_monthly (
+                month TEXT PRIMARY KEY,
+                sales REAL NOT NULL DEFAULT 0,
+                cogs REAL NOT NULL DEFAULT 0,
+                uncosted INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS stock_totals (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                items INTEGER NOT NULL,
+                units INTEGER NOT NULL,
+                value REAL NOT NULL,
+                uncosted INTEGER NOT NULL
+            )
+        ''')
+        # stock on hand opens a layer at the item's current cost, as does a new
+        # item's first stock; a deleted item's stock is written off, its layers
+        # kept for the bills that used them
+        cur.execute('''
+            INSERT INTO cost_layers (item_name, unit_cost, quantity)
+            SELECT name, cost, stock FROM inventory WHERE stock > 0
+        ''')
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS cost_layers_opening AFTER INSERT ON inventory WHEN NEW.stock > 0
+            BEGIN
+                INSERT INTO cost_layers (item_name, unit_cost, quantity) VALUES (NEW.name, NEW.cost, NEW.stock);
+            END
+        ''')
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS cost_layers_item_gone AFTER DELETE ON inventory
+            BEGIN
+                UPDATE cost_layers SET quantity = 0 WHERE item_name = OLD.name AND quantity > 0;
+            END
+        ''')
+        rebuild_stock_totals(conn)
+        install_stock_totals_triggers(conn)
+
+    if version < 17:
+        # price history triggers that survive an outer upsert, see PRICE HISTORY
+        for name in ('ins', 'upd'):
+            cur.execute(f'DROP TRIGGER IF EXISTS price_history_{name}')
+        install_price_history_triggers(conn)
+
+    if version < 18:
+        # a deleted item's lots go with it, as its cost layers already do
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS stock_lots_item_gone AFTER DELETE ON inventory
+            BEGIN
+                UPDATE stock_lots SET quantity = 0 WHERE item_name = OLD.name AND quantity > 0;
+            END
+        ''')
+        cur.execute('UPDATE stock_lots SET quantity = 0 WHERE quantity > 0 AND item_name NOT IN (SELECT name FROM inventory)')
+
+    if version < 19:
+        # the sales of costed bills, so margins compare like with like, see FIFO COSTING
+        if 'sales' not in table_columns(conn, 'cogs_monthly'):
+            cur.execute('ALTER TABLE cogs_monthly ADD COLUMN sales REAL NOT NULL DEFAULT 0')
+        cur.execute('''
+            INSERT INTO cogs_monthly (month, sales)
+            SELECT strftime('%Y-%m', b.created_at, 'localtime'), SUM(IFNULL(bi.taxable, 0))
+            FROM bills b JOIN bill_items bi ON bi.bill_id = b.id
+            WHERE EXISTS (SELECT 1 FROM cogs_entries e WHERE e.bill_id = b.id)
+            GROUP BY 1
+            ON CONFLICT (month) DO UPDATE SET sales = excluded.sales
+        ''')
+
+    if rebuild_rollups:
+        rebuild_sales_rollup(conn)
+
+    cur.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.commit()
+
+
+def open_database(path=DB_PATH):
+    """Open a connection with the schema ensured, for tools running without the UI"""
+    conn = sqlite3.connect(path)
+    ensure_schema(conn)
+    return conn
+
+
+# ============ FISCAL YEAR ARCHIVES ============
+# Closed fiscal years (April-March) are moved out of the hot database into
+# archives/fy<YYYY>-<YY>.db. Reports ATTACH an archive only when the date range
+# asked for overlaps it, so day-to-day queries never touch old years.
+ARCHIVE_DIR = 'archives'
+ARCHIVE_CHUNK = 2000
+ARCHIVED_TABLES = ('bills', 'bill_items')
+
+
+def fiscal_year_of(when):
+    """Fiscal year (by its starting calendar year) that a local date falls in"""
+    return when.year if when.month >= 4 else when.year - 1
+
+
+def fiscal_year_bounds(fy):
+    """[start, end) of fiscal year `fy` as UTC timestamps comparable with bills.created_at"""
+    start = datetime(fy, 4, 1).astimezone(timezone.utc)
+    end = datetime(fy + 1, 4, 1).astimezone(timezone.utc)
+    return start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def archive_alias(fy):
+    return f'fy{fy}'
+
+
+def archive_path(fy, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f'fy{fy}-{(fy + 1) % 100:02d}.db')
+
+
+def attached_schemas(conn):
+    return {row[1] for row in conn.execute('PRAGMA database_list')}
+
+
+def table_columns(conn, table, schema='main'):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info('{table}')")]
+
+
+def archive_fiscal_year(conn, fy, archive_dir=ARCHIVE_DIR, chunk_size=ARCHIVE_CHUNK, progress=None):
+    """Move every bill of closed fiscal year `fy` (and its items) into its archive file.
+
+    Bills move in chunks of `chunk_size`. The live database runs in WAL mode,
+    where a commit spanning it and an attached file is not atomic as a whole,
+    so each chunk is committed to the archive first, checked there, and only
+    then deleted from main in a second commit. An interruption in between
+    leaves that chunk in both files until the command is re-run, which copies
+    it again and removes it from main. A year is entered in `archives` (and so
+    read by reports) only once its first run finishes; for a year archived
+    before, reports count such a chunk twice until then. Returns bills moved.
+    """
+    if fy >= fiscal_year_of(datetime.now()):
+        raise ValueError(f"FY {fy}-{(fy + 1) % 100:02d} is not closed yet")
+    start_at, end_at = fiscal_year_bounds(fy)
+    path = archive_path(fy, archive_dir)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    alias = archive_alias(fy)
+
+    conn.commit()
+    if alias not in attached_schemas(conn):
+        conn.execute('ATTACH DATABASE ? AS ' + alias, (path,))
+    try:
+        # Archive tables mirror the live DDL at the time of archiving
+        for table in ARCHIVED_TABLES:
+            ddl = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                               (table,)).fetchone()[0]
+            ddl = re.sub(r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?', f'CREATE TABLE IF NOT EXISTS {alias}.', ddl.strip())
+            conn.execute(ddl)
+        # ...and carry the live indexes, so searches and reports seek archives the same way
+        indexes = conn.execute(f'''SELECT sql FROM main.sqlite_master
+                                   WHERE type = 'index' AND sql IS NOT NULL
+                                   AND tbl_name IN ({', '.join('?' * len(ARCHIVED_TABLES))})''',
+                               ARCHIVED_TABLES).fetchall()
+        for (ddl,) in indexes:
+            conn.execute(re.sub(r'^CREATE (UNIQUE )?INDEX\s+(IF NOT EXISTS\s+)?',
+                                lambda m: f"CREATE {m.group(1) or ''}INDEX IF NOT EXISTS {alias}.", ddl.strip()))
+        copy_cols = {}
+        for table in ARCHIVED_TABLES:
+            archived = set(table_columns(conn, table, alias))
+            copy_cols[table] = ', '.join(c for c in table_columns(conn, table) if c in archived)
+
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_ids (id INTEGER PRIMARY KEY)')
+        moved = 0
+        while True:
+            conn.execute('DELETE FROM temp.archive_ids')
+            conn.execute('''
+                INSERT INTO temp.archive_ids (id)
+                SELECT id FROM main.bills WHERE created_at >= ? AND created_at < ?
+                ORDER BY created_at LIMIT ?
+            ''', (start_at, end_at, chunk_size))
+            n = conn.execute('SELECT COUNT(*) FROM temp.archive_ids').fetchone()[0]
+            if not n:
+                conn.commit()
+                break
+            conn.execute(f'''INSERT OR REPLACE INTO {alias}.bills ({copy_cols['bills']})
+                             SELECT {copy_cols['bills']} FROM main.bills
+                             WHERE id IN (SELECT id FROM temp.archive_ids)''')
+            conn.execute(f'''INSERT OR REPLACE INTO {alias}.bill_items ({copy_cols['bill_items']})
+                             SELECT {copy_cols['bill_items']} FROM main.bill_items
+                             WHERE bill_id IN (SELECT id FROM temp.archive_ids)''')
+            conn.commit()
+            copied = conn.execute(f'''
+                SELECT (SELECT COUNT(*) FROM {alias}.bills WHERE id IN (SELECT id FROM temp.archive_ids)),
+                       (SELECT COUNT(*) FROM {alias}.bill_items WHERE bill_id IN (SELECT id FROM temp.archive_ids)),
+                       (SELECT COUNT(*) FROM main.bill_items WHERE bill_id IN (SELECT id FROM temp.archive_ids))
+            ''').fetchone()
+            if copied[0] != n or copied[1] != copied[2]:
+                raise sqlite3.DatabaseError(f"{path} is missing bills just archived; nothing was deleted from main")
+            try:
+                # archiving is housekeeping on this branch, not a deletion to sync
+                set_capture(conn, False)
+                conn.execute('DELETE FROM main.bill_items WHERE bill_id IN (SELECT id FROM temp.archive_ids)')
+                # a closed year's bills are never edited again, so their stock stays sold
+                conn.execute('DELETE FROM main.lot_allocations WHERE bill_id IN (SELECT id FROM temp.archive_ids)')
+                conn.execute('DELETE FROM main.cogs_entries WHERE bill_id IN (SELECT id FROM temp.archive_ids)')
+                conn.execute('DELETE FROM main.bills WHERE id IN (SELECT id FROM temp.archive_ids)')
+                set_capture(conn, True)
+                conn.commit()
+            except BaseException:
+                # a later commit must not store capture switched off
+                conn.rollback()
+                raise
+            moved += n
+            if progress:
+                progress(moved)
+
+        total = conn.execute(f'SELECT COUNT(*) FROM {alias}.bills').fetchone()[0]
+        if total:
+            conn.execute('''
+                INSERT OR REPLACE INTO archives (fiscal_year, path, start_at, end_at, bill_count, archived_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (fy, os.path.abspath(path), start_at, end_at, total))
+            conn.commit()
+        return moved
+    finally:
+        conn.execute('DETACH DATABASE ' + alias)
+
+
+def archive_closed_years(conn, archive_dir=ARCHIVE_DIR, chunk_size=ARCHIVE_CHUNK):
+    """Archive every fiscal year before the current one; returns {fy: bills moved}"""
+    oldest = conn.execute('SELECT MIN(created_at) FROM bills').fetchone()[0]
+    if not oldest:
+        return {}
+    oldest_local = datetime.strptime(oldest[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).astimezone()
+    current = fiscal_year_of(datetime.now())
+    return {fy: archive_fiscal_year(conn, fy, archive_dir, chunk_size)
+            for fy in range(fiscal_year_of(oldest_local), current)}
+
+
+def attach_archives(conn, start_at=None, end_at=None):
+    """ATTACH the archives overlapping [start_at, end_at) and return their schema names.
+
+    None on either side means unbounded. Archives already attached are reused.
+    """
+    sql = 'SELECT fiscal_year, path FROM archives WHERE 1 = 1'
+    params = []
+    if start_at is not None:
+        sql += ' AND end_at > ?'
+        params.append(start_at)
+    if end_at is not None:
+        sql += ' AND start_at < ?'
+        params.append(end_at)
+    attached = attached_schemas(conn)
+    schemas = []
+    for fy, path in conn.execute(sql, params).fetchall():
+        alias = archive_alias(fy)
+        if alias not in attached:
+            if not os.path.exists(path):
+                continue
+            if conn.in_transaction:
+                conn.commit()
+            conn.execute('ATTACH DATABASE ? AS ' + alias, (path,))
+        schemas.append(alias)
+    return schemas
+
+
+def bills_union_sql(schemas, columns, where):
+    """UNION ALL of `SELECT columns FROM <schema>.bills WHERE where` across schemas"""
+    return ' UNION ALL '.join(f'SELECT {columns} FROM {schema}.bills WHERE {where}' for schema in schemas)
+
+
+def sales_summary(conn, start_at=None, end_at=None):
+    """(bill count, total amount) over [start_at, end_at), reading archived years only when needed"""
+    where, params = ['1 = 1'], []
+    if start_at is not None:
+        where.append('created_at >= ?')
+        params.append(start_at)
+    if end_at is not None:
+        where.append('created_at < ?')
+        params.append(end_at)
+    schemas = ['main'] + attach_archives(conn, start_at, end_at)
+    inner = bills_union_sql(schemas, 'COUNT(*) AS n, COALESCE(SUM(total_amount), 0) AS amount', ' AND '.join(where))
+    count, amount = conn.execute(f'SELECT SUM(n), COALESCE(SUM(amount), 0) FROM ({inner})',
+                                 params * len(schemas)).fetchone()
+    return count or 0, amount
+
+
+# ============ BACKUPS ============
+# Online backups through sqlite3's backup API: pages are copied a few at a time
+# with a short pause in between, so billing on the UI connection is never held
+# up behind a whole-file copy. Each copy is verified before it replaces the
+# `.partial` name, and only the newest BACKUP_KEEP files are kept.
+BACKUP_DIR = 'backups'
+BACKUP_KEEP = 10
+BACKUP_INTERVAL_MS = 60 * 60 * 1000
+BACKUP_PAGES_PER_STEP = 128
+BACKUP_STEP_PAUSE = 0.005
+BACKUP_MAX_RESTARTS = 3
+BACKUP_PREFIX = 'fertilizer_shop-'
+
+backup_log = logging.getLogger('fertilizer_billing.backup')
+
+
+class BackupRestarted(Exception):
+    """Raised from the backup progress callback when the source keeps changing"""
+
+
+def verify_backup(path):
+    """Raise sqlite3.DatabaseError unless PRAGMA integrity_check on the copy reports ok"""
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute('PRAGMA integrity_check').fetchall()
+        if result != [('ok',)]:
+            raise sqlite3.DatabaseError(f"integrity check failed for {path}: {result[:5]}")
+        conn.execute('SELECT COUNT(*) FROM bills').fetchone()
+    finally:
+        conn.close()
+
+
+def rotate_backups(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    """Delete all but the newest `keep` backups (at least 1); returns the removed paths"""
+    if keep < 1:
+        raise ValueError("keep at least 1 backup")
+    paths = [os.path.join(backup_dir, n) for n in os.listdir(backup_dir)
+             if n.startswith(BACKUP_PREFIX) and n.endswith('.db')]
+    paths.sort(key=lambda p: (os.path.getmtime(p), p))
+    removed = []
+    for path in paths[:-keep]:
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+
+def backup_database(conn, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP,
+                    pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_STEP_PAUSE):
+    """Copy the database behind `conn` into backup_dir, verify it, rotate; returns the new path"""
+    if keep < 1:
+        raise ValueError("keep at least 1 backup")
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    final = os.path.join(backup_dir, f"{BACKUP_PREFIX}{stamp}.db")
+    n = 1
+    while os.path.exists(final):
+        final = os.path.join(backup_dir, f"{BACKUP_PREFIX}{stamp}-{n}.db")
+        n += 1
+    partial = final + '.partial'
+
+    # A write through another connection makes SQLite restart the copy at the
+    # next step; under a steady stream of writes that could go on forever.
+    copied = {'pages': 0, 'restarts': 0}
+
+    def step(status, remaining, total):
+        if copied['pages'] and total - remaining <= copied['pages']:
+            copied['restarts'] += 1
+            if copied['restarts'] >= BACKUP_MAX_RESTARTS:
+                raise BackupRestarted()
+        copied['pages'] = total - remaining
+        if remaining:
+            time.sleep(pause)
+
+    start = time.perf_counter()
+    dst = sqlite3.connect(partial)
+    try:
+        try:
+            # step() makes the pause, after busy steps too, so backup itself need not
+            conn.backup(dst, pages=pages, progress=step, sleep=0)
+        except BackupRestarted:
+            # finish with one consistent single-step copy (a short read lock)
+            conn.backup(dst, pages=-1)
+    finally:
+        dst.close()
+    try:
+        verify_backup(partial)
+    except sqlite3.DatabaseError:
+        os.remove(partial)
+        raise
+    os.replace(partial, final)
+    rotate_backups(backup_dir, keep)
+    backup_log.info('backup %s written in %.2fs', final, time.perf_counter() - start)
+    return final
+
+
+# ============ BILL SEARCH ============
+# Keyset pagination over (created_at, id): each page continues strictly after
+# the last row shown, so page 500 costs the same index seek as page 1.
+BILL_PAGE_SIZE = 50
+
+
+def local_day_to_utc(text, next_day=False):
+    """'DD-MM-YYYY' (local) -> UTC timestamp string of that midnight, or of the next one"""
+    day = datetime.strptime(text.strip(), '%d-%m-%Y')
+    if next_day:
+        day += timedelta(days=1)
+    return day.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_bills(conn, filters, after=None, limit=BILL_PAGE_SIZE):
+    """One page of bills matching `filters`, newest first.
+
+    filters may hold: invoice (prefix), customer (phone, or name prefix),
+    date_from / date_to (UTC bounds, [from, to)), payment, min_amount,
+    max_amount. `after` is the (created_at, id) of the last row of the
+    previous page. Returns (rows, next_after); next_after is None on the last
+    page. Each row is (schema, id, invoice, created_at, customer, phone,
+    payment, total); schema is 'main' unless the bill lives in an archive.
+    """
+    where, params = ['1 = 1'], []
+    invoice = (filters.get('invoice') or '').strip()
+    if invoice:
+        # range instead of LIKE so the BINARY unique index on invoice_number is used
+        where.append('b.invoice_number >= ? AND b.invoice_number < ?')
+        params += [invoice, invoice[:-1] + chr(ord(invoice[-1]) + 1)]
+    customer = (filters.get('customer') or '').strip()
+    if customer:
+        if customer.lstrip('+').replace(' ', '').isdigit():
+            where.append('b.customer_id IN (SELECT id FROM main.customers WHERE phone = ?)')
+            params.append(customer)
+        else:
+            where.append("b.customer_id IN (SELECT id FROM main.customers WHERE name LIKE ? ESCAPE '\\')")
+            params.append(escape_like(customer) + '%')
+    if filters.get('date_from'):
+        where.append('b.created_at >= ?')
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        where.append('b.created_at < ?')
+        params.append(filters['date_to'])
+    if filters.get('payment'):
+        where.append('b.payment_method = ?')
+        params.append(filters['payment'])
+    if filters.get('min_amount') is not None:
+        where.append('b.total_amount >= ?')
+        params.append(filters['min_amount'])
+    if filters.get('max_amount') is not None:
+        where.append('b.total_amount <= ?')
+        params.append(filters['max_amount'])
+    if after:
+        where.append('(b.created_at, b.id) < (?, ?)')
+        params += list(after)
+
+    schemas = ['main'] + attach_archives(conn, filters.get('date_from'), filters.get('date_to'))
+    selects = [f'''
+        SELECT '{schema}' AS schema_name, b.id, b.invoice_number, b.created_at, c.name, c.phone,
+               b.payment_method, b.total_amount
+        FROM {schema}.bills b LEFT JOIN main.customers c ON c.id = b.customer_id
+        WHERE {' AND '.join(where)}
+        ORDER BY b.created_at DESC, b.id DESC LIMIT {limit + 1}''' for schema in schemas]
+    if len(selects) == 1:
+        sql = selects[0]
+    else:
+        # each archive contributes at most one page; merge and cut
+        sql = ('SELECT * FROM (' + ' UNION ALL '.join(f'SELECT * FROM ({q})' for q in selects)
+               + f') ORDER BY created_at DESC, id DESC LIMIT {limit + 1}')
+    rows = conn.execute(sql, params * len(schemas)).fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, (rows[-1][3], rows[-1][1])
+    return rows, None
+
+
+# ============ CUSTOMER CREDIT (UDHAAR) LEDGER ============
+# customers.balance is the running amount owed, adjusted in the same
+# transaction as every ledger write, so a lookup is a single primary-key read.
+# Ledger amounts are signed: credit sales add to the balance, payments subtract.
+def sync_bill_credit(cur, bill_id, customer_id, payment_method, total):
+    """Keep a bill's credit-sale ledger row and the customer balance in step with the bill.
+
+    Call inside the transaction that saves, edits or deletes the bill; pass
+    payment_method=None to drop the bill's credit entirely (bill deleted).
+    """
+    cur.execute("SELECT id, customer_id, amount FROM ledger WHERE bill_id = ? AND kind = 'sale'", (bill_id,))
+    old = cur.fetchone()
+    if old and payment_method == 'Credit' and (old[1], old[2]) == (customer_id, total):
+        return
+    if old:
+        cur.execute('UPDATE customers SET balance = balance - ? WHERE id = ?', (old[2], old[1]))
+        cur.execute('DELETE FROM ledger WHERE id = ?', (old[0],))
+    if payment_method == 'Credit' and customer_id and total:
+        cur.execute('''
+            INSERT INTO ledger (customer_id, bill_id, kind, amount, created_at)
+            VALUES (?, ?, 'sale', ?, COALESCE((SELECT created_at FROM bills WHERE id = ?), CURRENT_TIMESTAMP))
+        ''', (customer_id, bill_id, total, bill_id))
+        cur.execute('UPDATE customers SET balance = balance + ? WHERE id = ?', (total, customer_id))
+
+
+def record_payment(conn, customer_id, amount, note=''):
+    """Record a repayment and reduce the customer's balance; returns the new balance"""
+    if amount <= 0:
+        raise ValueError("Payment amount must be positive")
+    conn.execute("INSERT INTO ledger (customer_id, kind, amount, note) VALUES (?, 'payment', ?, ?)",
+                 (customer_id, -amount, note))
+    conn.execute('UPDATE customers SET balance = balance - ? WHERE id = ?', (amount, customer_id))
+    balance = conn.execute('SELECT balance FROM customers WHERE id = ?', (customer_id,)).fetchone()[0]
+    conn.commit()
+    return balance
+
+
+def customer_balance(conn, customer_id):
+    row = conn.execute('SELECT balance FROM customers WHERE id = ?', (customer_id,)).fetchone()
+    return row[0] if row else 0.0
+
+
+def customer_statement(conn, customer_id):
+    """Ledger rows oldest first with the running balance after each: (created_at, kind, invoice, note, amount, balance)"""
+    return conn.execute('''
+        SELECT l.created_at, l.kind, b.invoice_number, l.note, l.amount,
+               SUM(l.amount) OVER (ORDER BY l.created_at, l.id) AS running
+        FROM ledger l LEFT JOIN bills b ON b.id = l.bill_id
+        WHERE l.customer_id = ?
+        ORDER BY l.created_at, l.id
+    ''', (customer_id,)).fetchall()
+
+
+# Payments settle the oldest credit first, so what is still open is the newest
+# sales up to the balance. Walking each owing customer's sales newest-first with
+# a running window sum finds the open part of every sale in a single pass over
+# idx_ledger_customer; anything the sales cannot explain is aged 90+.
+AGING_SQL = '''
+    WITH sales AS (
+        SELECT c.id AS customer_id, c.name, c.phone, c.balance, l.amount,
+               julianday('now') - julianday(l.created_at) AS age,
+               SUM(l.amount) OVER (PARTITION BY l.customer_id
+                                   ORDER BY l.created_at DESC, l.id DESC) AS newer_total
+        FROM customers c JOIN ledger l ON l.customer_id = c.id AND l.kind = 'sale'
+        WHERE c.balance > 0.005
+    ), open AS (
+        SELECT customer_id, name, phone, balance, age,
+               MAX(0, MIN(amount, balance - (newer_total - amount))) AS open_amount
+        FROM sales
+    )
+    SELECT customer_id, name, phone, balance,
+           SUM(CASE WHEN age <= 30 THEN open_amount ELSE 0 END),
+           SUM(CASE WHEN age > 30 AND age <= 60 THEN open_amount ELSE 0 END),
+           SUM(CASE WHEN age > 60 AND age <= 90 THEN open_amount ELSE 0 END),
+           SUM(CASE WHEN age > 90 THEN open_amount ELSE 0 END) + balance - SUM(open_amount)
+    FROM open
+    GROUP BY customer_id
+    UNION ALL
+    SELECT id, name, phone, balance, 0, 0, 0, balance
+    FROM customers
+    WHERE balance > 0.005 AND NOT EXISTS (SELECT 1 FROM ledger WHERE customer_id = customers.id AND kind = 'sale')
+    ORDER BY 4 DESC
+'''
+
+
+def aging_report(conn):
+    """(customer_id, name, phone, balance, 0-30, 31-60, 61-90, 90+) for every customer who owes"""
+    return conn.execute(AGING_SQL).fetchall()
+
+
+# ============ STOCK ALERTS ============
+# Each item carries its own reorder_level. idx_inventory_low only holds rows
+# below their level, so counting or listing them never touches healthy stock,
+# and a temp trigger reports the moment any write crosses the line.
+DEFAULT_REORDER_LEVEL = 20
+LOW_STOCK_COUNT_SQL = 'SELECT COUNT(*) FROM inventory WHERE stock < reorder_level'
+
+
+def install_stock_alerts(conn, on_alert):
+    """Call on_alert(name, stock, reorder_level) whenever a write on `conn` takes an item below its level"""
+    conn.create_function('stock_alert', 3, on_alert)
+    # TEMP triggers live only on this connection, so worker connections never
+    # call into a function they have not registered
+    conn.execute('''
+        CREATE TEMP TRIGGER IF NOT EXISTS inventory_crossed_low
+        AFTER UPDATE OF stock, reorder_level ON main.inventory
+        WHEN OLD.stock >= OLD.reorder_level AND NEW.stock < NEW.reorder_level
+        BEGIN SELECT stock_alert(NEW.name, NEW.stock, NEW.reorder_level); END
+    ''')
+
+
+# ============ DEMAND FORECAST ============
+# Reorder planning from up to FORECAST_YEARS of daily sales per item. SQLite
+# only sums quantities per (item, day); everything after that is array maths
+# over the whole catalogue at once. NumPy is optional and imported only when a
+# forecast runs, so it never costs anything at startup.
+FORECAST_YEARS = 5
+FORECAST_LEAD_DAYS = 14
+FORECAST_TARGET_DAYS = 30
+# 0 = kharif (Jun-Oct), 1 = rabi (Nov-Mar), 2 = zaid (Apr-May), indexed by month
+SEASON_OF_MONTH = (None, 1, 1, 1, 2, 2, 0, 0, 0, 0, 0, 1, 1)
+SEASON_NAMES = ('Kharif', 'Rabi', 'Zaid')
+FORECAST_COLUMNS = ('Item', 'Category', 'Stock', 'Avg/day 30d', 'Avg/day 90d', 'Kharif/day',
+                    'Rabi/day', 'Forecast/day', 'Days of cover', 'Reorder qty')
+
+
+def load_daily_sales(conn, start_day):
+    """(inventory ids, day offsets from start_day, quantities) for every item-day with sales since start_day.
+
+    Custom lines and deleted items have no inventory row and are left out.
+    """
+    import numpy as np
+    # created_at is UTC, so days are counted from the UTC time of local midnight
+    start_at = local_day_to_utc(start_day.strftime('%d-%m-%Y'))
+    schemas = ['main'] + attach_archives(conn, start_at, None)
+    sql = ' UNION ALL '.join(f'''
+        SELECT inv.id, CAST(julianday(b.created_at) - julianday(?) AS INTEGER), SUM(bi.quantity)
+        FROM {schema}.bills b
+        JOIN {schema}.bill_items bi ON bi.bill_id = b.id
+        JOIN main.inventory inv ON inv.name = bi.item_name
+        WHERE b.created_at >= ?
+        GROUP BY 1, 2''' for schema in schemas)
+    data = np.array(conn.execute(sql, [start_at, start_at] * len(schemas)).fetchall(),
+                    dtype=np.float64).reshape(-1, 3)
+    return data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2]
+
+
+def forecast_demand(item_names, stock, sale_items, sale_days, sale_qty, start_day, today,
+                    lead_days=FORECAST_LEAD_DAYS, target_days=FORECAST_TARGET_DAYS):
+    """Per-item demand statistics as a dict of arrays aligned with item_names.
+
+    sale_items/sale_days/sale_qty are parallel arrays: index into item_names,
+    day offset from start_day, quantity sold. Forecast daily demand blends the
+    last 30 days with the per-day baseline of the season the next delivery
+    will be sold into; days of cover and reorder quantity follow from stock.
+    """
+    import numpy as np
+    n = len(item_names)
+    horizon = (today - start_day).days + 1
+    stock = np.asarray(stock, dtype=np.float64)
+    keep = (sale_days >= 0) & (sale_days < horizon)
+    items, days, qty = sale_items[keep], sale_days[keep], sale_qty[keep]
+
+    def window_mean(length):
+        recent = days >= horizon - length
+        return np.bincount(items[recent], weights=qty[recent], minlength=n) / min(length, horizon)
+
+    # season of every calendar day in the window, then per-item seasonal totals
+    calendar = np.datetime64(start_day, 'D') + np.arange(horizon)
+    months = calendar.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    day_season = np.array(SEASON_OF_MONTH[1:], dtype=np.int64)[months - 1]
+    season_days = np.maximum(np.bincount(day_season, minlength=3), 1)
+    seasonal = np.bincount(items * 3 + day_season[days], weights=qty,
+                           minlength=n * 3).reshape(n, 3) / season_days
+
+    ma30, ma90 = window_mean(30), window_mean(90)
+    upcoming = SEASON_OF_MONTH[(today + timedelta(days=lead_days)).month]
+    forecast = 0.5 * ma30 + 0.5 * seasonal[:, upcoming]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cover = np.where(forecast > 0, stock / forecast, np.inf)
+    reorder = np.ceil(np.maximum(forecast * (lead_days + target_days) - stock, 0))
+    return {'ma30': ma30, 'ma90': ma90, 'kharif': seasonal[:, 0], 'rabi': seasonal[:, 1],
+            'forecast': forecast, 'cover': cover, 'reorder': reorder, 'upcoming': SEASON_NAMES[upcoming]}
+
+
+def reorder_suggestions(conn, today=None, years=FORECAST_YEARS, lead_days=FORECAST_LEAD_DAYS,
+                        target_days=FORECAST_TARGET_DAYS, include_all=False):
+    """Rows shaped like FORECAST_COLUMNS, most urgent (fewest days of cover) first.
+
+    Only items with a reorder quantity are returned unless include_all is set.
+    Raises ImportError when NumPy is not installed.
+    """
+    import numpy as np
+    today = today or datetime.now().date()
+    start_day = today - timedelta(days=365 * years + years // 4)
+    inventory = conn.execute('SELECT id, name, category, stock FROM inventory ORDER BY name').fetchall()
+    if not inventory:
+        return []
+    ids = np.array([r[0] for r in inventory], dtype=np.int64)
+    position = np.full(ids.max() + 1, -1, dtype=np.int64)
+    position[ids] = np.arange(len(ids))
+    sold_ids, days, qty = load_daily_sales(conn, start_day)
+    items = position[np.minimum(sold_ids, ids.max())]
+    known = (items >= 0) & (sold_ids <= ids.max())
+    names = [r[1] for r in inventory]
+    stats = forecast_demand(names, [r[3] or 0 for r in inventory], items[known], days[known], qty[known],
+                            start_day, today, lead_days, target_days)
+
+    order = np.lexsort((-stats['forecast'], stats['cover']))
+    if not include_all:
+        order = order[stats['reorder'][order] > 0]
+    return [(names[i], inventory[i][2] or '', inventory[i][3] or 0,
+             round(float(stats['ma30'][i]), 2), round(float(stats['ma90'][i]), 2),
+             round(float(stats['kharif'][i]), 2), round(float(stats['rabi'][i]), 2),
+             round(float(stats['forecast'][i]), 2),
+             None if np.isinf(stats['cover'][i]) else round(float(stats['cover'][i]), 1),
+             int(stats['reorder'][i]))
+            for i in order]
+
+
+def export_reorder_csv(rows, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(FORECAST_COLUMNS)
+        writer.writerows(rows)
+
+
+# ============ GST ============
+# Items carry their own GST slab and HSN code; an item without a slab is taxed
+# at the bill's GST % (custom items, or stock not yet classified). The bill
+# discount is spread over every line before tax. Intra-state supply, so each
+# slab's tax is split equally into CGST and SGST.
+GST_SLABS = ('0', '5', '12', '18', '28')
+
+
+def parse_gst_rate(text):
+    """'' -> None (tax at the bill's GST %), otherwise the slab as a float"""
+    text = str(text).strip().rstrip('%')
+    return float(text) if text else None
+
+
+def gst_breakdown(lines, discount_rate, default_rate):
+    """Tax each cart line at its own slab in a single pass.
+
+    Sets 'line_rate', 'taxable' and 'tax' on every line (what save_bill_to_db
+    snapshots into bill_items) and returns (slabs, taxable, tax) where slabs
+    is [(rate, taxable, cgst, sgst)] in rate order.
+    """
+    keep = 1 - discount_rate / 100
+    slabs = {}
+    for item in lines:
+        rate = item.get('gst_rate')
+        if rate is None:
+            rate = default_rate
+        taxable = item['total'] * keep
+        tax = taxable * rate / 100
+        item['line_rate'], item['taxable'], item['tax'] = rate, taxable, tax
+        slab = slabs.setdefault(rate, [0.0, 0.0])
+        slab[0] += taxable
+        slab[1] += tax
+    rows = []
+    for rate in sorted(slabs):
+        taxable, tax = slabs[rate]
+        half = round(tax / 2, 2)
+        rows.append((rate, taxable, half, half))
+    return rows, sum(r[1] for r in rows), sum(r[2] + r[3] for r in rows)
+
+
+def monthly_tax(conn, since_month=None):
+    """(month 'YYYY-MM', slab, taxable, cgst, sgst) from the tax_monthly rollup, newest month first"""
+    return conn.execute('''
+        SELECT month, gst_rate, taxable, tax / 2, tax / 2 FROM tax_monthly
+        WHERE month >= ? AND (taxable != 0 OR tax != 0)
+        ORDER BY month DESC, gst_rate
+    ''', (since_month or '',)).fetchall()
+
+
+def backfill_line_tax(conn, schema='main'):
+    """Give bill_items rows saved before per-line GST their rate, taxable value and tax from the bill"""
+    columns = table_columns(conn, 'bill_items', schema)
+    for column, decl in (('gst_rate', 'REAL'), ('hsn', "TEXT DEFAULT ''"), ('taxable', 'REAL'), ('tax', 'REAL')):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {schema}.bill_items ADD COLUMN {column} {decl}')
+    conn.execute(f'''
+        UPDATE {schema}.bill_items SET
+            gst_rate = (SELECT COALESCE(b.tax_rate, 0) FROM {schema}.bills b WHERE b.id = bill_items.bill_id),
+            taxable = total * (1 - COALESCE((SELECT b.discount_rate FROM {schema}.bills b
+                                             WHERE b.id = bill_items.bill_id), 0) / 100.0)
+        WHERE taxable IS NULL
+    ''')
+    conn.execute(f'UPDATE {schema}.bill_items SET tax = taxable * gst_rate / 100.0 WHERE tax IS NULL')
+
+
+# ============ GSTR-1 EXPORT ============
+# Month-end GST return data in the GSTR-1 layout: B2B invoices per recipient
+# GSTIN, B2C (small) totals per slab and the HSN-wise summary. Bill lines are
+# pulled from one ordered cursor GSTR1_CHUNK rows at a time and folded in as
+# they arrive; only the current bill and the per-slab/per-HSN totals are held,
+# so memory stays flat however long the period.
+GSTR1_CHUNK = 5000
+UQC_OF_UNIT = {'kg': 'KGS', 'g': 'GMS', 'L': 'LTR', 'mL': 'MLT', 'piece': 'PCS', 'bag': 'BAGS'}
+GSTR1_B2B_COLUMNS = ('GSTIN/UIN of Recipient', 'Receiver Name', 'Invoice Number', 'Invoice date',
+                     'Invoice Value', 'Place Of Supply', 'Reverse Charge', 'Invoice Type', 'Rate',
+                     'Taxable Value', 'Cess Amount')
+GSTR1_B2CS_COLUMNS = ('Type', 'Place Of Supply', 'Rate', 'Taxable Value', 'Cess Amount')
+GSTR1_HSN_COLUMNS = ('HSN', 'Description', 'UQC', 'Total Quantity', 'Total Value', 'Taxable Value',
+                     'Integrated Tax Amount', 'Central Tax Amount', 'State/UT Tax Amount', 'Cess Amount')
+
+
+def month_bounds(first_month, last_month=None):
+    """('YYYY-MM', 'YYYY-MM') local months, inclusive -> UTC [start_at, end_at)"""
+    year, month = map(int, first_month.split('-'))
+    end_year, end_month = map(int, (last_month or first_month).split('-'))
+    end_year, end_month = (end_year + 1, 1) if end_month == 12 else (end_year, end_month + 1)
+    return (local_day_to_utc(f'01-{month:02d}-{year:04d}'),
+            local_day_to_utc(f'01-{end_month:02d}-{end_year:04d}'))
+
+
+def gstr1_invoices(conn, start_at, end_at, chunk=GSTR1_CHUNK, stats=None):
+    """Yield one dict per bill in [start_at, end_at), unregistered customers first, then by GSTIN.
+
+    Each dict has invoice, date (DD-MM-YYYY), value, gstin, customer and
+    lines [(item, hsn, unit, quantity, value, rate, taxable, tax)]. `stats`,
+    if given, counts the 'lines' read.
+    """
+    schemas = ['main'] + attach_archives(conn, start_at, end_at)
+    selects = [f'''
+        SELECT COALESCE(c.gstin, '') AS gstin, b.created_at, b.id AS bill_id, b.invoice_number,
+               strftime('%d-%m-%Y', b.created_at, 'localtime'), b.total_amount, c.name,
+               bi.item_name, bi.hsn, inv.unit, bi.quantity, bi.total, bi.gst_rate, bi.taxable, bi.tax
+        FROM {schema}.bills b
+        JOIN {schema}.bill_items bi ON bi.bill_id = b.id
+        LEFT JOIN main.customers c ON c.id = b.customer_id
+        LEFT JOIN main.inventory inv ON inv.name = bi.item_name
+        WHERE b.created_at >= ? AND b.created_at < ?''' for schema in schemas]
+    cursor = conn.execute(' UNION ALL '.join(selects) + ' ORDER BY gstin, created_at, bill_id',
+                          [start_at, end_at] * len(schemas))
+    current = None
+    while True:
+        rows = cursor.fetchmany(chunk)
+        if not rows:
+            break
+        if stats is not None:
+            stats['lines'] = stats.get('lines', 0) + len(rows)
+        for gstin, _, bill_id, invoice, date, value, customer, *line in rows:
+            if current is None or current['bill_id'] != bill_id:
+                if current is not None:
+                    yield current
+                current = {'bill_id': bill_id, 'invoice': invoice, 'date': date, 'value': value or 0,
+                           'gstin': gstin, 'customer': customer or '', 'lines': []}
+            current['lines'].append(tuple(line))
+    if current is not None:
+        yield current
+
+
+def gstr1_fold(invoice, b2cs, hsn):
+    """Add a bill's lines to the B2C (unregistered only) and HSN totals; returns its {rate: [taxable, tax]}"""
+    slabs = {}
+    for item, code, unit, quantity, _, rate, taxable, tax in invoice['lines']:
+        rate, taxable, tax = rate or 0, taxable or 0, tax or 0
+        slab = slabs.setdefault(rate, [0.0, 0.0])
+        slab[0] += taxable
+        slab[1] += tax
+        # lines without an HSN code stay separate per item so the gaps are easy to spot
+        key = (code, rate, '') if code else ('', rate, item)
+        entry = hsn.get(key)
+        if entry is None:
+            entry = hsn[key] = {'desc': item, 'uqc': UQC_OF_UNIT.get(unit, 'OTH'),
+                                'qty': 0.0, 'val': 0.0, 'txval': 0.0, 'tax': 0.0}
+        entry['qty'] += quantity or 0
+        # invoice value after the bill discount, as txval is
+        entry['val'] += taxable + tax
+        entry['txval'] += taxable
+        entry['tax'] += tax
+    if not invoice['gstin']:
+        for rate, (taxable, tax) in slabs.items():
+            total = b2cs.setdefault(rate, [0.0, 0.0])
+            total[0] += taxable
+            total[1] += tax
+    return slabs
+
+
+def _money(value):
+    return round(value, 2)
+
+
+def write_gstr1_json(conn, start_at, end_at, path, shop_gstin, period, chunk=GSTR1_CHUNK):
+    """Stream the GSTR-1 JSON for [start_at, end_at) into `path`; returns counts"""
+    pos = shop_gstin[:2]
+    b2cs, hsn, stats = {}, {}, {'invoices': 0, 'b2b': 0}
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"gstin": %s, "fp": %s, "b2b": [' % (json.dumps(shop_gstin), json.dumps(period)))
+        ctin = None
+        for invoice in gstr1_invoices(conn, start_at, end_at, chunk, stats):
+            stats['invoices'] += 1
+            slabs = gstr1_fold(invoice, b2cs, hsn)
+            if not invoice['gstin']:
+                continue
+            stats['b2b'] += 1
+            if invoice['gstin'] != ctin:
+                f.write(('' if ctin is None else ']}, ') + '{"ctin": %s, "inv": [' % json.dumps(invoice['gstin']))
+            else:
+                f.write(', ')
+            ctin = invoice['gstin']
+            json.dump({'inum': invoice['invoice'], 'idt': invoice['date'], 'val': _money(invoice['value']),
+                       'pos': pos, 'rchrg': 'N', 'inv_typ': 'R',
+                       'itms': [{'num': n, 'itm_det': {'rt': rate, 'txval': _money(taxable),
+                                                       'camt': _money(tax / 2), 'samt': _money(tax / 2),
+                                                       'csamt': 0}}
+                                for n, (rate, (taxable, tax)) in enumerate(sorted(slabs.items()), 1)]}, f)
+        f.write(']}' if ctin is not None else '')
+        f.write('], "b2cs": ')
+        json.dump([{'sply_ty': 'INTRA', 'pos': pos, 'typ': 'OE', 'rt': rate, 'txval': _money(taxable),
+                    'camt': _money(tax / 2), 'samt': _money(tax / 2), 'csamt': 0}
+                   for rate, (taxable, tax) in sorted(b2cs.items())], f)
+        f.write(', "hsn": {"data": ')
+        json.dump([{'num': n, 'hsn_sc': code, 'desc': e['desc'], 'uqc': e['uqc'], 'qty': e['qty'],
+                    'val': _money(e['val']), 'txval': _money(e['txval']), 'iamt': 0,
+                    'camt': _money(e['tax'] / 2), 'samt': _money(e['tax'] / 2), 'csamt': 0, 'rt': rate}
+                   for n, ((code, rate, _), e) in enumerate(sorted(hsn.items()), 1)], f)
+        f.write('}}')
+    return stats
+
+
+def write_gstr1_csv(conn, start_at, end_at, out_dir, shop_gstin, chunk=GSTR1_CHUNK):
+    """Stream b2b.csv, then write b2cs.csv and hsn.csv for [start_at, end_at) into out_dir; returns counts"""
+    pos = shop_gstin[:2]
+    b2cs, hsn, stats = {}, {}, {'invoices': 0, 'b2b': 0}
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'b2b.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(GSTR1_B2B_COLUMNS)
+        for invoice in gstr1_invoices(conn, start_at, end_at, chunk, stats):
+            stats['invoices'] += 1
+            slabs = gstr1_fold(invoice, b2cs, hsn)
+            if not invoice['gstin']:
+                continue
+            stats['b2b'] += 1
+            for rate, (taxable, tax) in sorted(slabs.items()):
+                writer.writerow((invoice['gstin'], invoice['customer'], invoice['invoice'], invoice['date'],
+                                 _money(invoice['value']), pos, 'N', 'Regular', rate, _money(taxable), 0))
+    with open(os.path.join(out_dir, 'b2cs.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(GSTR1_B2CS_COLUMNS)
+        for rate, (taxable, tax) in sorted(b2cs.items()):
+            writer.writerow(('OE', pos, rate, _money(taxable), 0))
+    with open(os.path.join(out_dir, 'hsn.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(GSTR1_HSN_COLUMNS)
+        for (code, rate, _), e in sorted(hsn.items()):
+            writer.writerow((code, e['desc'], e['uqc'], e['qty'], _money(e['val']), _money(e['txval']),
+                             0, _money(e['tax'] / 2), _money(e['tax'] / 2), 0))
+    return stats
+
+
+def export_gstr1(conn, out, first_month, last_month=None, fmt='json', chunk=GSTR1_CHUNK):
+    """GSTR-1 for the local months first_month..last_month ('YYYY-MM') as a JSON file or a CSV folder.
+
+    Returns the counts with 'seconds' added. The shop GSTIN comes from settings.
+    """
+    row = conn.execute('SELECT gst_number FROM settings WHERE id = 1').fetchone()
+    shop_gstin = ((row and row[0]) or '').strip().upper()
+    if len(shop_gstin) != 15:
+        raise ValueError("Set the shop's 15 character GST number in Settings first")
+    start_at, end_at = month_bounds(first_month, last_month)
+    began = time.perf_counter()
+    if fmt == 'csv':
+        stats = write_gstr1_csv(conn, start_at, end_at, out, shop_gstin, chunk)
+    else:
+        year, month = (last_month or first_month).split('-')
+        stats = write_gstr1_json(conn, start_at, end_at, out, shop_gstin, month + year, chunk)
+    stats['seconds'] = time.perf_counter() - began
+    return stats
+
+
+# ============ SALES ROLLUP ============
+# sales_daily holds quantity and line value per (local day, item), and
+# tax_monthly taxable value and GST per (local month, slab). Both are updated
+# in the same transaction as every bill save, edit and delete, so analytics
+# and tax totals read a few rows per day or month instead of re-aggregating
+# bill_items. They stay in the live file when years are archived.
+SALES_ROLLUP_UPSERT = '''
+    INSERT INTO sales_daily (day, item_name, category, quantity, amount)
+    SELECT DATE(b.created_at, 'localtime'), bi.item_name, COALESCE(inv.category, 'Other'),
+           ? * SUM(bi.quantity), ? * SUM(bi.total)
+    FROM {schema}.bills b
+    JOIN {schema}.bill_items bi ON bi.bill_id = b.id
+    LEFT JOIN main.inventory inv ON inv.name = bi.item_name
+    WHERE {where}
+    GROUP BY 1, 2
+    ON CONFLICT (day, item_name) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        amount = amount + excluded.amount,
+        category = excluded.category
+'''
+TAX_ROLLUP_UPSERT = '''
+    INSERT INTO tax_monthly (month, gst_rate, taxable, tax)
+    SELECT strftime('%Y-%m', b.created_at, 'localtime'), COALESCE(bi.gst_rate, 0),
+           ? * SUM(bi.taxable), ? * SUM(bi.tax)
+    FROM {schema}.bills b
+    JOIN {schema}.bill_items bi ON bi.bill_id = b.id
+    WHERE {where}
+    GROUP BY 1, 2
+    ON CONFLICT (month, gst_rate) DO UPDATE SET
+        taxable = taxable + excluded.taxable,
+        tax = tax + excluded.tax
+'''
+ROLLUPS = (('sales_daily', SALES_ROLLUP_UPSERT), ('tax_monthly', TAX_ROLLUP_UPSERT))
+ROLLUP_BILL_SQL = [upsert.format(schema='main', where='b.id = ?') for _, upsert in ROLLUPS]
+ROLLUP_DELETE_SQL = [upsert.format(schema='main', where='b.id IN (SELECT id FROM temp.doomed_bills)')
+                     for _, upsert in ROLLUPS]
+# one bill's day/month, with the amounts given rather than summed from its lines
+SALES_ROLLUP_DELTA = '''
+    INSERT INTO sales_daily (day, item_name, category, quantity, amount)
+    SELECT DATE(b.created_at, 'localtime'), ?,
+           COALESCE((SELECT category FROM inventory WHERE name = ?), 'Other'), ?, ?
+    FROM bills b
+    WHERE b.id = ?
+    ON CONFLICT (day, item_name) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        amount = amount + excluded.amount,
+        category = excluded.category
+'''
+TAX_ROLLUP_DELTA = '''
+    INSERT INTO tax_monthly (month, gst_rate, taxable, tax)
+    SELECT strftime('%Y-%m', b.created_at, 'localtime'), ?, ?, ?
+    FROM bills b
+    WHERE b.id = ?
+    ON CONFLICT (month, gst_rate) DO UPDATE SET
+        taxable = taxable + excluded.taxable,
+        tax = tax + excluded.tax
+'''
+
+
+def rollup_bill(cur, bill_id, sign):
+    """Add (sign=1) or take back (sign=-1) a bill's lines in the rollups; call inside the bill's transaction"""
+    for sql in ROLLUP_BILL_SQL:
+        cur.execute(sql, (sign, sign, bill_id))
+
+
+def rollup_line_changes(cur, bill_id, changes):
+    """Move the rollups by edited lines only; changes is [(sign, bill_items row)], -1 for a line as it was.
+
+    Rows are (item_name, quantity, price, total, gst_rate, hsn, taxable, tax).
+    The bill keeps its created_at, so its day and month do not move.
+    """
+    sales, slabs = {}, {}
+    for sign, (name, quantity, _, total, rate, _, taxable, tax) in changes:
+        entry = sales.setdefault(name, [0, 0.0])
+        entry[0] += sign * quantity
+        entry[1] += sign * total
+        entry = slabs.setdefault(rate or 0, [0.0, 0.0])
+        entry[0] += sign * (taxable or 0)
+        entry[1] += sign * (tax or 0)
+    for name, (quantity, amount) in sales.items():
+        if quantity or amount:
+            cur.execute(SALES_ROLLUP_DELTA, (name, name, quantity, amount, bill_id))
+    for rate, (taxable, tax) in slabs.items():
+        if taxable or tax:
+            cur.execute(TAX_ROLLUP_DELTA, (rate, taxable, tax, bill_id))
+
+
+def rebuild_sales_rollup(conn):
+    """Recompute sales_daily and tax_monthly from every bill, archived years included"""
+    schemas = ['main'] + attach_archives(conn)
+    for table, upsert in ROLLUPS:
+        conn.execute(f'DELETE FROM {table}')
+        for schema in schemas:
+            conn.execute(upsert.format(schema=schema, where='1 = 1'), (1, 1))
+    conn.commit()
+
+
+def percent_change(current, previous):
+    return None if not previous else (current - previous) * 100.0 / previous
+
+
+def item_sales(conn, start_day, end_day, limit=None):
+    """Per-item sales over local days [start_day, end_day), best first.
+
+    Rows are (item, category, quantity, amount, previous_amount) where the
+    previous period is the same number of days immediately before start_day.
+    """
+    prev_start = start_day - (end_day - start_day)
+    sql = '''
+        SELECT item_name, MAX(category),
+               SUM(CASE WHEN day >= ? THEN quantity ELSE 0 END),
+               SUM(CASE WHEN day >= ? THEN amount ELSE 0 END) AS current,
+               SUM(CASE WHEN day < ? THEN amount ELSE 0 END)
+        FROM sales_daily
+        WHERE day >= ? AND day < ?
+        GROUP BY item_name
+        HAVING current != 0
+        ORDER BY current DESC
+    '''
+    params = [start_day.isoformat()] * 3 + [prev_start.isoformat(), end_day.isoformat()]
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def category_sales(conn, start_day, end_day):
+    """(category, amount, previous_amount) over local days [start_day, end_day), largest first"""
+    prev_start = start_day - (end_day - start_day)
+    return conn.execute('''
+        SELECT category,
+               SUM(CASE WHEN day >= ? THEN amount ELSE 0 END) AS current,
+               SUM(CASE WHEN day < ? THEN amount ELSE 0 END)
+        FROM sales_daily
+        WHERE day >= ? AND day < ?
+        GROUP BY category
+        ORDER BY current DESC
+    ''', (start_day.isoformat(), start_day.isoformat(), prev_start.isoformat(), end_day.isoformat())).fetchall()
+
+
+# ============ PRICE HISTORY ============
+# inventory.price and inventory.cost are the figures in effect now; every change
+# is also kept in price_history under the time it takes effect, so the price or
+# cost on any past day is one seek of its primary key. Triggers note changes
+# made straight on inventory (edit window, sync); schedule_price records one
+# dated ahead or back, and apply_due_prices brings the cached columns up to
+# whatever has since come into effect. Times are UTC 'YYYY-MM-DD HH:MM:SS', as
+# in bills.created_at, so a bill line finds the cost it was sold against.
+PRICE_AT_SQL = '''
+    SELECT price, cost FROM price_history
+    WHERE item_name = ? AND effective_from <= ?
+    ORDER BY effective_from DESC LIMIT 1
+'''
+MARGIN_COLUMNS = ('Month', 'Item', 'Quantity', 'Sales', 'Cost', 'Margin', 'Uncosted Qty')
+# the price/cost in effect now for each item_name row of {items}
+CURRENT_PRICES_SQL = '''
+    SELECT ph.price, ph.cost, ph.item_name
+    FROM ({items}) AS due
+    JOIN price_history ph ON ph.item_name = due.item_name
+     AND ph.effective_from = (SELECT MAX(effective_from) FROM price_history
+                              WHERE item_name = due.item_name AND effective_from <= CURRENT_TIMESTAMP)
+'''
+
+
+def install_price_history_triggers(conn):
+    """Record price/cost changes made on inventory, unless history already has them in effect"""
+    for name, event in (('ins', 'INSERT'), ('upd', 'UPDATE OF name, price, cost')):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS price_history_{name} AFTER {event} ON inventory
+            WHEN NOT EXISTS (
+                SELECT 1 FROM (SELECT price, cost FROM price_history
+                               WHERE item_name = NEW.name AND effective_from <= CURRENT_TIMESTAMP
+                               ORDER BY effective_from DESC LIMIT 1)
+                WHERE price = NEW.price AND cost IS NEW.cost)
+            BEGIN
+                -- an upsert, not OR REPLACE: an outer statement's conflict
+                -- clause (sync applies items with one) would override that
+                INSERT INTO price_history (item_name, effective_from, price, cost)
+                VALUES (NEW.name, CURRENT_TIMESTAMP, NEW.price, NEW.cost)
+                ON CONFLICT (item_name, effective_from) DO UPDATE SET price = excluded.price, cost = excluded.cost;
+            END
+        ''')
+
+
+def price_at(cur, item_name, at=None):
+    """(price, cost) of an item at UTC time `at` (default now), or None before its history starts"""
+    cur.execute(PRICE_AT_SQL, (item_name, at or datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')))
+    return cur.fetchone()
+
+
+def schedule_price(cur, item_name, price, cost=None, effective_from=None):
+    """Record a price/cost taking effect at UTC `effective_from` (default now), without committing.
+
+    A later date waits in the history until apply_due_prices finds it due;
+    an earlier one corrects the past and becomes current unless a newer
+    change is already in effect.
+    """
+    cur.execute('''
+        INSERT OR REPLACE INTO price_history (item_name, effective_from, price, cost)
+        VALUES (?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?)
+    ''', (item_name, effective_from, price, cost))
+    apply_due_prices(cur, item_name)
+
+
+def apply_due_prices(cur, item_name=None):
+    """Copy the price/cost now in effect onto inventory for items whose history changed; returns items updated.
+
+    settings.prices_applied_at marks how far history has been applied, so
+    when nothing has come due this is a single seek of idx_price_history_from.
+    Nothing at all is written, the mark included, unless some item's price
+    or cost changes, so a caller need only commit on a nonzero return.
+    """
+    if item_name is not None:
+        return refresh_prices(cur, 'SELECT ? AS item_name', (item_name,))
+    cur.execute("SELECT COALESCE(prices_applied_at, ''), CURRENT_TIMESTAMP FROM settings WHERE id = 1")
+    since, now = cur.fetchone()
+    cur.execute('SELECT 1 FROM price_history WHERE effective_from > ? AND effective_from <= ? LIMIT 1', (since, now))
+    if cur.fetchone() is None:
+        return 0
+    due = 'SELECT DISTINCT item_name FROM price_history WHERE effective_from > ? AND effective_from <= ?'
+    # a plain read first: an UPDATE that matches nothing still opens a write transaction
+    cur.execute(f'''
+        SELECT 1 FROM inventory JOIN ({CURRENT_PRICES_SQL.format(items=due)}) AS h ON h.item_name = inventory.name
+        WHERE inventory.price IS NOT h.price OR inventory.cost IS NOT h.cost
+        LIMIT 1
+    ''', (since, now))
+    if cur.fetchone() is None:
+        return 0
+    updated = refresh_prices(cur, due, (since, now))
+    cur.execute('UPDATE settings SET prices_applied_at = ? WHERE id = 1', (now,))
+    return updated
+
+
+def refresh_prices(cur, items_sql, params=()):
+    """Bring inventory price/cost up to date for the item_name rows items_sql selects; returns items changed"""
+    cur.execute(f'''
+        UPDATE inventory SET price = h.price, cost = h.cost
+        FROM ({CURRENT_PRICES_SQL.format(items=items_sql)}) AS h
+        WHERE inventory.name = h.item_name AND (inventory.price IS NOT h.price OR inventory.cost IS NOT h.cost)
+    ''', params)
+    return cur.rowcount
+
+
+def price_history_rows(cur, item_name):
+    """(effective_from local 'DD-MM-YYYY HH:MM', price, cost) for an item, newest first"""
+    cur.execute('''
+        SELECT strftime('%d-%m-%Y %H:%M', effective_from, 'localtime'), price, cost
+        FROM price_history WHERE item_name = ? ORDER BY effective_from DESC
+    ''', (item_name,))
+    return cur.fetchall()
+
+
+def margin_report(conn, start_at, end_at):
+    """Margins per local month and item for bills in UTC [start_at, end_at), as MARGIN_COLUMNS rows.
+
+    Sales are the lines' taxable values (after the bill discount, before GST);
+    each line is costed at the cost in effect when its bill was made. Lines
+    with no cost on record count only towards Uncosted Qty and Sales.
+    """
+    schemas = ['main'] + attach_archives(conn, start_at, end_at)
+    lines = ' UNION ALL '.join(f'''
+        SELECT strftime('%Y-%m', b.created_at, 'localtime') AS month, bi.item_name, bi.quantity,
+               COALESCE(bi.taxable, bi.total) AS sales,
+               -- as TEXT: created_at's TIMESTAMP affinity would keep the seek to item_name alone
+               (SELECT h.cost FROM main.price_history h
+                WHERE h.item_name = bi.item_name AND h.effective_from <= CAST(b.created_at AS TEXT)
+                ORDER BY h.effective_from DESC LIMIT 1) AS unit_cost
+        FROM {schema}.bills b
+        JOIN {schema}.bill_items bi ON bi.bill_id = b.id
+        WHERE b.created_at >= ? AND b.created_at < ?''' for schema in schemas)
+    return conn.execute(f'''
+        SELECT month, item_name, SUM(quantity), ROUND(SUM(sales), 2),
+               ROUND(SUM(quantity * unit_cost), 2),
+               ROUND(SUM(CASE WHEN unit_cost IS NOT NULL THEN sales - quantity * unit_cost END), 2),
+               SUM(CASE WHEN unit_cost IS NULL THEN quantity ELSE 0 END)
+        FROM ({lines})
+        GROUP BY month, item_name
+        ORDER BY month, item_name
+    ''', [start_at, end_at] * len(schemas)).fetchall()
+
+
+def export_margins_csv(rows, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(MARGIN_COLUMNS)
+        writer.writerows(rows)
+
+
+# ============ BULK PRICE REVISION ============
+# Repricing many items at once, e.g. when subsidy rates change. A revision is a
+# rule (raise/lower by a percentage or an amount, or set a fixed price) over a
+# target (a category, names containing some text, or chosen items). Preview and
+# apply share one WHERE clause, and applying is a single INSERT ... SELECT into
+# price_history plus one UPDATE of the targeted rows, in the caller's
+# transaction.
+PRICE_RULES = {
+    'percent': 'ROUND(price * (100 + :value) / 100.0, 2)',
+    'amount': 'ROUND(price + :value, 2)',
+    'set': 'ROUND(:value, 2)',
+}
+
+
+class PriceRevisionError(ValueError):
+    """A revision that cannot be applied as entered; the message is meant for the user"""
+
+
+def revision_target(cur, category=None, contains=None, names=None):
+    """WHERE clause (named parameters) on inventory for one kind of target.
+
+    Chosen names are loaded into temp.revision_items so any number of them
+    costs one indexed IN.
+    """
+    if names is not None:
+        cur.execute('CREATE TEMP TABLE IF NOT EXISTS revision_items (name TEXT PRIMARY KEY)')
+        cur.execute('DELETE FROM temp.revision_items')
+        cur.executemany('INSERT OR IGNORE INTO temp.revision_items (name) VALUES (?)', ((n,) for n in names))
+        return 'name IN (SELECT name FROM temp.revision_items)', {}
+    if category is not None:
+        return 'category = :category', {'category': category}
+    if contains:
+        return "name LIKE :contains ESCAPE '\\'", {'contains': f'%{escape_like(contains)}%'}
+    raise PriceRevisionError("Choose a category, a name to match or some items")
+
+
+def _revision_sql(rule, value):
+    if rule not in PRICE_RULES:
+        raise PriceRevisionError(f"Unknown rule: {rule}")
+    if rule == 'set' and value <= 0:
+        raise PriceRevisionError("Price must be greater than 0!")
+    return PRICE_RULES[rule]
+
+
+def preview_price_revision(cur, rule, value, **target):
+    """(name, category, price, new price) for every item the revision would touch, by name"""
+    new_price = _revision_sql(rule, value)
+    where, params = revision_target(cur, **target)
+    cur.execute(f'SELECT name, category, price, {new_price} FROM inventory WHERE {where} ORDER BY name',
+                {**params, 'value': value})
+    return cur.fetchall()
+
+
+def apply_price_revision(cur, rule, value, effective_from=None, **target):
+    """Reprice the target in one set-based pass without committing; returns the items revised.
+
+    Each new price goes into price_history at UTC effective_from (default
+    now), costs unchanged; inventory.price follows at once unless the date is
+    still ahead, in which case apply_due_prices picks it up when due.
+    """
+    new_price = _revision_sql(rule, value)
+    where, params = revision_target(cur, **target)
+    params.update(value=value, at=effective_from)
+    cur.execute(f'SELECT COUNT(*) FROM inventory WHERE {where} AND {new_price} <= 0', params)
+    below = cur.fetchone()[0]
+    if below:
+        raise PriceRevisionError(f"{below} items would be priced at 0 or less")
+    cur.execute(f'''
+        INSERT OR REPLACE INTO price_history (item_name, effective_from, price, cost)
+        SELECT name, COALESCE(:at, CURRENT_TIMESTAMP), {new_price}, cost FROM inventory WHERE {where}
+    ''', params)
+    revised = cur.rowcount
+    refresh_prices(cur, f'SELECT name AS item_name FROM inventory WHERE {where}', params)
+    return revised
+
+
+# ============ STOCK LOTS ============
+# Stock is held in lots (batch, expiry, quantity left) and inventory.stock stays
+# the item's total. Bills take units first-expiry-first-out, reaching for
+# expired lots only once the unexpired ones run out, and lot_allocations
+# remembers which lots each bill drew on so an edit or delete puts the units
+# back where they came from. idx_lots_fefo keeps every item's lots with stock
+# in expiry order (no expiry last), so allocating reads only the lots it takes
+# from; idx_lots_expiry answers the expiring-soon report as one range. Expiry
+# dates are local 'YYYY-MM-DD'. Stock from before lots existed is one opening
+# lot per item; units sold beyond the lots on record are left unallocated, and
+# units a bill gives back without an allocation (sold before lots were kept, or
+# beyond them) come back as a new lot with no batch or expiry.
+NO_EXPIRY = '9999-12-31'
+LOT_ORDER = f"IFNULL(expiry, '{NO_EXPIRY}')"
+LOT_FETCH = 8
+EXPIRY_WARN_DAYS = 30
+EXPIRING_COLUMNS = ('Item', 'Batch', 'Expiry', 'Quantity', 'Days Left')
+
+
+def parse_expiry(text):
+    """'DD-MM-YYYY' -> 'YYYY-MM-DD', None when blank; raises ValueError otherwise"""
+    text = (text or '').strip()
+    return datetime.strptime(text, '%d-%m-%Y').strftime('%Y-%m-%d') if text else None
+
+
+def add_lot(cur, item_name, quantity, batch='', expiry=None):
+    """Record a lot of an item; inventory.stock is left to the caller"""
+    cur.execute('INSERT INTO stock_lots (item_name, batch, expiry, quantity) VALUES (?, ?, ?, ?)',
+                (item_name, batch or '', expiry, quantity))
+    return cur.lastrowid
+
+
+def receive_stock(cur, item_name, quantity, batch='', expiry=None, unit_cost=None):
+    """Add units as a new lot and cost layer and to inventory.stock, without committing.
+
+    unit_cost is what was paid per unit; by default the item's current cost.
+    """
+    add_lot(cur, item_name, quantity, batch, expiry)
+    if unit_cost is None:
+        cur.execute('SELECT cost FROM inventory WHERE name = ?', (item_name,))
+        unit_cost = (cur.fetchone() or (None,))[0]
+    add_layer(cur, item_name, quantity, unit_cost)
+    cur.execute('UPDATE inventory SET stock = stock + ? WHERE name = ?', (quantity, item_name))
+
+
+def remove_stock(cur, item_name, quantity):
+    """Write units off inventory.stock, its lots (earliest expiry first) and cost layers without committing; False if short"""
+    cur.execute('UPDATE inventory SET stock = stock - ? WHERE name = ? AND stock >= ?', (quantity, item_name, quantity))
+    if not cur.rowcount:
+        return False
+    take_from_lots(cur, item_name, quantity)
+    consume_layers(cur, item_name, quantity)
+    return True
+
+
+def take_from_lots(cur, item_name, quantity, bill_id=None, today=None):
+    """Take units from an item's lots first-expiry-first-out; returns units taken.
+
+    With bill_id the lots taken from are recorded against the bill. Lots are
+    read LOT_FETCH at a time off idx_lots_fefo, unexpired ones first.
+    """
+    today = today or datetime.now().strftime('%Y-%m-%d')
+    taken = 0
+    for window in (f'{LOT_ORDER} >= ?', f'{LOT_ORDER} < ?'):
+        while taken < quantity:
+            cur.execute(f'''
+                SELECT id, quantity FROM stock_lots
+                WHERE item_name = ? AND quantity > 0 AND {window}
+                ORDER BY {LOT_ORDER}, id LIMIT {LOT_FETCH}
+            ''', (item_name, today))
+            lots = cur.fetchall()
+            if not lots:
+                break
+            for lot_id, left in lots:
+                take = min(left, quantity - taken)
+                cur.execute('UPDATE stock_lots SET quantity = quantity - ? WHERE id = ?', (take, lot_id))
+                if bill_id is not None:
+                    cur.execute('''
+                        INSERT INTO lot_allocations (bill_id, lot_id, quantity) VALUES (?, ?, ?)
+                        ON CONFLICT (bill_id, lot_id) DO UPDATE SET quantity = quantity + excluded.quantity
+                    ''', (bill_id, lot_id, take))
+                taken += take
+                if taken == quantity:
+                    break
+    return taken
+
+
+def return_to_lots(cur, bill_id, item_name, quantity):
+    """Put units of an item back into the lots the bill took them from, latest expiry first.
+
+    Units beyond the bill's allocations become a new lot, so the lots always
+    add up to inventory.stock. Returns the units put back into existing lots.
+    """
+    cur.execute(f'''
+        SELECT a.lot_id, a.quantity FROM lot_allocations a JOIN stock_lots l ON l.id = a.lot_id
+        WHERE a.bill_id = ? AND l.item_name = ?
+        ORDER BY IFNULL(l.expiry, '{NO_EXPIRY}') DESC, l.id DESC
+    ''', (bill_id, item_name))
+    returned = 0
+    for lot_id, allocated in cur.fetchall():
+        give = min(allocated, quantity - returned)
+        if give <= 0:
+            break
+        cur.execute('UPDATE stock_lots SET quantity = quantity + ? WHERE id = ?', (give, lot_id))
+        if give == allocated:
+            cur.execute('DELETE FROM lot_allocations WHERE bill_id = ? AND lot_id = ?', (bill_id, lot_id))
+        else:
+            cur.execute('UPDATE lot_allocations SET quantity = quantity - ? WHERE bill_id = ? AND lot_id = ?',
+                        (give, bill_id, lot_id))
+        returned += give
+    if returned < quantity:
+        add_lot(cur, item_name, quantity - returned)
+    return returned
+
+
+def item_lots(cur, item_name):
+    """(batch, expiry, quantity) of an item's lots with stock, in the order bills take them"""
+    cur.execute(f'''
+        SELECT batch, expiry, quantity FROM stock_lots
+        WHERE item_name = ? AND quantity > 0 ORDER BY {LOT_ORDER}, id
+    ''', (item_name,))
+    return cur.fetchall()
+
+
+def expiring_lots(cur, days=EXPIRY_WARN_DAYS, today=None):
+    """EXPIRING_COLUMNS rows for lots with stock expiring within `days` (or already expired), soonest first"""
+    today = today or datetime.now().strftime('%Y-%m-%d')
+    cur.execute('''
+        SELECT item_name, batch, expiry, quantity, CAST(julianday(expiry) - julianday(:today) AS INTEGER)
+        FROM stock_lots
+        WHERE expiry <= date(:today, :ahead) AND quantity > 0
+        ORDER BY expiry, item_name
+    ''', {'today': today, 'ahead': f'+{int(days)} days'})
+    return cur.fetchall()
+
+
+# ============ FIFO COSTING ============
+# Every receipt of stock is a cost layer (units left, unit cost paid) and sales
+# use layers up oldest first, so cost of goods sold follows FIFO whichever lots
+# the units physically came from. cogs_entries remembers which layers a bill
+# used, so edits and deletes put units back at the cost they left at. Two
+# running totals spare the reports any scan: stock_totals (items, units, value
+# at cost), kept by triggers on inventory and cost_layers, and cogs_monthly,
+# moved with each bill like the sales rollups. Units from layers with no known
+# cost are counted as uncosted rather than valued at 0, and so are units sold
+# beyond the layers on record: they are entered against an empty layer of no
+# cost, which is where they go back to. Units returned beyond a bill's entries
+# (bills from before costing began) open a layer at the item's current cost.
+# cogs_monthly counts the sales of costed bills only, the ones with entries,
+# so bills synced from other branches or saved before costing began are left
+# out of both sides of the margin.
+COGS_COLUMNS = ('Month', 'Sales', 'COGS', 'Margin', 'Margin %', 'Uncosted Qty')
+COGS_DELTA = '''
+    INSERT INTO cogs_monthly (month, sales, cogs, uncosted)
+    SELECT strftime('%Y-%m', b.created_at, 'localtime'), ?, ?, ?
+    FROM bills b
+    WHERE b.id = ?
+    ON CONFLICT (month) DO UPDATE SET
+        sales = sales + excluded.sales,
+        cogs = cogs + excluded.cogs,
+        uncosted = uncosted + excluded.uncosted
+'''
+# takes back the sales and COGS of every costed bill in temp.doomed_bills, one row per month
+COGS_DELETE_SQL = '''
+    INSERT INTO cogs_monthly (month, sales, cogs, uncosted)
+    SELECT strftime('%Y-%m', b.created_at, 'localtime'), -SUM(c.sales), -SUM(c.cogs), -SUM(c.uncosted)
+    FROM (SELECT d.id, (SELECT SUM(IFNULL(bi.taxable, 0)) FROM bill_items bi WHERE bi.bill_id = d.id) AS sales,
+                 SUM(e.quantity * IFNULL(l.unit_cost, 0)) AS cogs,
+                 SUM(IIF(l.unit_cost IS NULL, e.quantity, 0)) AS uncosted
+          FROM temp.doomed_bills d CROSS JOIN cogs_entries e ON e.bill_id = d.id
+          JOIN cost_layers l ON l.id = e.layer_id
+          GROUP BY d.id) AS c
+    JOIN bills b ON b.id = c.id
+    WHERE true
+    GROUP BY 1
+    ON CONFLICT (month) DO UPDATE SET
+        sales = sales + excluded.sales,
+        cogs = cogs + excluded.cogs,
+        uncosted = uncosted + excluded.uncosted
+'''
+STOCK_TOTALS_TRIGGERS = (
+    ('inventory_ins', 'INSERT ON inventory', 'items = items + 1, units = units + NEW.stock'),
+    ('inventory_del', 'DELETE ON inventory', 'items = items - 1, units = units - OLD.stock'),
+    ('inventory_stock', 'UPDATE OF stock ON inventory', 'units = units + NEW.stock - OLD.stock'),
+    ('layers_ins', 'INSERT ON cost_layers',
+     'value = value + NEW.quantity * IFNULL(NEW.unit_cost, 0), '
+     'uncosted = uncosted + IIF(NEW.unit_cost IS NULL, NEW.quantity, 0)'),
+    ('layers_upd', 'UPDATE OF quantity ON cost_layers',
+     'value = value + (NEW.quantity - OLD.quantity) * IFNULL(NEW.unit_cost, 0), '
+     'uncosted = uncosted + IIF(NEW.unit_cost IS NULL, NEW.quantity - OLD.quantity, 0)'),
+    ('layers_del', 'DELETE ON cost_layers',
+     'value = value - OLD.quantity * IFNULL(OLD.unit_cost, 0), '
+     'uncosted = uncosted - IIF(OLD.unit_cost IS NULL, OLD.quantity, 0)'),
+)
+
+
+def install_stock_totals_triggers(conn):
+    """Keep stock_totals in step with every write to inventory and cost_layers"""
+    for name, event, change in STOCK_TOTALS_TRIGGERS:
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS stock_totals_{name} AFTER {event}
+            BEGIN
+                UPDATE stock_totals SET {change} WHERE id = 1;
+            END
+        ''')
+
+
+def rebuild_stock_totals(conn):
+    """Recount stock_totals from inventory and cost_layers"""
+    conn.execute('''
+        INSERT OR REPLACE INTO stock_totals (id, items, units, value, uncosted)
+        SELECT 1, (SELECT COUNT(*) FROM inventory), (SELECT IFNULL(SUM(stock), 0) FROM inventory),
+               IFNULL(SUM(quantity * IFNULL(unit_cost, 0)), 0),
+               IFNULL(SUM(IIF(unit_cost IS NULL, quantity, 0)), 0)
+        FROM cost_layers
+    ''')
+
+
+def add_layer(cur, item_name, quantity, unit_cost):
+    """Record a cost layer; inventory.stock is left to the caller"""
+    cur.execute('INSERT INTO cost_layers (item_name, unit_cost, quantity) VALUES (?, ?, ?)',
+                (item_name, unit_cost, quantity))
+
+
+def consume_layers(cur, item_name, quantity, bill_id=None):
+    """Use up an item's cost layers oldest first; returns (units costed, cost).
+
+    With bill_id the layers used are recorded against the bill and its
+    month's COGS moves with them; units the layers cannot cover are entered
+    against a new empty layer and counted as uncosted. Layers are read
+    LOT_FETCH at a time off idx_layers_fifo.
+    """
+    used, cost, uncosted = 0, 0.0, 0
+    while used < quantity:
+        cur.execute(f'''
+            SELECT id, quantity, unit_cost FROM cost_layers
+            WHERE item_name = ? AND quantity > 0
+            ORDER BY id LIMIT {LOT_FETCH}
+        ''', (item_name,))
+        layers = cur.fetchall()
+        if not layers:
+            break
+        for layer_id, left, unit_cost in layers:
+            take = min(left, quantity - used)
+            cur.execute('UPDATE cost_layers SET quantity = quantity - ? WHERE id = ?', (take, layer_id))
+            if bill_id is not None:
+                cur.execute('''
+                    INSERT INTO cogs_entries (bill_id, layer_id, quantity) VALUES (?, ?, ?)
+                    ON CONFLICT (bill_id, layer_id) DO UPDATE SET quantity = quantity + excluded.quantity
+                ''', (bill_id, layer_id, take))
+            used += take
+            if unit_cost is None:
+                uncosted += take
+            else:
+                cost += take * unit_cost
+            if used == quantity:
+                break
+    if bill_id is None:
+        return used, cost
+    if used < quantity:
+        cur.execute('INSERT INTO cost_layers (item_name, unit_cost, quantity) VALUES (?, NULL, 0)', (item_name,))
+        cur.execute('INSERT INTO cogs_entries (bill_id, layer_id, quantity) VALUES (?, ?, ?)',
+                    (bill_id, cur.lastrowid, quantity - used))
+        uncosted += quantity - used
+    if quantity:
+        cur.execute(COGS_DELTA, (0, cost, uncosted, bill_id))
+    return used, cost
+
+
+def restore_layers(cur, bill_id, item_name, quantity):
+    """Give units of an item back to the layers the bill used, newest first, taking back their COGS.
+
+    Units beyond the bill's entries open a layer at the item's current cost,
+    so the layers always add up to inventory.stock. Returns the units put
+    back into the bill's layers.
+    """
+    cur.execute('''
+        SELECT e.layer_id, e.quantity, l.unit_cost FROM cogs_entries e JOIN cost_layers l ON l.id = e.layer_id
+        WHERE e.bill_id = ? AND l.item_name = ?
+        ORDER BY e.layer_id DESC
+    ''', (bill_id, item_name))
+    returned, cost, uncosted = 0, 0.0, 0
+    for layer_id, used, unit_cost in cur.fetchall():
+        give = min(used, quantity - returned)
+        if give <= 0:
+            break
+        cur.execute('UPDATE cost_layers SET quantity = quantity + ? WHERE id = ?', (give, layer_id))
+        if give == used:
+            cur.execute('DELETE FROM cogs_entries WHERE bill_id = ? AND layer_id = ?', (bill_id, layer_id))
+        else:
+            cur.execute('UPDATE cogs_entries SET quantity = quantity - ? WHERE bill_id = ? AND layer_id = ?',
+                        (give, bill_id, layer_id))
+        returned += give
+        if unit_cost is None:
+            uncosted += give
+        else:
+            cost += give * unit_cost
+    if returned:
+        cur.execute(COGS_DELTA, (0, -cost, -uncosted, bill_id))
+    if returned < quantity:
+        cur.execute('INSERT INTO cost_layers (item_name, unit_cost, quantity) SELECT name, cost, ? FROM inventory WHERE name = ?',
+                    (quantity - returned, item_name))
+    return returned
+
+
+def stock_valuation(cur):
+    """(items, units, value at cost, uncosted units) from the running totals"""
+    cur.execute('SELECT items, units, value, uncosted FROM stock_totals WHERE id = 1')
+    return cur.fetchone() or (0, 0, 0.0, 0)
+
+
+def cogs_report(conn, first_month, last_month=None):
+    """COGS_COLUMNS rows per local month 'YYYY-MM', inclusive, from the monthly totals.
+
+    Sales are the taxable values (after discounts, before GST) of the costed
+    bills only, the same bills the COGS comes from, so one primary-key range
+    however many bills.
+    """
+    last_month = last_month or first_month
+    rows = conn.execute('''
+        SELECT month, sales, cogs, uncosted FROM cogs_monthly
+        WHERE month BETWEEN ? AND ?
+        ORDER BY month
+    ''', (first_month, last_month)).fetchall()
+    return [(month, round(sales, 2), round(cogs, 2), round(sales - cogs, 2),
+             round((sales - cogs) / sales * 100, 1) if sales else None, uncosted)
+            for month, sales, cogs, uncosted in rows]
+
+
+def export_cogs_csv(rows, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(COGS_COLUMNS)
+        writer.writerows(rows)
+
+
+# ============ BARCODES ============
+# Scanners on the counter are keyboard wedges: they type the code into the
+# focused entry and finish with Enter (or Tab, depending on the model).
+def normalize_barcode(text):
+    """Typed or scanned text -> the stored barcode, None when blank"""
+    text = (text or '').strip()
+    return text or None
+
+
+def find_by_barcode(cur, barcode):
+    """Name of the item with this barcode (idx_inventory_barcode), or None"""
+    cur.execute('SELECT name FROM inventory WHERE barcode = ?', (barcode,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+# ============ CART JOURNAL ============
+# Undo/redo for the billing cart. Every cart change is journalled as the
+# smallest step that replays it either way:
+#   ('set', index, (quantity, total) before, (quantity, total) after)
+#   ('lines', added, [(index, line), ...])   lines added or removed, in that order
+#   ('swap', cart before, cart after)        the whole cart replaced (Clear All)
+# Steps keep the line dicts themselves rather than copies. Undo always takes
+# the newest step, so a step meets the cart exactly as it left it and touches
+# only the lines it names. Only the last CART_UNDO_LIMIT steps are kept.
+CART_UNDO_LIMIT = 100
+
+
+class CartJournal:
+    """Bounded undo and redo stacks of cart steps.
+
+    `listener`, if set, is called as listener('step', step), listener('undo')
+    or listener('redo') for every change that reaches the cart.
+    """
+
+    def __init__(self, limit=CART_UNDO_LIMIT, listener=None):
+        self.undo_steps = deque(maxlen=limit)
+        self.redo_steps = deque(maxlen=limit)
+        self.listener = listener
+
+    def record(self, step):
+        """A new change; whatever was undone before it can no longer be redone"""
+        self.undo_steps.append(step)
+        self.redo_steps.clear()
+        if self.listener:
+            self.listener('step', step)
+
+    def reset(self):
+        self.undo_steps.clear()
+        self.redo_steps.clear()
+
+    def undo(self):
+        """The step to reverse, or None"""
+        if not self.undo_steps:
+            return None
+        step = self.undo_steps.pop()
+        self.redo_steps.append(step)
+        if self.listener:
+            self.listener('undo')
+        return step
+
+    def redo(self):
+        """The step to apply again, or None"""
+        if not self.redo_steps:
+            return None
+        step = self.redo_steps.pop()
+        self.undo_steps.append(step)
+        if self.listener:
+            self.listener('redo')
+        return step
+
+
+def cart_step_edits(step, undo=False):
+    """The list edits a step makes, in order: ('set', index, quantity, total),
+    ('insert', index, line), ('pop', index) or ('swap', cart)"""
+    if step[0] == 'set':
+        _, index, before, after = step
+        return [('set', index) + tuple(before if undo else after)]
+    if step[0] == 'lines':
+        _, added, lines = step
+        if undo:
+            lines = reversed(lines)
+        return [('insert', index, line) if added != undo else ('pop', index) for index, line in lines]
+    return [('swap', step[1] if undo else step[2])]
+
+
+def apply_cart_edits(cart, edits):
+    """Apply cart_step_edits to a cart list; returns the cart, which is another list after a swap"""
+    for edit in edits:
+        if edit[0] == 'set':
+            line = cart[edit[1]]
+            line['quantity'], line['total'] = edit[2], edit[3]
+        elif edit[0] == 'insert':
+            cart.insert(edit[1], edit[2])
+        elif edit[0] == 'pop':
+            cart.pop(edit[1])
+        else:
+            cart = edit[1]
+    return cart
+
+
+# ============ CART DRAFTS ============
+# The cart on screen is kept in draft_cart as it changes, so a power cut
+# mid-bill loses at most the last DRAFT_FLUSH_MS of it. Every journal entry
+# becomes one short row (the line added, the positions removed, a quantity
+# change, or just undo/redo/clear), so a change costs the same however long
+# the cart is. Rows are queued by the UI
+# and written by one thread on its own connection, a batch per transaction.
+# The first row names the saved bill being edited, if any; startup replays
+# the rest through a CartJournal, which brings back the undo history too.
+# Saving the bill deletes its draft in the same transaction and never waits
+# on the writer: rows still queued are dropped, and the writer empties
+# draft_cart once more in case it committed some after the bill. A new
+# draft's first row replaces the old draft in the transaction that writes it,
+# and a batch that fails is written again, in order, before anything after it.
+DRAFT_FLUSH_MS = 200
+DRAFT_RETRY_S = 1.0
+CART_LINE_KEYS = ('name', 'quantity', 'price', 'total', 'gst_rate', 'hsn')
+
+draft_log = logging.getLogger('fertilizer_billing.drafts')
+
+
+def draft_record(kind, step=None):
+    """A CartJournal listener call -> its draft_cart row text"""
+    if kind != 'step':
+        return json.dumps([kind])
+    if step[0] == 'set':
+        return json.dumps(list(step))
+    if step[0] == 'lines' and step[1]:
+        (index, line), = step[2]
+        return json.dumps(['add', index, [line[key] for key in CART_LINE_KEYS]])
+    if step[0] == 'lines':
+        return json.dumps(['remove', [index for index, _ in step[2]]])
+    return '["clear"]'
+
+
+def load_draft(cur):
+    """(invoice being edited or None, rows after the first) of the draft left in draft_cart"""
+    cur.execute('SELECT record FROM draft_cart ORDER BY seq')
+    records = [row[0] for row in cur.fetchall()]
+    if records and records[0].startswith('["base"'):
+        return json.loads(records[0])[1], records[1:]
+    return None, records
+
+
+def replay_draft(cart, records):
+    """Replay draft rows onto the cart they started from; returns (cart, CartJournal).
+
+    Raises ValueError, LookupError or TypeError for rows that do not fit the cart.
+    """
+    journal = CartJournal()
+    for text in records:
+        record = json.loads(text)
+        kind = record[0]
+        if kind in ('undo', 'redo'):
+            step = getattr(journal, kind)()
+            if step is not None:
+                cart = apply_cart_edits(cart, cart_step_edits(step, kind == 'undo'))
+            continue
+        if kind == 'remove':
+            # the step must hold the very lines taken out, as it does live, since
+            # redoing an earlier step can put those same dicts back in the cart
+            step = ('lines', False, [(index, cart.pop(index)) for index in record[1]])
+        else:
+            if kind == 'set':
+                step = ('set', record[1], tuple(record[2]), tuple(record[3]))
+            elif kind == 'add':
+                step = ('lines', True, [(record[1], dict(zip(CART_LINE_KEYS, record[2])))])
+            elif kind == 'clear':
+                step = ('swap', cart, [])
+            else:
+                raise ValueError(f"unknown draft record {kind!r}")
+            cart = apply_cart_edits(cart, cart_step_edits(step))
+        journal.record(step)
+    return cart, journal
+
+
+def discard_draft(cur):
+    cur.execute('DELETE FROM draft_cart')
+
+
+class DraftLog:
+    """Queue of draft_cart rows and the thread that writes them; log() never touches the database"""
+
+    def __init__(self, db_path=DB_PATH, flush_ms=DRAFT_FLUSH_MS):
+        self.db_path = db_path
+        self.linger = flush_ms / 1000
+        self.queue = queue.Queue()
+        self.hurry = threading.Event()
+        self.active = False
+        self.failed = False
+        self.seq = 0
+        self.thread = threading.Thread(target=self._write_loop, name='draft-writer', daemon=True)
+        self.thread.start()
+
+    def start(self, invoice=None, records=()):
+        """Replace the draft with a fresh one, for a new bill or for the saved bill `invoice`"""
+        self.active = True
+        self.seq = 0
+        self._put(json.dumps(['base', invoice]))
+        for text in records:
+            self._put(text)
+
+    def discard(self):
+        """Drop the rows not yet written and empty draft_cart; log nothing more until the next start"""
+        self.active = False
+        self.queue.put('discard')
+        self.hurry.set()
+
+    def log(self, kind, step=None):
+        if self.active:
+            self._put(draft_record(kind, step))
+
+    def _put(self, text):
+        self.seq += 1
+        self.queue.put((self.seq, text))
+
+    def flush(self, timeout=5):
+        """Wait until everything logged so far is committed; False if the write failed or timed out"""
+        done = threading.Event()
+        self.queue.put(done)
+        self.hurry.set()
+        # a later success clears `failed` only once the failed rows are in too
+        return done.wait(timeout) and not self.failed
+
+    def close(self):
+        self.queue.put('close')
+        self.hurry.set()
+        self.thread.join(5)
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        rows, wipe, closing = [], False, False
+        while not closing:
+            items = []
+            try:
+                items.append(self.queue.get(timeout=DRAFT_RETRY_S if rows or wipe else None))
+            except queue.Empty:
+                pass  # nothing new; try the rows of the failed batch again
+            if items and isinstance(items[0], tuple):
+                # let the rest of a burst of changes catch up and share the commit
+                self.hurry.wait(self.linger)
+                self.hurry.clear()
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            waiting = []
+            for item in items:
+                if isinstance(item, tuple):
+                    rows.append(item)
+                elif item == 'close':
+                    closing = True
+                elif item == 'discard':
+                    rows, wipe = [], True
+                else:
+                    waiting.append(item)
+            try:
+                with conn:
+                    if wipe:
+                        conn.execute('DELETE FROM draft_cart')
+                    for seq, text in rows:
+                        if seq == 1:
+                            # a new draft's base row: the old draft goes in the same transaction
+                            conn.execute('DELETE FROM draft_cart')
+                        conn.execute('INSERT OR REPLACE INTO draft_cart (seq, record) VALUES (?, ?)', (seq, text))
+                rows, wipe = [], False
+                self.failed = False
+            except sqlite3.Error:
+                self.failed = True
+                draft_log.exception('%d draft rows not written, will retry', len(rows))
+            for done in waiting:
+                done.set()
+        conn.close()
+
+
+# ============ BILLING ENGINE ============
+# Pricing and saving a bill apart from the widgets, shared by the billing
+# screen and the counter API so a bill is written the same way by either.
+
+PAYMENT_METHODS = ('Cash', 'Card', 'UPI', 'Credit')
+
+
+class BillError(ValueError):
+    """A bill that cannot be saved as entered; the message is meant for the user"""
+
+
+def price_bill(lines, discount_rate, tax_rate):
+    """Totals for cart lines, in the shape save_bill expects.
+
+    Lines are add_to_cart dicts (name, quantity, price, total, gst_rate, hsn);
+    gst_breakdown also stamps each with its line_rate, taxable and tax.
+    """
+    subtotal = sum(item['total'] for item in lines)
+    discount_amount = (discount_rate / 100) * subtotal
+    slabs, _, tax_amount = gst_breakdown(lines, discount_rate, tax_rate)
+    return {
+        'subtotal': subtotal,
+        'discount_rate': discount_rate,
+        'discount_amount': discount_amount,
+        'tax_rate': tax_rate,
+        'tax_amount': tax_amount,
+        'gst_slabs': slabs,
+        'total': subtotal - discount_amount + tax_amount
+    }
+
+
+def next_invoice_number(cur):
+    """INV-YYYYMMDD-NNNN after the highest number issued today; INV-<node>-... once branches sync"""
+    cur.execute('SELECT node FROM sync_node WHERE id = 1')
+    node = cur.fetchone()
+    prefix = f"INV-{node[0] + '-' if node else ''}{datetime.now().strftime('%Y%m%d')}-"
+    # a range on the unique index, so only today's last number is read
+    cur.execute('SELECT MAX(invoice_number) FROM bills WHERE invoice_number > ? AND invoice_number < ?',
+                (prefix, prefix + '~'))
+    last = cur.fetchone()[0]
+    count = int(last[len(prefix):]) + 1 if last and last[len(prefix):].isdigit() else 1
+    return f"{prefix}{count:04d}"
+
+
+def bill_line_row(item):
+    """A priced cart line as a bill_items row (item_name, quantity, price, total, gst_rate, hsn, taxable, tax)"""
+    return (item['name'], item['quantity'], item['price'], item['total'],
+            item['line_rate'], item.get('hsn', ''), item['taxable'], item['tax'])
+
+
+def update_bill_lines(cur, bill_id, lines):
+    """Bring a saved bill's items in line with priced cart lines, writing only the lines that differ.
+
+    Lines are matched to the saved ones by item. Stock moves by each item's
+    net change, taken from or put back into its lots and cost layers, and the
+    rollups and COGS by the difference, so changing one quantity costs a few
+    rows however long the bill is. A bill saved before costing began stays
+    out of COGS: its layers move but nothing is entered against it.
+    """
+    cur.execute('SELECT EXISTS (SELECT 1 FROM cogs_entries WHERE bill_id = ?)', (bill_id,))
+    costed = cur.fetchone()[0]
+    cur.execute('''
+        SELECT id, item_name, quantity, price, total, gst_rate, hsn, taxable, tax
+        FROM bill_items WHERE bill_id = ? ORDER BY id
+    ''', (bill_id,))
+    saved = {}
+    for row in cur.fetchall():
+        saved.setdefault(row[1], []).append((row[0], row[1:6] + (row[6] or '',) + row[7:]))
+    stock, changes = {}, []
+    for item in lines:
+        new = bill_line_row(item)
+        name = new[0]
+        if saved.get(name):
+            line_id, old = saved[name].pop(0)
+            if old == new:
+                continue
+            cur.execute('''
+                UPDATE bill_items SET quantity = ?, price = ?, total = ?, gst_rate = ?, hsn = ?, taxable = ?, tax = ?
+                WHERE id = ?
+            ''', new[1:] + (line_id,))
+            changes.append((-1, old))
+            stock[name] = stock.get(name, 0) + old[1]
+        else:
+            cur.execute('''
+                INSERT INTO bill_items (bill_id, item_name, quantity, price, total, gst_rate, hsn, taxable, tax)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (bill_id,) + new)
+        changes.append((1, new))
+        stock[name] = stock.get(name, 0) - new[1]
+    for rows in saved.values():
+        for line_id, old in rows:
+            cur.execute('DELETE FROM bill_items WHERE id = ?', (line_id,))
+            changes.append((-1, old))
+            stock[old[0]] = stock.get(old[0], 0) + old[1]
+    for name, delta in stock.items():
+        if delta:
+            cur.execute('UPDATE inventory SET stock = stock + ? WHERE name = ?', (delta, name))
+            if not cur.rowcount:
+                continue  # the item has been deleted since, and its stock with it
+            if delta > 0:
+                return_to_lots(cur, bill_id, name, delta)
+                restore_layers(cur, bill_id, name, delta)
+            else:
+                take_from_lots(cur, name, -delta, bill_id)
+                consume_layers(cur, name, -delta, bill_id if costed else None)
+    rollup_line_changes(cur, bill_id, changes)
+    sales = sum(sign * (row[6] or 0) for sign, row in changes)
+    if costed and sales:
+        cur.execute(COGS_DELTA, (sales, 0, 0, bill_id))
+
+
+def save_bill(cur, lines, values, payment_method, invoice_number=None, customer=None, bill_id=None):
+    """Write a priced bill without committing; returns (bill_id, invoice_number).
+
+    customer is (name, phone, address, gstin). With bill_id the saved bill is
+    edited in place, keeping its number and date, and only what changed is
+    written; otherwise a new bill is inserted, under a fresh number if
+    invoice_number is missing or already used. Stock (lots first-expiry-first-
+    out), its FIFO cost, the credit ledger and the sales/tax rollups move with
+    the bill. Raises BillError for bills that cannot be saved as entered.
+    """
+    if not lines:
+        raise BillError("Cart is empty!")
+    name, phone, address, gstin = customer or ('', '', '', '')
+    name, phone, gstin = (name or '').strip(), (phone or '').strip(), (gstin or '').strip().upper()
+    if payment_method == 'Credit' and not phone:
+        raise BillError("Credit sales need the customer's phone number")
+    if gstin and len(gstin) != 15:
+        raise BillError("GSTIN must be 15 characters")
+    if gstin and not phone:
+        raise BillError("Enter the phone number of the GST registered customer")
+
+    customer_id = None
+    if phone:
+        cur.execute('SELECT id FROM customers WHERE phone = ?', (phone,))
+        result = cur.fetchone()
+        if result:
+            customer_id = result[0]
+            if gstin:
+                cur.execute('UPDATE customers SET gstin = ? WHERE id = ?', (gstin, customer_id))
+        else:
+            cur.execute('''
+                INSERT INTO customers (name, phone, address, gstin)
+                VALUES (?, ?, ?, ?)
+            ''', (name, phone, address or '', gstin))
+            customer_id = cur.lastrowid
+
+    if bill_id:
+        cur.execute('''
+            SELECT invoice_number, customer_id, subtotal, discount_rate, discount_amount,
+                   tax_rate, tax_amount, total_amount, payment_method
+            FROM bills WHERE id = ?
+        ''', (bill_id,))
+        saved = cur.fetchone()
+        if saved is None:
+            raise BillError("This bill is no longer in the database")
+        invoice_number = saved[0]
+        header = (customer_id, values['subtotal'], values['discount_rate'], values['discount_amount'],
+                  values['tax_rate'], values['tax_amount'], values['total'], payment_method)
+        if saved[1:] != header:
+            cur.execute('''
+                UPDATE bills SET customer_id = ?, subtotal = ?, discount_rate = ?, discount_amount = ?,
+                    tax_rate = ?, tax_amount = ?, total_amount = ?, payment_method = ?
+                WHERE id = ?
+            ''', header + (bill_id,))
+        sync_bill_credit(cur, bill_id, customer_id, payment_method, values['total'])
+        update_bill_lines(cur, bill_id, lines)
+        return bill_id, invoice_number
+
+    if invoice_number:
+        cur.execute('SELECT 1 FROM bills WHERE invoice_number = ?', (invoice_number,))
+        if cur.fetchone() is not None:
+            invoice_number = None
+    invoice_number = invoice_number or next_invoice_number(cur)
+    cur.execute('''
+        INSERT INTO bills (invoice_number, customer_id, subtotal,
+                          discount_rate, discount_amount, tax_rate,
+                          tax_amount, total_amount, payment_method)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (invoice_number, customer_id, values['subtotal'], values['discount_rate'],
+          values['discount_amount'], values['tax_rate'], values['tax_amount'], values['total'],
+          payment_method))
+    bill_id = cur.lastrowid
+    sync_bill_credit(cur, bill_id, customer_id, payment_method, values['total'])
+
+    for item in lines:
+        cur.execute('''
+            INSERT INTO bill_items (bill_id, item_name, quantity, price, total, gst_rate, hsn, taxable, tax)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (bill_id,) + bill_line_row(item))
+        cur.execute('UPDATE inventory SET stock = stock - ? WHERE name = ?', (item['quantity'], item['name']))
+        take_from_lots(cur, item['name'], item['quantity'], bill_id)
+        consume_layers(cur, item['name'], item['quantity'], bill_id)
+    cur.execute(COGS_DELTA, (sum(item['taxable'] for item in lines), 0, 0, bill_id))
+    rollup_bill(cur, bill_id, 1)
+    return bill_id, invoice_number
+
+
+def delete_saved_bills(cur, invoices):
+    """Delete bills by invoice number without committing; returns how many were found.
+
+    Works on the whole set at once, however many are picked: the bill ids go
+    into a temp table, stock, its lots, cost layers and credit balances come
+    back through one aggregated UPDATE each, the rollups and COGS are taken
+    back with one upsert each and the lines and bills are deleted by joining
+    on the same ids.
+    """
+    # CROSS JOIN keeps the few picked ids as the outer loop; the temp table has
+    # no statistics, so otherwise the planner may scan bill_items or ledger
+    cur.execute('CREATE TEMP TABLE IF NOT EXISTS doomed_bills (id INTEGER PRIMARY KEY)')
+    cur.execute('DELETE FROM temp.doomed_bills')
+    cur.executemany('INSERT OR IGNORE INTO temp.doomed_bills SELECT id FROM bills WHERE invoice_number = ?',
+                    [(invoice,) for invoice in invoices])
+    cur.execute('SELECT COUNT(*) FROM temp.doomed_bills')
+    count = cur.fetchone()[0]
+    if not count:
+        return 0
+    cur.execute('''
+        UPDATE inventory SET stock = stock + restored.quantity
+        FROM (SELECT bi.item_name, SUM(bi.quantity) AS quantity
+              FROM temp.doomed_bills d CROSS JOIN bill_items bi ON bi.bill_id = d.id
+              GROUP BY bi.item_name) AS restored
+        WHERE inventory.name = restored.item_name
+    ''')
+    # as return_to_lots: units without an allocation come back as a new lot
+    cur.execute('''
+        INSERT INTO stock_lots (item_name, quantity)
+        SELECT sold.item_name, sold.units - IFNULL(taken.units, 0)
+        FROM (SELECT bi.item_name, SUM(bi.quantity) AS units
+              FROM temp.doomed_bills d CROSS JOIN bill_items bi ON bi.bill_id = d.id
+              GROUP BY bi.item_name) AS sold
+        JOIN inventory i ON i.name = sold.item_name
+        LEFT JOIN (SELECT l.item_name, SUM(a.quantity) AS units
+                   FROM temp.doomed_bills d CROSS JOIN lot_allocations a ON a.bill_id = d.id
+                   JOIN stock_lots l ON l.id = a.lot_id
+                   GROUP BY l.item_name) AS taken ON taken.item_name = sold.item_name
+        WHERE sold.units > IFNULL(taken.units, 0)
+    ''')
+    cur.execute('''
+        UPDATE stock_lots SET quantity = quantity + back.units
+        FROM (SELECT a.lot_id, SUM(a.quantity) AS units
+              FROM temp.doomed_bills d CROSS JOIN lot_allocations a ON a.bill_id = d.id
+              GROUP BY a.lot_id) AS back
+        WHERE stock_lots.id = back.lot_id AND stock_lots.item_name IN (SELECT name FROM inventory)
+    ''')
+    cur.execute('DELETE FROM lot_allocations WHERE bill_id IN (SELECT id FROM temp.doomed_bills)')
+    cur.execute(COGS_DELETE_SQL)
+    # as restore_layers: units without an entry come back as a layer at today's cost
+    cur.execute('''
+        INSERT INTO cost_layers (item_name, unit_cost, quantity)
+        SELECT sold.item_name, i.cost, sold.units - IFNULL(costed.units, 0)
+        FROM (SELECT bi.item_name, SUM(bi.quantity) AS units
+              FROM temp.doomed_bills d CROSS JOIN bill_items bi ON bi.bill_id = d.id
+              GROUP BY bi.item_name) AS sold
+        JOIN inventory i ON i.name = sold.item_name
+        LEFT JOIN (SELECT l.item_name, SUM(e.quantity) AS units
+                   FROM temp.doomed_bills d CROSS JOIN cogs_entries e ON e.bill_id = d.id
+                   JOIN cost_layers l ON l.id = e.layer_id
+                   GROUP BY l.item_name) AS costed ON costed.item_name = sold.item_name
+        WHERE sold.units > IFNULL(costed.units, 0)
+    ''')
+    cur.execute('''
+        UPDATE cost_layers SET quantity = quantity + back.units
+        FROM (SELECT e.layer_id, SUM(e.quantity) AS units
+              FROM temp.doomed_bills d CROSS JOIN cogs_entries e ON e.bill_id = d.id
+              GROUP BY e.layer_id) AS back
+        WHERE cost_layers.id = back.layer_id AND cost_layers.item_name IN (SELECT name FROM inventory)
+    ''')
+    cur.execute('DELETE FROM cogs_entries WHERE bill_id IN (SELECT id FROM temp.doomed_bills)')
+    # as sync_bill_credit does for one deleted bill
+    cur.execute('''
+        UPDATE customers SET balance = balance - owed.amount
+        FROM (SELECT l.customer_id, SUM(l.amount) AS amount
+              FROM temp.doomed_bills d CROSS JOIN ledger l ON l.bill_id = d.id
+              WHERE l.kind = 'sale'
+              GROUP BY l.customer_id) AS owed
+        WHERE customers.id = owed.customer_id
+    ''')
+    cur.execute("DELETE FROM ledger WHERE kind = 'sale' AND bill_id IN (SELECT id FROM temp.doomed_bills)")
+    for sql in ROLLUP_DELETE_SQL:
+        cur.execute(sql, (-1, -1))
+    cur.execute('DELETE FROM bill_items WHERE bill_id IN (SELECT id FROM temp.doomed_bills)')
+    cur.execute('DELETE FROM bills WHERE id IN (SELECT id FROM temp.doomed_bills)')
+    cur.execute('DELETE FROM temp.doomed_bills')
+    return count
+
+
+# ============ BILL LAYOUT ============
+# The bill as fixed-width lines, shared by the on-screen preview and the
+# printable outputs so they always agree. Each line is (style, text): style
+# is '' or 'bold', text is already padded to the width. The heading depends
+# only on the shop settings; the body on the bill.
+BILL_WIDTH = 48
+
+
+def shop_settings(cur):
+    """(shop_name, shop_address, shop_phone, currency, gst_number, licence_number), blanks filled in"""
+    cur.execute('SELECT shop_name, shop_address, shop_phone, currency, gst_number, licence_number FROM settings WHERE id=1')
+    row = cur.fetchone() or ("Fertilizer Shop", "", "", "Rs.", "", "")
+    return (row[0], row[1] or "", row[2] or "", row[3] or "Rs.", row[4] or "", row[5] or "")
+
+
+def wrap_text(s, w):
+    """Break s at spaces into lines of at most w characters"""
+    lines = []
+    while len(s) > w:
+        idx = s.rfind(' ', 0, w)
+        if idx == -1:
+            idx = w
+        lines.append(s[:idx])
+        s = s[idx:].lstrip()
+    if s:
+        lines.append(s)
+    return lines
+
+
+def bill_heading(shop, width=BILL_WIDTH):
+    """Shop name, address, phone, GST and licence numbers between rules"""
+    shop_name, shop_address, shop_phone, _, gst_number, licence_number = shop
+    lines = [('', '=' * width), ('bold', shop_name.center(width))]
+    if shop_address:
+        lines += [('', ln.center(width)) for ln in wrap_text(shop_address, width - 6)]
+    if shop_phone:
+        lines.append(('', f"Phone: {shop_phone}".center(width)))
+    lines.append(('', '=' * width))
+    if gst_number:
+        lines.append(('', f"GST No: {gst_number}".center(width)))
+    if licence_number:
+        lines.append(('', f"Licence No: {licence_number}".center(width)))
+    return lines
+
+
+def bill_body(shop, bill, items, values, width=BILL_WIDTH):
+    """Everything below the heading.
+
+    bill has 'date', 'invoice', 'customer' and 'payment'; items are cart
+    lines and values are price_bill totals (or the same read back from a
+    saved bill). Below 38 columns (58mm rolls) item names get a line of
+    their own above the figures, as they do at any width when the figures
+    (totals of 10,000 and up) are too wide to sit beside the name.
+    """
+    currency = shop[3]
+    name_width, label_width = width - 26, width - 15
+    narrow = name_width < 12
+    lines = [f"Date: {bill['date']}", f"Invoice: {bill['invoice']}"]
+    if bill['customer']:
+        lines.append(f"Customer: {bill['customer']}")
+    lines.append('-' * width)
+    if narrow:
+        lines.append(f"{'Item':<{width - 24}}{'Qty':>4} {'Price':>9} {'Total':>9}")
+    else:
+        lines.append(f"{'Item':<{name_width}} {'Qty':>4} {'Price':>9} {'Total':>9}")
+    lines.append('-' * width)
+    for item in items:
+        price_str = f"{currency}{item['price']:,.2f}"
+        total_str = f"{currency}{item['total']:,.2f}"
+        figures = f"{str(item['quantity']):>4} {price_str:>9} {total_str:>9}"
+        if len(figures) > width:
+            figures = f"{item['quantity']} {price_str} {total_str}"
+        if narrow or name_width + 1 + len(figures) > width:
+            lines.append(item['name'][:width])
+            lines.append(f"{figures:>{width}}")
+        else:
+            lines.append(f"{item['name'][:name_width]:<{name_width}} {figures}")
+        if item.get('hsn'):
+            lines.append(f"  HSN {item['hsn']}")
+    lines.append('-' * width)
+
+    def amount(label, value):
+        # a label too long for the roll goes on a line of its own
+        if len(label) > label_width:
+            lines.append(label)
+            label = ''
+        lines.append(f"{label:<{label_width}} {value}")
+
+    amount('Subtotal:', f"{currency}{values['subtotal']:>8.2f}")
+    discount_rate = values['discount_rate']
+    if discount_rate > 0:
+        amount('Discount (' + str(discount_rate) + '%):', f"-{currency}{values['discount_amount']:>8.2f}")
+    for rate, taxable, cgst, sgst in values['gst_slabs']:
+        if rate > 0:
+            amount(f"CGST @{rate / 2:g}% on {taxable:.2f}:", f"+{currency}{cgst:>8.2f}")
+            amount(f"SGST @{rate / 2:g}%:", f"+{currency}{sgst:>8.2f}")
+    lines.append('=' * width)
+    body = [('', line) for line in lines]
+    body.append(('bold', f"{'GRAND TOTAL:':<{label_width}} {currency}{values['total']:>8.2f}"))
+    body += [('', line) for line in ('=' * width, f"Payment: {bill['payment']}", "",
+                                      'Thank you for your purchase!'.center(width),
+                                      'Visit Again Soon!'.center(width), '=' * width)]
+    return body
+
+
+def saved_bills(conn, schema, bill_ids):
+    """(bill, items, values) for bill_layout, read back from <schema>.bills in id order"""
+    marks = ', '.join('?' * len(bill_ids))
+    bills = conn.execute(f'''
+        SELECT b.id, b.invoice_number, strftime('%d-%m-%Y %H:%M:%S', b.created_at, 'localtime'),
+               COALESCE(c.name, ''), COALESCE(b.payment_method, ''), COALESCE(b.subtotal, 0),
+               COALESCE(b.discount_rate, 0), COALESCE(b.discount_amount, 0), COALESCE(b.tax_rate, 0),
+               COALESCE(b.total_amount, 0)
+        FROM {schema}.bills b LEFT JOIN main.customers c ON c.id = b.customer_id
+        WHERE b.id IN ({marks}) ORDER BY b.id
+    ''', bill_ids).fetchall()
+    items = {}
+    for bill_id, name, quantity, price, total, rate, hsn, taxable, tax in conn.execute(f'''
+            SELECT bill_id, item_name, quantity, price, total, gst_rate, hsn, taxable, tax
+            FROM {schema}.bill_items WHERE bill_id IN ({marks}) ORDER BY bill_id, id
+            ''', bill_ids):
+        items.setdefault(bill_id, []).append({'name': name, 'quantity': quantity, 'price': price or 0,
+                                              'total': total or 0, 'hsn': hsn or '', 'line_rate': rate,
+                                              'taxable': taxable or 0, 'tax': tax or 0})
+    for bill_id, invoice, date, customer, payment, subtotal, discount_rate, discount_amount, tax_rate, total in bills:
+        lines = items.get(bill_id, [])
+        slabs = {}
+        for item in lines:
+            slab = slabs.setdefault(tax_rate if item['line_rate'] is None else item['line_rate'], [0.0, 0.0])
+            slab[0] += item['taxable']
+            slab[1] += item['tax']
+        values = {'subtotal': subtotal, 'discount_rate': discount_rate, 'discount_amount': discount_amount,
+                  'total': total, 'gst_slabs': [(rate, taxable, round(tax / 2, 2), round(tax / 2, 2))
+                                                for rate, (taxable, tax) in sorted(slabs.items())]}
+        yield ({'date': date, 'invoice': invoice, 'customer': customer, 'payment': payment}, lines, values)
+
+
+# ============ PDF INVOICES ============
+# Invoices as PDF without extra packages: the bill layout is set in Courier so
+# its columns line up exactly as on screen. The heading only changes with the
+# settings, so it is drawn once into a form XObject that each page places with
+# a single `Do`; the drawn heading is also cached per process, so a batch pays
+# for it once. Reprinting a date range hands chunks of bills to a process pool,
+# one PDF file per bill.
+PDF_PAGE = (595, 842)  # A4 in points
+PDF_MARGIN = 48
+PDF_FONT_SIZE = 10
+PDF_LEADING = 13
+PDF_WIDTH = 80  # Courier is 0.6em wide: 80 characters at 10pt fill 480 of the 499pt text width
+PDF_CHUNK = 200
+
+
+def _pdf_string(text):
+    data = text.rstrip().encode('cp1252', 'replace')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _pdf_text(lines, x, y):
+    """Content-stream ops drawing (style, text) lines downward from (x, y)"""
+    ops = [b'BT /F1 %d Tf %d TL %d %d Td' % (PDF_FONT_SIZE, PDF_LEADING, x, y)]
+    bold = False
+    for style, text in lines:
+        if (style == 'bold') != bold:
+            bold = not bold
+            ops.append(b'/F%d %d Tf' % (2 if bold else 1, PDF_FONT_SIZE))
+        ops.append(b'T* ' + _pdf_string(text) + b' Tj')
+    ops.append(b'ET')
+    return b'\n'.join(ops)
+
+
+@functools.lru_cache(maxsize=8)
+def pdf_heading_template(shop, width=PDF_WIDTH):
+    """(compressed form XObject stream, height) of the shop heading"""
+    lines = bill_heading(shop, width)
+    height = len(lines) * PDF_LEADING + PDF_LEADING // 2
+    return zlib.compress(_pdf_text(lines, 0, height)), height
+
+
+def invoice_pdf(shop, bills, width=PDF_WIDTH):
+    """PDF bytes with each (bill, items, values) starting a page; returns (data, pages)"""
+    heading, heading_height = pdf_heading_template(shop, width)
+    page_width, page_height = PDF_PAGE
+    top = page_height - PDF_MARGIN - heading_height
+    per_page = (top - PDF_MARGIN) // PDF_LEADING
+    contents = []
+    for bill, items, values in bills:
+        body = bill_body(shop, bill, items, values, width)
+        start = 0
+        while not start or start < len(body):
+            if start:
+                # later pages of a long bill say whose they are
+                lines = [('', f"Invoice: {bill['invoice']} (continued)")] + body[start:start + per_page - 1]
+                start += per_page - 1
+            else:
+                lines = body[:per_page]
+                start = per_page
+            contents.append(zlib.compress(b'q 1 0 0 1 %d %d cm /Head Do Q\n' % (PDF_MARGIN, top)
+                                          + _pdf_text(lines, PDF_MARGIN, top)))
+
+    # 1 catalog, 2 page tree, 3-4 fonts, 5 heading, then a page and its contents per page
+    fonts = b'<< /Font << /F1 3 0 R /F2 4 0 R >> >>'
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [%s] /Count %d /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R /F2 4 0 R >>'
+        b' /XObject << /Head 5 0 R >> >> >>' % (b' '.join(b'%d 0 R' % (6 + 2 * n) for n in range(len(contents))),
+                                                len(contents), page_width, page_height),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier-Bold /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /XObject /Subtype /Form /BBox [0 0 %d %d] /Resources %s /Filter /FlateDecode /Length %d >>\n'
+        b'stream\n%s\nendstream' % (page_width, heading_height, fonts, len(heading), heading),
+    ]
+    for n, content in enumerate(contents):
+        objects.append(b'<< /Type /Page /Parent 2 0 R /Contents %d 0 R >>' % (7 + 2 * n))
+        objects.append(b'<< /Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream' % (len(content), content))
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, obj)
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out), len(contents)
+
+
+def _pdf_filename(invoice):
+    return re.sub(r'[^\w.-]', '_', invoice) + '.pdf'
+
+
+def _render_bill_chunk(task):
+    """Process pool worker: one PDF per bill of the chunk; returns (bills, pages, bytes)"""
+    db_path, out_dir, schema, start_at, end_at, bill_ids = task
+    conn = sqlite3.connect(db_path)
+    try:
+        if schema != 'main':
+            attach_archives(conn, start_at, end_at)
+        shop = shop_settings(conn.cursor())
+        bills = pages = size = 0
+        for bill in saved_bills(conn, schema, bill_ids):
+            data, n = invoice_pdf(shop, [bill])
+            with open(os.path.join(out_dir, _pdf_filename(bill[0]['invoice'])), 'wb') as f:
+                f.write(data)
+            bills, pages, size = bills + 1, pages + n, size + len(data)
+        return bills, pages, size
+    finally:
+        conn.close()
+
+
+def reprint_bills_pdf(db_path, out_dir, start_at, end_at, workers=None, chunk=PDF_CHUNK):
+    """Write a PDF for every bill in [start_at, end_at), archives included; returns counts and seconds.
+
+    workers=1 renders in this process; otherwise chunks of `chunk` bills go to
+    a pool of that many processes (default: one per CPU).
+    """
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    try:
+        tasks = []
+        for schema in ['main'] + attach_archives(conn, start_at, end_at):
+            ids = [row[0] for row in conn.execute(
+                f'SELECT id FROM {schema}.bills WHERE created_at >= ? AND created_at < ? ORDER BY id',
+                (start_at, end_at))]
+            tasks += [(db_path, out_dir, schema, start_at, end_at, ids[i:i + chunk])
+                      for i in range(0, len(ids), chunk)]
+    finally:
+        conn.close()
+    os.makedirs(out_dir, exist_ok=True)
+    workers = min(workers or os.cpu_count() or 1, len(tasks) or 1)
+    if workers == 1:
+        results = [_render_bill_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_render_bill_chunk, tasks))
+    bills, pages, size = (sum(result[i] for result in results) for i in range(3))
+    return {'bills': bills, 'pages': pages, 'bytes': size, 'workers': workers,
+            'seconds': time.perf_counter() - started}
+
+
+# ============ ESC/POS RECEIPTS ============
+# Raw receipts for thermal printers, 32 columns on 58mm rolls and 48 on 80mm,
+# from the same bill layout as the preview. The bytes go to the printer's
+# device (/dev/usb/lp0, a COM or LPT port, a shared printer path) or to any
+# file standing in for one. Receipts are built into one reusable buffer from
+# three parts: the heading, encoded once per settings and cached; the body,
+# encoded in a single pass (one encode call for all lines costs a third of
+# encoding and copying them one by one); and the feed-and-cut.
+RECEIPT_WIDTHS = (32, 48)
+RECEIPT_ENCODING = 'cp437'  # the printers' default code page
+ESC_INIT = b'\x1b@\x1bt\x00'  # reset, code page PC437
+ESC_BOLD_ON = b'\x1bE\x01\x1d!\x01'  # emphasized, double height (width stays, so centring holds)
+ESC_BOLD_OFF = b'\x1bE\x00\x1d!\x00'
+ESC_FEED_CUT = b'\x1bd\x04\x1dV\x01'  # feed 4 lines, partial cut
+
+
+_BOLD_ON, _BOLD_OFF = ESC_BOLD_ON.decode('ascii'), ESC_BOLD_OFF.decode('ascii')
+
+
+def escpos_lines(lines):
+    """(style, text) layout lines -> printer bytes, bold lines wrapped in the emphasis codes.
+
+    Trailing spaces are dropped: a full-width line plus its newline would
+    feed an empty line on printers that wrap at the last column.
+    """
+    return ''.join([f"{_BOLD_ON}{text.rstrip()}\n{_BOLD_OFF}" if style else text.rstrip() + '\n'
+                    for style, text in lines]).encode(RECEIPT_ENCODING, 'replace')
+
+
+@functools.lru_cache(maxsize=8)
+def escpos_heading(shop, width):
+    """Printer reset plus the shop heading, encoded once per settings and width"""
+    return ESC_INIT + escpos_lines(bill_heading(shop, width))
+
+
+class ReceiptBuffer:
+    """A reusable buffer that receipts are built into, one at a time or a batch back to back"""
+
+    def __init__(self, size=16 * 1024):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.pos = 0
+
+    def put(self, data):
+        end = self.pos + len(data)
+        if end > len(self.buf):
+            # only when a receipt outgrows every earlier one
+            self.view.release()
+            self.buf.extend(bytes(max(len(self.buf), end - len(self.buf))))
+            self.view = memoryview(self.buf)
+        self.view[self.pos:end] = data
+        self.pos = end
+
+    def clear(self):
+        self.pos = 0
+
+    def add(self, shop, bill, items, values, width=BILL_WIDTH):
+        """Append one receipt after whatever the buffer holds"""
+        self.put(escpos_heading(shop, width))
+        self.put(escpos_lines(bill_body(shop, bill, items, values, width)))
+        self.put(ESC_FEED_CUT)
+
+    def contents(self):
+        """What the buffer holds, as a memoryview; release it (use `with`) before building again"""
+        return self.view[:self.pos]
+
+    def build(self, shop, bill, items, values, width=BILL_WIDTH):
+        """The receipt alone as a memoryview into the buffer, as contents()"""
+        self.clear()
+        self.add(shop, bill, items, values, width)
+        return self.contents()
+
+
+def write_receipt(data, target):
+    """Send receipt bytes to a printer device or file; returns the seconds it took.
+
+    The file is opened unbuffered and appended to, so a device gets one raw
+    write and a stand-in file collects receipts like a roll.
+    """
+    began = time.perf_counter()
+    with open(target, 'ab', buffering=0) as f:
+        view = memoryview(data)
+        while view:
+            view = view[f.write(view):]
+    return time.perf_counter() - began
+
+
+# ============ COUNTER API ============
+# HTTP/JSON for tablets on the shop LAN (`fertilizer_billing.py serve`):
+#   GET  /inventory?q=ure   items whose name starts with q
+#   POST /cart/price        {"items": [{"name", "quantity"}], "discount_rate", "tax_rate"}
+#   POST /bills             the same plus "payment_method" and "customer"
+#                           {"name", "phone", "address", "gstin"}
+# Carts are always re-priced from inventory, never from what the client sent.
+# Requests share one asyncio loop and its read connection (WAL lets reads run
+# alongside a write). Saves queue up for a single writer thread, which commits
+# whatever has queued in one transaction, one savepoint per bill so a bad bill
+# does not sink the others.
+API_HOST = '127.0.0.1'
+API_PORT = 8765
+API_MAX_BODY = 64 * 1024
+API_WRITE_BATCH = 32
+API_LOOKUP_LIMIT = 50
+API_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+              409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+api_log = logging.getLogger('fertilizer_billing.api')
+
+
+def cart_lines(cur, items):
+    """[{'name', 'quantity'}] -> cart lines priced from inventory, merged and stock-checked like add_to_cart"""
+    if not isinstance(items, list) or not items:
+        raise BillError("Cart is empty!")
+    lines = {}
+    for entry in items:
+        name = entry.get('name') if isinstance(entry, dict) else None
+        quantity = entry.get('quantity') if isinstance(entry, dict) else None
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+            raise BillError(f"Please enter a valid quantity for {name}!")
+        line = lines.get(name)
+        if line is None:
+            cur.execute('SELECT price, stock, gst_rate, hsn FROM inventory WHERE name = ?', (name,))
+            row = cur.fetchone()
+            if row is None:
+                raise BillError(f"Unknown item: {name}")
+            line = lines[name] = {'name': name, 'quantity': 0, 'price': row[0], 'total': 0,
+                                  'gst_rate': row[2], 'hsn': row[3] or '', 'stock': row[1]}
+        line['quantity'] += quantity
+        if line['quantity'] > line['stock']:
+            raise BillError(f"Only {line['stock']} units of {name} available!")
+        line['total'] = line['quantity'] * line['price']
+    return list(lines.values())
+
+
+def price_request(cur, payload):
+    """Cart lines and totals for an API request body, with the shop's default GST % when none is given"""
+    if not isinstance(payload, dict):
+        raise BillError("Expected a JSON object")
+    cur.execute('SELECT default_tax FROM settings WHERE id = 1')
+    row = cur.fetchone()
+    rates = []
+    for key, default in (('discount_rate', 0), ('tax_rate', row[0] if row and row[0] is not None else 18)):
+        rate = payload.get(key, default)
+        if isinstance(rate, bool) or not isinstance(rate, (int, float)) or not 0 <= rate <= 100:
+            raise BillError(f"{key} must be a percentage")
+        rates.append(float(rate))
+    lines = cart_lines(cur, payload.get('items'))
+    return lines, price_bill(lines, *rates)
+
+
+def priced_cart_json(lines, values):
+    return {
+        'lines': [{'name': item['name'], 'quantity': item['quantity'], 'price': item['price'],
+                   'total': round(item['total'], 2), 'gst_rate': item['line_rate'], 'hsn': item['hsn'],
+                   'tax': round(item['tax'], 2)} for item in lines],
+        'subtotal': round(values['subtotal'], 2),
+        'discount_amount': round(values['discount_amount'], 2),
+        'gst': [{'rate': rate, 'taxable': round(taxable, 2), 'cgst': cgst, 'sgst': sgst}
+                for rate, taxable, cgst, sgst in values['gst_slabs']],
+        'tax_amount': round(values['tax_amount'], 2),
+        'total': round(values['total'], 2),
+    }
+
+
+class CounterAPI:
+    """Request handlers plus the single bill writer behind `serve`"""
+
+    def __init__(self, db_path=DB_PATH, batch=API_WRITE_BATCH):
+        self.db_path = db_path
+        self.batch = batch
+        self.conn = None
+        self.writes = None
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bill-writer')
+        self.writer_conn = None
+        self.alerts = []
+
+    async def start(self, host=API_HOST, port=API_PORT):
+        self.conn = sqlite3.connect(self.db_path, timeout=30)
+        ensure_schema(self.conn)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        await asyncio.get_running_loop().run_in_executor(self.writer, self._open_writer)
+        self.writes = asyncio.Queue()
+        self.write_task = asyncio.create_task(self._write_loop())
+        return await asyncio.start_server(self._serve_client, host, port)
+
+    def close(self):
+        self.write_task.cancel()
+        self.writer.submit(self.writer_conn.close).result()
+        self.writer.shutdown()
+        self.conn.close()
+
+    # --- writer thread ---
+    def _open_writer(self):
+        # autocommit mode, so the BEGIN/SAVEPOINT below are exactly what runs
+        self.writer_conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        install_stock_alerts(self.writer_conn, lambda *alert: self.alerts.append(alert))
+
+    def _save(self, cur, payload):
+        lines, values = price_request(cur, payload)
+        payment_method = payload.get('payment_method', 'Cash')
+        if payment_method not in PAYMENT_METHODS:
+            raise BillError(f"payment_method must be one of {', '.join(PAYMENT_METHODS)}")
+        customer = payload.get('customer') or {}
+        if not isinstance(customer, dict):
+            raise BillError("customer must be an object")
+        bill_id, invoice_number = save_bill(
+            cur, lines, values, payment_method,
+            customer=tuple(str(customer.get(key) or '') for key in ('name', 'phone', 'address', 'gstin')))
+        return {'bill_id': bill_id, 'invoice_number': invoice_number, **priced_cart_json(lines, values)}
+
+    def _write_bills(self, payloads):
+        """Save each queued bill under its own savepoint and commit them together"""
+        cur = self.writer_conn.cursor()
+        results = []
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            for payload in payloads:
+                self.alerts.clear()
+                cur.execute('SAVEPOINT bill')
+                try:
+                    result = self._save(cur, payload)
+                    result['low_stock'] = [{'name': name, 'stock': stock, 'reorder_level': level}
+                                           for name, stock, level in self.alerts]
+                except Exception as e:
+                    cur.execute('ROLLBACK TO bill')
+                    result = e
+                cur.execute('RELEASE bill')
+                results.append(result)
+            cur.execute('COMMIT')
+        except BaseException:
+            if self.writer_conn.in_transaction:
+                cur.execute('ROLLBACK')
+            raise
+        return results
+
+    # --- event loop ---
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self.writes.get()]
+            while len(jobs) < self.batch and not self.writes.empty():
+                jobs.append(self.writes.get_nowait())
+            try:
+                results = await loop.run_in_executor(self.writer, self._write_bills, [p for p, _ in jobs])
+            except Exception as e:
+                results = [e] * len(jobs)
+            for (_, future), result in zip(jobs, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def save(self, payload):
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((payload, future))
+        result = await future
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def lookup(self, prefix):
+        cur = self.conn.execute(f'''
+            SELECT name, category, price, stock, unit, gst_rate, hsn FROM inventory
+            WHERE name LIKE ? ESCAPE '\\' ORDER BY name LIMIT {API_LOOKUP_LIMIT}
+        ''', (escape_like(prefix) + '%',))
+        keys = ('name', 'category', 'price', 'stock', 'unit', 'gst_rate', 'hsn')
+        return [dict(zip(keys, row)) for row in cur]
+
+    async def dispatch(self, method, target, body):
+        """(status, JSON-able body) for one request"""
+        path, _, query = target.partition('?')
+        routes = {'/inventory': 'GET', '/cart/price': 'POST', '/bills': 'POST'}
+        if path not in routes:
+            return 404, {'error': f"no such endpoint: {path}"}
+        if method != routes[path]:
+            return 405, {'error': f"use {routes[path]} for {path}"}
+        try:
+            if path == '/inventory':
+                return 200, {'items': self.lookup(parse_qs(query).get('q', [''])[0])}
+            payload = json.loads(body or b'{}')
+            if path == '/cart/price':
+                return 200, priced_cart_json(*price_request(self.conn.cursor(), payload))
+            return 200, await self.save(payload)
+        except (BillError, json.JSONDecodeError, UnicodeDecodeError) as e:
+            return 400, {'error': str(e)}
+        except sqlite3.IntegrityError as e:
+            return 409, {'error': str(e)}
+        except Exception as e:
+            api_log.exception('%s %s failed', method, path)
+            return 500, {'error': str(e)}
+
+    async def _serve_client(self, reader, writer):
+        """Minimal HTTP/1.1 with keep-alive; enough for the tablets' fetch() calls"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                if length > API_MAX_BODY:
+                    status, payload = 413, {'error': 'request too large'}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, payload = await self.dispatch(method, target, body)
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                data = json.dumps(payload).encode('utf-8')
+                writer.write((f"HTTP/1.1 {status} {API_STATUS[status]}\r\n"
+                              f"Content-Type: application/json\r\n"
+                              f"Content-Length: {len(data)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def serve_counter_api(db_path=DB_PATH, host=API_HOST, port=API_PORT):
+    """Run the counter API until interrupted; port 0 picks a free port"""
+    async def main():
+        api = CounterAPI(db_path)
+        server = await api.start(host, port)
+        print(f"Counter API on http://{host}:{server.sockets[0].getsockname()[1]}", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            api.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+# ============ BRANCH SYNC ============
+# Branches exchange delta files instead of whole databases. Once a database has
+# a node name (`sync init --node B1`), triggers note every write to inventory,
+# customers and bills in `changelog` under the node's own sequence number;
+# bill_items writes count as a change to their bill, and back-to-back writes to
+# the same row collapse into one entry. An export carries each changed row's
+# current state once, stamped with its latest change, so a file's size and the
+# time to make or apply it follow the number of changed rows, not the size of
+# the database. Every branch settles conflicts the same way:
+#   - the newest stamp wins (UTC to the millisecond, then node name);
+#   - a bill is only ever changed by the branch that made it (bills.origin);
+#   - stock and credit balances stay with each branch: they are never synced,
+#     and a remote delete is skipped while the row still has stock, a balance
+#     or bills here.
+SYNC_FORMAT = 'fertilizer-sync'
+SYNC_TABLES = ('inventory', 'customers', 'bills')
+SYNC_KEYS = {'inventory': 'name', 'customers': 'phone', 'bills': 'invoice_number'}
+SYNC_COLUMNS = {
+    'inventory': ('name', 'price', 'category', 'unit', 'description', 'reorder_level', 'gst_rate', 'hsn',
+                  'barcode'),
+    'customers': ('name', 'phone', 'address', 'gstin'),
+    'bills': ('invoice_number', 'subtotal', 'discount_rate', 'discount_amount', 'tax_rate', 'tax_amount',
+              'total_amount', 'payment_method', 'created_at'),
+}
+SYNC_ITEM_COLUMNS = ('item_name', 'quantity', 'price', 'total', 'gst_rate', 'hsn', 'taxable', 'tax')
+
+
+class SyncError(ValueError):
+    """A sync request that cannot be carried out here; the message says why"""
+
+
+def install_sync_triggers(conn):
+    """Create the change-capture triggers; they stay idle until the database has a node name"""
+    item_bill = "(SELECT invoice_number FROM bills WHERE id = {}.bill_id)"
+    triggers = []
+    for tbl in ('inventory', 'customers'):
+        key = SYNC_KEYS[tbl]
+        update = f"UPDATE OF {', '.join(SYNC_COLUMNS[tbl])} ON {tbl}"
+        triggers += [(f'{tbl}_ins', f'INSERT ON {tbl}', tbl, f'NEW.{key}', ''),
+                     (f'{tbl}_upd', update, tbl, f'NEW.{key}', ''),
+                     (f'{tbl}_rekey', update, tbl, f'OLD.{key}', f' AND OLD.{key} IS NOT NEW.{key}'),
+                     (f'{tbl}_del', f'DELETE ON {tbl}', tbl, f'OLD.{key}', '')]
+    triggers += [('bills_ins', 'INSERT ON bills', 'bills', 'NEW.invoice_number', ''),
+                 ('bills_upd', 'UPDATE ON bills', 'bills', 'NEW.invoice_number', ''),
+                 ('bills_del', 'DELETE ON bills', 'bills', 'OLD.invoice_number', ''),
+                 ('bill_items_ins', 'INSERT ON bill_items', 'bills', item_bill.format('NEW'), ''),
+                 ('bill_items_upd', 'UPDATE ON bill_items', 'bills', item_bill.format('NEW'), ''),
+                 ('bill_items_del', 'DELETE ON bill_items', 'bills', item_bill.format('OLD'), '')]
+    for name, event, tbl, key, extra in triggers:
+        # the previous entry is dropped when it was the same row, so a bill and
+        # its items saved together leave one entry under a fresh number
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS sync_{name} AFTER {event}
+            WHEN (SELECT capture FROM sync_node) = 1 AND {key} IS NOT NULL AND {key} != ''{extra}
+            BEGIN
+                UPDATE sync_node SET seq = seq + 1;
+                DELETE FROM changelog WHERE origin = (SELECT node FROM sync_node)
+                    AND seq = (SELECT seq - 1 FROM sync_node) AND tbl = '{tbl}' AND key = {key};
+                INSERT INTO changelog (origin, seq, tbl, key, at)
+                    SELECT node, seq, '{tbl}', {key}, strftime('%Y-%m-%d %H:%M:%f', 'now') FROM sync_node;
+            END
+        ''')
+
+
+def local_node(conn):
+    """This database's node name, or None before `sync init`"""
+    row = conn.execute('SELECT node FROM sync_node WHERE id = 1').fetchone()
+    return row[0] if row else None
+
+
+def init_sync_node(conn, node):
+    """Name this database's node; changes are captured from then on"""
+    node = node.strip().upper()
+    if not re.fullmatch(r'[A-Z0-9]{1,8}', node):
+        raise SyncError("A node name is 1-8 letters or digits, e.g. B1")
+    current = local_node(conn)
+    if current and current != node:
+        raise SyncError(f"This database is already node {current}")
+    conn.execute('INSERT OR IGNORE INTO sync_node (id, node) VALUES (1, ?)', (node,))
+    conn.commit()
+    return node
+
+
+def set_capture(conn, on):
+    """Switch change capture for the current transaction, e.g. while applying remote changes"""
+    conn.execute('UPDATE sync_node SET capture = ?', (1 if on else 0,))
+
+
+def _require_node(conn):
+    node = local_node(conn)
+    if not node:
+        raise SyncError("Name this branch first: fertilizer_billing.py sync init --node <NAME>")
+    return node
+
+
+def _bill_schemas(conn):
+    """'main', then every archive, attached only once iteration gets past main"""
+    yield 'main'
+    yield from attach_archives(conn)
+
+
+def _sync_row(cur, node, tbl, key):
+    """Current state of a synced row, or None once it is deleted"""
+    columns = SYNC_COLUMNS[tbl]
+    if tbl != 'bills':
+        cur.execute(f"SELECT {', '.join(columns)} FROM {tbl} WHERE {SYNC_KEYS[tbl]} = ?", (key,))
+        row = cur.fetchone()
+        return dict(zip(columns, row)) if row else None
+    # a bill archived since its change was logged is still there to send, only
+    # moved; the archives are attached only for a bill that main no longer has
+    for schema in _bill_schemas(cur.connection):
+        origin = 'b.origin' if schema == 'main' or 'origin' in table_columns(cur.connection, 'bills', schema) else 'NULL'
+        cur.execute(f'''
+            SELECT {', '.join('b.' + c for c in columns)}, b.id, COALESCE({origin}, ?), c.phone
+            FROM {schema}.bills b LEFT JOIN main.customers c ON c.id = b.customer_id
+            WHERE b.invoice_number = ?
+        ''', (node, key))
+        row = cur.fetchone()
+        if row is not None:
+            break
+    else:
+        return None
+    state = dict(zip(columns, row))
+    bill_id, state['origin'], state['customer_phone'] = row[len(columns):]
+    cur.execute(f"SELECT {', '.join(SYNC_ITEM_COLUMNS)} FROM {schema}.bill_items WHERE bill_id = ? ORDER BY id",
+                (bill_id,))
+    state['items'] = [list(item) for item in cur.fetchall()]
+    return state
+
+
+def export_changes(conn, peer, path, resend=False):
+    """Write everything `peer` has not been sent yet into the delta file `path`; returns counts.
+
+    resend starts over from the beginning of the change log, for when a
+    file went missing.
+    """
+    node = _require_node(conn)
+    peer = peer.strip().upper()
+    if peer == node:
+        raise SyncError("A branch does not sync with itself")
+    began = time.perf_counter()
+    cur = conn.cursor()
+    cur.execute('SELECT origin, seq FROM sync_peers WHERE peer = ?', (peer,))
+    sent = {} if resend else dict(cur.fetchall())
+    cur.execute('SELECT seq FROM sync_node WHERE id = 1')
+    tops = {node: cur.fetchone()[0]}
+    cur.execute('SELECT origin, seq FROM sync_seen')
+    for origin, seen in cur.fetchall():
+        cur.execute('SELECT MAX(seq) FROM changelog WHERE origin = ?', (origin,))
+        tops[origin] = max(seen, cur.fetchone()[0] or 0)
+
+    ranges, keys = {}, set()
+    for origin, top in tops.items():
+        low = sent.get(origin, 0)
+        if origin == peer or top <= low:
+            continue
+        ranges[origin] = [low, top]
+        cur.execute('SELECT tbl, key FROM changelog WHERE origin = ? AND seq > ? AND seq <= ?', (origin, low, top))
+        keys.update(cur.fetchall())
+
+    changes = []
+    for tbl, key in keys:
+        cur.execute('''SELECT origin, seq, at FROM changelog WHERE tbl = ? AND key = ?
+                       ORDER BY at DESC, origin DESC LIMIT 1''', (tbl, key))
+        origin, seq, at = cur.fetchone()
+        if origin != peer:
+            # the peer made the latest change itself, so it has this state already
+            changes.append((SYNC_TABLES.index(tbl), at, tbl, key, origin, seq))
+    changes.sort()
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"format": %s, "version": 1, "node": %s, "peer": %s, "ranges": %s, "changes": ['
+                % (json.dumps(SYNC_FORMAT), json.dumps(node), json.dumps(peer), json.dumps(ranges)))
+        for n, (_, at, tbl, key, origin, seq) in enumerate(changes):
+            f.write(',\n' if n else '\n')
+            json.dump({'tbl': tbl, 'key': key, 'origin': origin, 'seq': seq, 'at': at,
+                       'row': _sync_row(cur, node, tbl, key)}, f)
+        f.write('\n]}\n')
+    cur.executemany('''INSERT INTO sync_peers (peer, origin, seq) VALUES (?, ?, ?)
+                       ON CONFLICT(peer, origin) DO UPDATE SET seq = excluded.seq''',
+                    [(peer, origin, top) for origin, (_, top) in ranges.items()])
+    conn.commit()
+    return {'changes': len(changes), 'bytes': os.path.getsize(path), 'seconds': time.perf_counter() - began}
+
+
+def _apply_row(cur, node, tbl, key, origin, row):
+    """Bring one row to the incoming state; returns a conflict message when a rule keeps the local row"""
+    if tbl == 'inventory':
+        if row is None:
+            cur.execute('DELETE FROM inventory WHERE name = ? AND stock <= 0', (key,))
+            cur.execute('SELECT stock FROM inventory WHERE name = ?', (key,))
+            left = cur.fetchone()
+            return f"kept item {key}: {left[0]} still in stock here" if left else None
+        if row.get('barcode'):
+            cur.execute('SELECT name FROM inventory WHERE barcode = ? AND name != ?', (row['barcode'], key))
+            taken = cur.fetchone()
+            if taken:
+                return f"kept item {key} as is: barcode {row['barcode']} belongs to {taken[0]} here"
+        columns = SYNC_COLUMNS['inventory']
+        cur.execute(f'''
+            INSERT INTO inventory (stock, {', '.join(columns)}) VALUES (0, {', '.join('?' * len(columns))})
+            ON CONFLICT(name) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns[1:])}
+        ''', [row.get(c) for c in columns])
+        return None
+
+    if tbl == 'customers':
+        if row is None:
+            cur.execute('''DELETE FROM customers WHERE phone = ? AND ABS(balance) < 0.005
+                           AND NOT EXISTS (SELECT 1 FROM bills WHERE bills.customer_id = customers.id)''', (key,))
+            cur.execute('SELECT 1 FROM customers WHERE phone = ?', (key,))
+            return f"kept customer {key}: has bills or a balance here" if cur.fetchone() else None
+        columns = SYNC_COLUMNS['customers']
+        cur.execute(f'''
+            INSERT INTO customers ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+            ON CONFLICT(phone) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns if c != 'phone')}
+        ''', [row[c] for c in columns])
+        return None
+
+    cur.execute('SELECT id, COALESCE(origin, ?) FROM bills WHERE invoice_number = ?', (node, key))
+    local = cur.fetchone()
+    owner = row['origin'] if row else (local[1] if local else origin)
+    if owner != origin:
+        return f"ignored change to bill {key} from {origin}: it belongs to {owner}"
+    if local and local[1] != owner:
+        return f"bill {key} from {owner} clashes with this branch's own bill {key}"
+    if local:
+        rollup_bill(cur, local[0], -1)
+        cur.execute('DELETE FROM bill_items WHERE bill_id = ?', (local[0],))
+    if row is None:
+        if local:
+            cur.execute('DELETE FROM bills WHERE id = ?', (local[0],))
+        return None
+    customer_id = None
+    if row.get('customer_phone'):
+        cur.execute('SELECT id FROM customers WHERE phone = ?', (row['customer_phone'],))
+        found = cur.fetchone()
+        customer_id = found[0] if found else None
+    columns = SYNC_COLUMNS['bills']
+    values = [row[c] for c in columns] + [customer_id, owner]
+    if local:
+        bill_id = local[0]
+        cur.execute(f'''UPDATE bills SET {', '.join(f'{c} = ?' for c in columns)}, customer_id = ?, origin = ?
+                        WHERE id = ?''', values + [bill_id])
+    else:
+        cur.execute(f'''INSERT INTO bills ({', '.join(columns)}, customer_id, origin)
+                        VALUES ({', '.join('?' * (len(columns) + 2))})''', values)
+        bill_id = cur.lastrowid
+    cur.executemany(f'''INSERT INTO bill_items (bill_id, {', '.join(SYNC_ITEM_COLUMNS)})
+                        VALUES (?, {', '.join('?' * len(SYNC_ITEM_COLUMNS))})''',
+                    [[bill_id] + item for item in row['items']])
+    rollup_bill(cur, bill_id, 1)
+    return None
+
+
+def apply_changes(conn, path):
+    """Apply a delta file from another branch in one transaction; returns counts.
+
+    Applying a file again, or one that overlaps what is already here, changes
+    nothing. A file that starts after changes this branch never received is
+    refused, so nothing is skipped silently.
+    """
+    node = _require_node(conn)
+    began = time.perf_counter()
+    with open(path, encoding='utf-8') as f:
+        delta = json.load(f)
+    if delta.get('format') != SYNC_FORMAT or delta.get('version') != 1:
+        raise SyncError(f"{path} is not a sync file")
+    if delta['peer'] != node:
+        raise SyncError(f"This file is for node {delta['peer']}, but this database is node {node}")
+    cur = conn.cursor()
+    cur.execute('SELECT origin, seq FROM sync_seen')
+    seen = dict(cur.fetchall())
+    ranges = {origin: r for origin, r in delta['ranges'].items() if origin != node}
+    missing = [f"{origin} {seen.get(origin, 0) + 1}-{low}" for origin, (low, _) in ranges.items()
+               if low > seen.get(origin, 0)]
+    if missing:
+        raise SyncError(f"Changes missing before this file ({', '.join(missing)}); "
+                        f"ask {delta['node']} to export again with --resend")
+    stats = {'applied': 0, 'skipped': 0, 'conflicts': [], 'seconds': 0.0}
+    if all(top <= seen.get(origin, 0) for origin, (_, top) in ranges.items()):
+        stats['skipped'] = len(delta['changes'])
+        return stats
+
+    try:
+        set_capture(conn, False)
+        for change in delta['changes']:
+            tbl, key, origin, at = change['tbl'], change['key'], change['origin'], change['at']
+            if tbl not in SYNC_TABLES:
+                raise SyncError(f"Unknown table in sync file: {tbl}")
+            cur.execute('''SELECT at, origin FROM changelog WHERE tbl = ? AND key = ?
+                           ORDER BY at DESC, origin DESC LIMIT 1''', (tbl, key))
+            latest = cur.fetchone()
+            if origin == node or (latest and tuple(latest) >= (at, origin)):
+                stats['skipped'] += 1
+                continue
+            conflict = _apply_row(cur, node, tbl, key, origin, change['row'])
+            if conflict:
+                stats['conflicts'].append(conflict)
+                continue
+            cur.execute('INSERT OR IGNORE INTO changelog (origin, seq, tbl, key, at) VALUES (?, ?, ?, ?, ?)',
+                        (origin, change['seq'], tbl, key, at))
+            cur.execute('INSERT OR IGNORE INTO sync_seen (origin, seq) VALUES (?, 0)', (origin,))
+            stats['applied'] += 1
+        cur.executemany('''INSERT INTO sync_seen (origin, seq) VALUES (?, ?)
+                           ON CONFLICT(origin) DO UPDATE SET seq = MAX(seq, excluded.seq)''',
+                        [(origin, top) for origin, (_, top) in ranges.items()])
+        set_capture(conn, True)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    stats['seconds'] = time.perf_counter() - began
+    return stats
+
+
+def sync_status(conn):
+    """(node, local sequence, {origin: seen}, {peer: local changes not yet sent})"""
+    node = _require_node(conn)
+    seq = conn.execute('SELECT seq FROM sync_node WHERE id = 1').fetchone()[0]
+    seen = dict(conn.execute('SELECT origin, seq FROM sync_seen ORDER BY origin'))
+    pending = {}
+    for peer, sent in conn.execute('SELECT peer, seq FROM sync_peers WHERE origin = ? ORDER BY peer', (node,)):
+        pending[peer] = conn.execute('SELECT COUNT(*) FROM changelog WHERE origin = ? AND seq > ?',
+                                     (node, sent)).fetchone()[0]
+    return node, seq, seen, pending
+
+
+class FertilizerBillingApp:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("🌱 Fertilizer Shop Billing System")
+        self.root.geometry("1300x850")
+        self.root.configure(bg="#1a1a2e")
+
+        # Instrumentation must wrap handlers before widgets capture them as commands
+        self.instr = Instrumentation(enabled=os.environ.get('FERTILIZER_INSTRUMENT') == '1')
+        for name in INSTRUMENTED_HANDLERS:
+            setattr(self, name, self.instr.wrap(name, getattr(self, name)))
+
+        # Initialize database
+        self.init_database()
+        
+        # Variables
+        self._bg_results = queue.Queue()
+        self._bg_pending = 0
+        self._preview_pending = None
+        self.scan_started = None
+        self.scan_latency = LatencyHistogram()
+        # buffers not out at the printer; a second only while a slow write is under way
+        self.receipt_buffers = [ReceiptBuffer()]
+        self.cart_items = []
+        self.drafts = DraftLog(DB_PATH)
+        self.cart_journal = CartJournal(listener=self.drafts.log)
+        self.invoice_number = self.generate_invoice_number()
+        self.calculated_values = {
+            'subtotal': 0, 'discount_rate': 0, 'discount_amount': 0,
+            'tax_rate': 18, 'tax_amount': 0, 'total': 0
+        }
+        
+        # Colors
+        self.colors = {
+            'primary': '#4CAF50',
+            'secondary': '#2196F3',
+            'danger': '#f44336',
+            'warning': '#ff9800',
+            'dark': '#1a1a2e',
+            'light': '#eaeaea',
+            'card': '#16213e',
+            'text': '#ffffff',
+            'success': '#00c853',
+            'purple': '#9c27b0'
+        }
+        
+        # Create UI
+        self.create_header()
+        self.create_main_content()
+        self.create_footer()
+        
+        # Load inventory
+        self.load_inventory()
+        
+        # Shortcuts
+        self.root.bind('<Control-n>', lambda e: self.new_bill())
+        self.root.bind('<Control-s>', lambda e: self.save_bill_to_db())
+        self.root.bind('<F5>', lambda e: self.load_inventory())
+        self.root.bind('<Control-f>', lambda e: self.show_bill_search_window())
+        self.root.bind('<F12>', lambda e: self.show_diagnostics_window())
+        self.root.bind('<F2>', lambda e: self.scan_entry.focus_set())
+        self.root.bind('<Control-z>', lambda e: self.undo_cart())
+        self.root.bind('<Control-y>', lambda e: self.redo_cart())
+        self.scan_entry.focus_set()
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
+        self.root.after(BACKUP_INTERVAL_MS, self.scheduled_backup)
+        # editing state for bills
+        self.editing_bill_id = None
+        self.restore_draft()
+
+    def on_close(self):
+        self.instr.dump()
+        self.drafts.close()
+        if self.query_profiler:
+            self.query_profiler.close()
+        self.root.destroy()
+
+    def init_database(self):
+        """Initialize SQLite database"""
+        self.conn = sqlite3.connect(DB_PATH)
+        self.cursor = self.instr.wrap_cursor(self.conn.cursor())
+        self.query_profiler = None
+        if os.environ.get('FERTILIZER_QUERY_LOG') == '1':
+            self.query_profiler = QueryProfiler(self.conn)
+
+        # Warm start costs one PRAGMA; migrations run only when the file is behind
+        ensure_schema(self.conn)
+        self.pending_stock_alerts = []
+        install_stock_alerts(self.conn, lambda *alert: self.pending_stock_alerts.append(alert))
+
     def generate_invoice_number(self):
-        date_str = datetime.now().strftime("%Y%m%d")
-        self.cursor.execute('SELECT COUNT(*) FROM bills WHERE DATE(created_at) = DATE("now")')
-        count = self.cursor.fetchone()[0] + 1
-        return f"INV-{date_str}-{count:04d}"
+        return next_invoice_number(self.cursor)
     
     def create_header(self):
         header_frame = tk.Frame(self.root, bg=self.colors['dark'], pady=10)
@@ -240,6 +4019,14 @@ class FertilizerBillingApp:
                               cursor='hand2', padx=15, pady=8)
         report_btn.pack(side='left', padx=5)
         
+        # Credit Ledger Button
+        credit_btn = tk.Button(btn_frame, text="CREDIT",
+                              command=self.show_credit_window,
+                              bg=self.colors['danger'], fg='white',
+                              font=('Helvetica', 11, 'bold'),
+                              cursor='hand2', padx=15, pady=8)
+        credit_btn.pack(side='left', padx=5)
+        
         # Settings Button
         settings_btn = tk.Button(btn_frame, text="SETTINGS",
                                 command=self.show_settings,
@@ -314,6 +4101,16 @@ class FertilizerBillingApp:
                 fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=(10, 0))
         self.customer_address = tk.Entry(row1, font=('Helvetica', 10), width=25)
         self.customer_address.pack(side='left', padx=(5, 0))
+        
+        row2 = tk.Frame(customer_frame, bg=self.colors['card'])
+        row2.pack(fill='x', pady=3)
+        
+        tk.Label(row2, text="GSTIN:", font=('Helvetica', 10),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left')
+        self.customer_gstin = tk.Entry(row2, font=('Helvetica', 10), width=18)
+        self.customer_gstin.pack(side='left', padx=(5, 5))
+        tk.Label(row2, text="(registered dealers only - billed as B2B)", font=('Helvetica', 9),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left')
     
     def create_item_selection(self, parent):
         item_frame = tk.LabelFrame(parent, text=" Add Items to Cart ",
@@ -323,6 +4120,23 @@ class FertilizerBillingApp:
                                   pady=8, padx=8)
         item_frame.pack(fill='x', padx=10, pady=8)
         
+        # Row 0 - Barcode scanner
+        row0 = tk.Frame(item_frame, bg=self.colors['card'])
+        row0.pack(fill='x', pady=5)
+        
+        tk.Label(row0, text="Scan Barcode:", font=('Helvetica', 10, 'bold'),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left')
+        
+        self.scan_entry = tk.Entry(row0, font=('Helvetica', 11), width=24)
+        self.scan_entry.pack(side='left', padx=10)
+        self.scan_entry.bind('<Key>', self.on_scan_key)
+        for key in ('<Return>', '<KP_Enter>', '<Tab>'):
+            self.scan_entry.bind(key, self.scan_barcode)
+        
+        self.scan_status = tk.Label(row0, text="F2 to scan", font=('Helvetica', 10),
+                                   fg=self.colors['light'], bg=self.colors['card'])
+        self.scan_status.pack(side='left', padx=5)
+        
         # Row 1 - Select from inventory
         row1 = tk.Frame(item_frame, bg=self.colors['card'])
         row1.pack(fill='x', pady=5)
@@ -475,6 +4289,18 @@ class FertilizerBillingApp:
                              font=('Helvetica', 9), cursor='hand2')
         clear_btn.pack(side='left', padx=5)
         
+        undo_btn = tk.Button(btn_frame, text="Undo",
+                            command=self.undo_cart,
+                            bg=self.colors['secondary'], fg='white',
+                            font=('Helvetica', 9), cursor='hand2')
+        undo_btn.pack(side='left', padx=5)
+        
+        redo_btn = tk.Button(btn_frame, text="Redo",
+                            command=self.redo_cart,
+                            bg=self.colors['secondary'], fg='white',
+                            font=('Helvetica', 9), cursor='hand2')
+        redo_btn.pack(side='left', padx=5)
+        
         # Cart summary
         self.cart_count_label = tk.Label(btn_frame, text="Items: 0",
                                         font=('Helvetica', 10, 'bold'),
@@ -529,7 +4355,7 @@ class FertilizerBillingApp:
                 fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=5)
         self.payment_var = tk.StringVar(value="Cash")
         
-        for method in ['Cash', 'Card', 'UPI', 'Credit']:
+        for method in PAYMENT_METHODS:
             rb = tk.Radiobutton(row2, text=method, variable=self.payment_var,
                                value=method, bg=self.colors['card'],
                                fg=self.colors['light'], selectcolor=self.colors['dark'],
@@ -575,34 +4401,90 @@ class FertilizerBillingApp:
         footer_frame = tk.Frame(self.root, bg=self.colors['dark'], pady=8)
         footer_frame.pack(fill='x', side='bottom')
         
-        self.cursor.execute('SELECT COUNT(*) FROM bills WHERE DATE(created_at) = DATE("now")')
-        today_bills = self.cursor.fetchone()[0]
-        
-        self.cursor.execute('SELECT COALESCE(SUM(total_amount), 0) FROM bills WHERE DATE(created_at) = DATE("now")')
-        today_sales = self.cursor.fetchone()[0]
-        
-        self.cursor.execute('SELECT COUNT(*) FROM inventory')
-        total_items = self.cursor.fetchone()[0]
-        
-        stats_label = tk.Label(footer_frame, 
-                              text=f"Today: {today_bills} Bills | Sales: Rs.{today_sales:.2f} | Inventory: {total_items} items",
+        # Stats are filled in after first paint so startup never waits on aggregates
+        self.stats_label = tk.Label(footer_frame,
+                              text="Today: ... | Loading stats ...",
                               font=('Helvetica', 10),
                               fg=self.colors['light'],
                               bg=self.colors['dark'])
-        stats_label.pack(side='left', padx=20)
+        self.stats_label.pack(side='left', padx=20)
+        self.root.after_idle(self.refresh_footer_stats)
         
-        help_label = tk.Label(footer_frame, text="Ctrl+N: New | Ctrl+S: Save | F5: Refresh",
+        help_label = tk.Label(footer_frame, text="Ctrl+N: New | Ctrl+S: Save | Ctrl+F: Find Bill | F5: Refresh | F12: Diagnostics",
                              font=('Helvetica', 9),
                              fg=self.colors['light'],
                              bg=self.colors['dark'])
         help_label.pack(side='right', padx=20)
     
+    def refresh_footer_stats(self):
+        """Recompute the footer totals on a worker connection and update the label when done"""
+        def work(conn):
+            today_bills, today_sales = conn.execute(TODAY_TOTALS_SQL).fetchone()
+            total_items = stock_valuation(conn.cursor())[0]
+            low_stock = conn.execute(LOW_STOCK_COUNT_SQL).fetchone()[0]
+            return today_bills, today_sales, total_items, low_stock
+
+        def done(result):
+            today_bills, today_sales, total_items, low_stock = result
+            text = f"Today: {today_bills} Bills | Sales: Rs.{today_sales:.2f} | Inventory: {total_items} items"
+            if low_stock:
+                text += f" | Low stock: {low_stock}"
+            self.stats_label.config(text=text)
+
+        self.run_in_background(work, done)
+
+    def show_stock_alerts(self):
+        """Warn about items that the last committed write took below their reorder level"""
+        alerts, self.pending_stock_alerts[:] = list(self.pending_stock_alerts), []
+        if alerts:
+            lines = [f"{name}: {stock} left (reorder at {level})" for name, stock, level in alerts]
+            messagebox.showwarning("Reorder Needed", "Stock fell below reorder level:\n\n" + "\n".join(lines))
+
+    def run_in_background(self, work, on_done=None, on_error=None):
+        """Run work(conn) on a thread with its own connection; callbacks run on the Tk thread"""
+        def runner():
+            try:
+                conn = sqlite3.connect(DB_PATH, timeout=30)
+                try:
+                    result = ('ok', work(conn))
+                finally:
+                    conn.close()
+            except Exception as e:
+                result = ('error', e)
+            self._bg_results.put((result, on_done, on_error))
+
+        self._bg_pending += 1
+        threading.Thread(target=runner, daemon=True).start()
+        if self._bg_pending == 1:
+            self.root.after(BG_POLL_MS, self._poll_background)
+
+    def _poll_background(self):
+        # Tk is not thread-safe, so workers hand results back through a queue
+        while True:
+            try:
+                (status, value), on_done, on_error = self._bg_results.get_nowait()
+            except queue.Empty:
+                break
+            self._bg_pending -= 1
+            if status == 'ok' and on_done:
+                on_done(value)
+            elif status == 'error' and on_error:
+                on_error(value)
+        if self._bg_pending:
+            self.root.after(BG_POLL_MS, self._poll_background)
+
+    def report_first_frame(self):
+        """Print time from interpreter start to the first idle, painted frame, then exit (startup benchmark)"""
+        self.root.update()
+        print(f"FIRST_FRAME_MS {(time.perf_counter() - PROCESS_START) * 1000.0:.1f}", flush=True)
+        self.root.after(0, self.root.destroy)
+
     # ============ ADD FERTILIZER WINDOW ============
     def show_add_fertilizer_window(self):
         """Show window to add new fertilizer with custom price"""
         window = tk.Toplevel(self.root)
         window.title("Add New Fertilizer")
-        window.geometry("500x550")
+        window.geometry("500x680")
         window.configure(bg=self.colors['card'])
         window.transient(self.root)
         window.grab_set()
@@ -672,6 +4554,27 @@ class FertilizerBillingApp:
         category_combo.set('Other')
         fields['category'] = category_combo
         
+        # GST slab and HSN code
+        tk.Label(form_frame, text="GST % (blank = bill GST %)  /  HSN Code", font=('Helvetica', 11, 'bold'),
+                fg=self.colors['light'], bg=self.colors['card']).pack(anchor='w', pady=(10, 2))
+        gst_frame = tk.Frame(form_frame, bg=self.colors['card'])
+        gst_frame.pack(anchor='w', pady=2)
+        gst_combo = ttk.Combobox(gst_frame, font=('Helvetica', 11), width=6, values=('',) + GST_SLABS)
+        gst_combo.pack(side='left')
+        fields['gst_rate'] = gst_combo
+        hsn_entry = tk.Entry(gst_frame, font=('Helvetica', 11), width=12)
+        hsn_entry.pack(side='left', padx=10)
+        fields['hsn'] = hsn_entry
+        
+        # Barcode
+        tk.Label(form_frame, text="Barcode (scan or type)", font=('Helvetica', 11, 'bold'),
+                fg=self.colors['light'], bg=self.colors['card']).pack(anchor='w', pady=(10, 2))
+        barcode_entry = tk.Entry(form_frame, font=('Helvetica', 11), width=24)
+        barcode_entry.pack(anchor='w', pady=2)
+        # a scanner's Enter should not do anything else here
+        barcode_entry.bind('<Return>', lambda e: 'break')
+        fields['barcode'] = barcode_entry
+        
         # Unit
         tk.Label(form_frame, text="Unit", font=('Helvetica', 11, 'bold'),
                 fg=self.colors['light'], bg=self.colors['card']).pack(anchor='w', pady=(10, 2))
@@ -704,6 +4607,9 @@ class FertilizerBillingApp:
                 category = fields['category'].get()
                 unit = fields['unit'].get()
                 description = fields['description'].get()
+                gst_rate = parse_gst_rate(fields['gst_rate'].get())
+                hsn = fields['hsn'].get().strip()
+                barcode = normalize_barcode(fields['barcode'].get())
                 
                 if not name:
                     messagebox.showerror("Error", "Please enter fertilizer name!")
@@ -714,9 +4620,9 @@ class FertilizerBillingApp:
                 
                 try:
                     self.cursor.execute('''
-                        INSERT INTO inventory (name, price, stock, category, unit, description)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (name, price, stock, category, unit, description))
+                        INSERT INTO inventory (name, price, stock, category, unit, description, gst_rate, hsn, barcode)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (name, price, stock, category, unit, description, gst_rate, hsn, barcode))
                     self.conn.commit()
                 except sqlite3.OperationalError as oe:
                     # If column missing, try to add it and retry once
@@ -725,9 +4631,9 @@ class FertilizerBillingApp:
                             self.cursor.execute("ALTER TABLE inventory ADD COLUMN description TEXT")
                             self.conn.commit()
                             self.cursor.execute('''
-                                INSERT INTO inventory (name, price, stock, category, unit, description)
-                                VALUES (?, ?, ?, ?, ?, ?)
-                            ''', (name, price, stock, category, unit, description))
+                                INSERT INTO inventory (name, price, stock, category, unit, description, gst_rate, hsn, barcode)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            ''', (name, price, stock, category, unit, description, gst_rate, hsn, barcode))
                             self.conn.commit()
                         except Exception:
                             raise
@@ -740,8 +4646,11 @@ class FertilizerBillingApp:
                 
             except ValueError:
                 messagebox.showerror("Error", "Please enter valid numbers for price and stock!")
-            except sqlite3.IntegrityError:
-                messagebox.showerror("Error", "This fertilizer already exists!")
+            except sqlite3.IntegrityError as e:
+                if 'barcode' in str(e):
+                    messagebox.showerror("Error", "This barcode is already on another fertilizer!")
+                else:
+                    messagebox.showerror("Error", "This fertilizer already exists!")
         
         def save_and_add_more():
             try:
@@ -751,6 +4660,9 @@ class FertilizerBillingApp:
                 category = fields['category'].get()
                 unit = fields['unit'].get()
                 description = fields['description'].get()
+                gst_rate = parse_gst_rate(fields['gst_rate'].get())
+                hsn = fields['hsn'].get().strip()
+                barcode = normalize_barcode(fields['barcode'].get())
                 
                 if not name or price <= 0:
                     messagebox.showerror("Error", "Please fill required fields!")
@@ -758,9 +4670,9 @@ class FertilizerBillingApp:
                 
                 try:
                     self.cursor.execute('''
-                        INSERT INTO inventory (name, price, stock, category, unit, description)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (name, price, stock, category, unit, description))
+                        INSERT INTO inventory (name, price, stock, category, unit, description, gst_rate, hsn, barcode)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (name, price, stock, category, unit, description, gst_rate, hsn, barcode))
                     self.conn.commit()
                 except sqlite3.OperationalError as oe:
                     if 'no column named description' in str(oe).lower():
@@ -768,9 +4680,9 @@ class FertilizerBillingApp:
                             self.cursor.execute("ALTER TABLE inventory ADD COLUMN description TEXT")
                             self.conn.commit()
                             self.cursor.execute('''
-                                INSERT INTO inventory (name, price, stock, category, unit, description)
-                                VALUES (?, ?, ?, ?, ?, ?)
-                            ''', (name, price, stock, category, unit, description))
+                                INSERT INTO inventory (name, price, stock, category, unit, description, gst_rate, hsn, barcode)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            ''', (name, price, stock, category, unit, description, gst_rate, hsn, barcode))
                             self.conn.commit()
                         except Exception:
                             raise
@@ -784,12 +4696,16 @@ class FertilizerBillingApp:
                 fields['name'].delete(0, tk.END)
                 fields['price'].delete(0, tk.END)
                 fields['description'].delete(0, tk.END)
+                fields['barcode'].delete(0, tk.END)
                 fields['name'].focus()
                 
             except ValueError:
                 messagebox.showerror("Error", "Please enter valid numbers!")
-            except sqlite3.IntegrityError:
-                messagebox.showerror("Error", "This fertilizer already exists!")
+            except sqlite3.IntegrityError as e:
+                if 'barcode' in str(e):
+                    messagebox.showerror("Error", "This barcode is already on another fertilizer!")
+                else:
+                    messagebox.showerror("Error", "This fertilizer already exists!")
         
         tk.Button(btn_frame, text="SAVE", command=save_fertilizer,
                  bg=self.colors['success'], fg='white',
@@ -811,7 +4727,7 @@ class FertilizerBillingApp:
         """Show window to edit fertilizer prices"""
         window = tk.Toplevel(self.root)
         window.title("Edit Fertilizer Prices")
-        window.geometry("750x550")
+        window.geometry("1000x600")
         window.configure(bg=self.colors['card'])
         window.transient(self.root)
         window.grab_set()
@@ -837,7 +4753,7 @@ class FertilizerBillingApp:
         tree_frame = tk.Frame(window, bg=self.colors['card'])
         tree_frame.pack(fill='both', expand=True, padx=20, pady=10)
         
-        columns = ('ID', 'Name', 'Current Price', 'Stock', 'Category')
+        columns = ('ID', 'Name', 'Current Price', 'Stock', 'Category', 'GST %', 'HSN', 'Barcode')
         tree = ttk.Treeview(tree_frame, columns=columns, show='headings', height=12)
         
         tree.heading('ID', text='ID')
@@ -845,12 +4761,18 @@ class FertilizerBillingApp:
         tree.heading('Current Price', text='Current Price')
         tree.heading('Stock', text='Stock')
         tree.heading('Category', text='Category')
+        tree.heading('GST %', text='GST %')
+        tree.heading('HSN', text='HSN')
+        tree.heading('Barcode', text='Barcode')
         
         tree.column('ID', width=40, anchor='center')
         tree.column('Name', width=220)
         tree.column('Current Price', width=120, anchor='e')
         tree.column('Stock', width=80, anchor='center')
         tree.column('Category', width=120)
+        tree.column('GST %', width=60, anchor='center')
+        tree.column('HSN', width=80, anchor='center')
+        tree.column('Barcode', width=110, anchor='center')
         
         scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
         tree.configure(yscrollcommand=scrollbar.set)
@@ -864,14 +4786,15 @@ class FertilizerBillingApp:
             
             if search_term:
                 self.cursor.execute('''
-                    SELECT id, name, price, stock, category FROM inventory 
+                    SELECT id, name, price, stock, category, gst_rate, hsn, barcode FROM inventory 
                     WHERE name LIKE ? ORDER BY name
                 ''', (f'%{search_term}%',))
             else:
-                self.cursor.execute('SELECT id, name, price, stock, category FROM inventory ORDER BY name')
+                self.cursor.execute('SELECT id, name, price, stock, category, gst_rate, hsn, barcode FROM inventory ORDER BY name')
             
             for row in self.cursor.fetchall():
-                tree.insert('', 'end', values=(row[0], row[1], f"Rs.{row[2]:.2f}", row[3], row[4]))
+                gst = '' if row[5] is None else f"{row[5]:g}"
+                tree.insert('', 'end', values=(row[0], row[1], f"Rs.{row[2]:.2f}", row[3], row[4], gst, row[6] or '', row[7] or ''))
         
         load_items()
         
@@ -898,6 +4821,48 @@ class FertilizerBillingApp:
         add_stock_entry.pack(side='left', padx=10)
         add_stock_entry.insert(0, "0")
         
+        tk.Label(edit_inner, text="GST %:", font=('Helvetica', 11),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=(10, 0))
+        gst_combo = ttk.Combobox(edit_inner, font=('Helvetica', 11), width=4, values=('',) + GST_SLABS)
+        gst_combo.pack(side='left', padx=5)
+        
+        tk.Label(edit_inner, text="HSN:", font=('Helvetica', 11),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=(10, 0))
+        hsn_entry = tk.Entry(edit_inner, font=('Helvetica', 11), width=9)
+        hsn_entry.pack(side='left', padx=5)
+        
+        tk.Label(edit_inner, text="Barcode:", font=('Helvetica', 11),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=(10, 0))
+        barcode_entry = tk.Entry(edit_inner, font=('Helvetica', 11), width=14)
+        barcode_entry.pack(side='left', padx=5)
+        barcode_entry.bind('<Return>', lambda e: 'break')
+        
+        dates_inner = tk.Frame(edit_frame, bg=self.colors['card'])
+        dates_inner.pack(fill='x', padx=10, pady=(0, 10))
+        
+        tk.Label(dates_inner, text="Cost (Rs.):", font=('Helvetica', 11),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left')
+        cost_entry = tk.Entry(dates_inner, font=('Helvetica', 11), width=12)
+        cost_entry.pack(side='left', padx=10)
+        
+        tk.Label(dates_inner, text="Effective from (DD-MM-YYYY, blank = now):", font=('Helvetica', 11),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=(20, 0))
+        effective_entry = tk.Entry(dates_inner, font=('Helvetica', 11), width=12)
+        effective_entry.pack(side='left', padx=10)
+        
+        lot_inner = tk.Frame(edit_frame, bg=self.colors['card'])
+        lot_inner.pack(fill='x', padx=10, pady=(0, 10))
+        
+        tk.Label(lot_inner, text="Added stock - Batch:", font=('Helvetica', 11),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left')
+        batch_entry = tk.Entry(lot_inner, font=('Helvetica', 11), width=14)
+        batch_entry.pack(side='left', padx=10)
+        
+        tk.Label(lot_inner, text="Expiry (DD-MM-YYYY):", font=('Helvetica', 11),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=(20, 0))
+        expiry_entry = tk.Entry(lot_inner, font=('Helvetica', 11), width=12)
+        expiry_entry.pack(side='left', padx=10)
+        
         def on_select(event):
             selected = tree.selection()
             if selected:
@@ -905,6 +4870,17 @@ class FertilizerBillingApp:
                 current_price = str(values[2]).replace('Rs.', '').strip()
                 new_price_entry.delete(0, tk.END)
                 new_price_entry.insert(0, current_price)
+                gst_combo.set(values[5])
+                hsn_entry.delete(0, tk.END)
+                hsn_entry.insert(0, values[6])
+                # from the table, as the tree would turn 0012... into a number
+                self.cursor.execute('SELECT barcode, cost FROM inventory WHERE id = ?', (values[0],))
+                row = self.cursor.fetchone() or (None, None)
+                barcode_entry.delete(0, tk.END)
+                barcode_entry.insert(0, row[0] or '')
+                cost_entry.delete(0, tk.END)
+                cost_entry.insert(0, '' if row[1] is None else f"{row[1]:.2f}")
+                effective_entry.delete(0, tk.END)
         
         tree.bind('<<TreeviewSelect>>', on_select)
         
@@ -918,22 +4894,49 @@ class FertilizerBillingApp:
                 item_id = tree.item(selected[0])['values'][0]
                 new_price = float(new_price_entry.get())
                 add_stock = int(add_stock_entry.get() or 0)
+                gst_rate = parse_gst_rate(gst_combo.get())
+                cost = float(cost_entry.get()) if cost_entry.get().strip() else None
+                effective = effective_entry.get().strip()
+                effective_from = local_day_to_utc(effective) if effective else None
+                expiry = parse_expiry(expiry_entry.get())
                 
                 if new_price <= 0:
                     messagebox.showerror("Error", "Price must be greater than 0!")
                     return
+                if cost is not None and cost < 0:
+                    messagebox.showerror("Error", "Cost cannot be negative!")
+                    return
                 
                 self.cursor.execute('''
-                    UPDATE inventory SET price = ?, stock = stock + ? WHERE id = ?
-                ''', (new_price, add_stock, item_id))
+                    UPDATE inventory SET gst_rate = ?, hsn = ?, barcode = ? WHERE id = ?
+                ''', (gst_rate, hsn_entry.get().strip(), normalize_barcode(barcode_entry.get()), item_id))
+                self.cursor.execute('SELECT name FROM inventory WHERE id = ?', (item_id,))
+                item_name = self.cursor.fetchone()[0]
+                if add_stock > 0:
+                    receive_stock(self.cursor, item_name, add_stock, batch_entry.get().strip(), expiry, cost)
+                elif add_stock < 0 and not remove_stock(self.cursor, item_name, -add_stock):
+                    self.conn.rollback()
+                    messagebox.showerror("Error", "Not that much stock to take off!")
+                    return
+                schedule_price(self.cursor, item_name, new_price, cost, effective_from)
                 self.conn.commit()
+                add_stock_entry.delete(0, tk.END)
+                add_stock_entry.insert(0, "0")
+                batch_entry.delete(0, tk.END)
+                expiry_entry.delete(0, tk.END)
                 
                 load_items(search_var.get())
                 self.load_inventory()
-                messagebox.showinfo("Success", "Price updated successfully!")
+                if effective_from and effective_from > datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'):
+                    messagebox.showinfo("Success", f"New price takes effect from {effective}")
+                else:
+                    messagebox.showinfo("Success", "Price updated successfully!")
                 
             except ValueError:
-                messagebox.showerror("Error", "Please enter valid numbers!")
+                messagebox.showerror("Error", "Please enter valid numbers and dates as DD-MM-YYYY!")
+            except sqlite3.IntegrityError:
+                self.conn.rollback()
+                messagebox.showerror("Error", "This barcode is already on another fertilizer!")
         
         def delete_item():
             selected = tree.selection()
@@ -958,6 +4961,179 @@ class FertilizerBillingApp:
         tk.Button(btn_frame, text="DELETE", command=delete_item,
                  bg=self.colors['danger'], fg='white',
                  font=('Helvetica', 10, 'bold'), padx=15).pack(side='left', padx=5)
+        
+        def show_history():
+            selected = tree.selection()
+            if not selected:
+                messagebox.showwarning("Warning", "Please select a fertilizer!")
+                return
+            self.cursor.execute('SELECT name FROM inventory WHERE id = ?', (tree.item(selected[0])['values'][0],))
+            row = self.cursor.fetchone()
+            if row:
+                self.show_price_history_window(window, row[0])
+        
+        def bulk_revise():
+            names = []
+            for iid in tree.selection():
+                self.cursor.execute('SELECT name FROM inventory WHERE id = ?', (tree.item(iid)['values'][0],))
+                row = self.cursor.fetchone()
+                if row:
+                    names.append(row[0])
+            self.show_price_revision_window(window, names, lambda: load_items(search_var.get()))
+        
+        tk.Button(dates_inner, text="BULK REVISE", command=bulk_revise,
+                 bg=self.colors['warning'], fg='white',
+                 font=('Helvetica', 10, 'bold'), padx=15).pack(side='right', padx=5)
+        
+        tk.Button(dates_inner, text="HISTORY", command=show_history,
+                 bg=self.colors['primary'], fg='white',
+                 font=('Helvetica', 10, 'bold'), padx=15).pack(side='right', padx=5)
+    
+    def show_price_history_window(self, parent, item_name):
+        """Every price and cost an item has had, newest first"""
+        window = tk.Toplevel(parent)
+        window.title(f"Price History - {item_name}")
+        window.geometry("520x380")
+        window.configure(bg=self.colors['card'])
+        window.transient(parent)
+        
+        tk.Label(window, text=item_name, font=('Helvetica', 14, 'bold'),
+                fg=self.colors['warning'], bg=self.colors['card']).pack(pady=10)
+        
+        columns = ('From', 'Price', 'Cost', 'Margin')
+        tree = ttk.Treeview(window, columns=columns, show='headings', height=12)
+        for col, width in zip(columns, (160, 100, 100, 90)):
+            tree.heading(col, text=col)
+            tree.column(col, width=width, anchor='center')
+        tree.pack(fill='both', expand=True, padx=15, pady=(0, 15))
+        
+        for effective, price, cost in price_history_rows(self.cursor, item_name):
+            margin = '' if cost is None or not price else f"{(price - cost) / price * 100:.1f}%"
+            tree.insert('', 'end', values=(effective, f"Rs.{price:.2f}",
+                                           '' if cost is None else f"Rs.{cost:.2f}", margin))
+    
+    def show_price_revision_window(self, parent, selected_names, on_applied):
+        """Reprice a category, matching names or the selected items in one go, after a preview"""
+        window = tk.Toplevel(parent)
+        window.title("Bulk Price Revision")
+        window.geometry("760x560")
+        window.configure(bg=self.colors['card'])
+        window.transient(parent)
+        window.grab_set()
+        
+        tk.Label(window, text="Bulk Price Revision", font=('Helvetica', 16, 'bold'),
+                fg=self.colors['warning'], bg=self.colors['card']).pack(pady=10)
+        
+        # Target
+        target_frame = tk.Frame(window, bg=self.colors['card'])
+        target_frame.pack(fill='x', padx=20, pady=5)
+        target_var = tk.StringVar(value='selected' if selected_names else 'category')
+        self.cursor.execute("SELECT DISTINCT category FROM inventory WHERE category IS NOT NULL ORDER BY category")
+        category_combo = ttk.Combobox(target_frame, font=('Helvetica', 10), width=18, state='readonly',
+                                      values=[row[0] for row in self.cursor.fetchall()])
+        contains_entry = tk.Entry(target_frame, font=('Helvetica', 10), width=16)
+        for value, text, widget in (('category', "Category", category_combo),
+                                    ('contains', "Name contains", contains_entry),
+                                    ('selected', f"Selected items ({len(selected_names)})", None)):
+            tk.Radiobutton(target_frame, text=text, variable=target_var, value=value,
+                          bg=self.colors['card'], fg=self.colors['light'],
+                          selectcolor=self.colors['dark']).pack(side='left', padx=(10, 2))
+            if widget is not None:
+                widget.pack(side='left', padx=(0, 10))
+        
+        # Rule
+        rule_frame = tk.Frame(window, bg=self.colors['card'])
+        rule_frame.pack(fill='x', padx=20, pady=5)
+        rules = {"Change by %": 'percent', "Change by Rs.": 'amount', "Set price to Rs.": 'set'}
+        tk.Label(rule_frame, text="Rule:", font=('Helvetica', 11),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=(10, 0))
+        rule_combo = ttk.Combobox(rule_frame, font=('Helvetica', 10), width=16, state='readonly',
+                                  values=list(rules))
+        rule_combo.current(0)
+        rule_combo.pack(side='left', padx=5)
+        value_entry = tk.Entry(rule_frame, font=('Helvetica', 11, 'bold'), width=10)
+        value_entry.pack(side='left', padx=5)
+        tk.Label(rule_frame, text="Effective from (DD-MM-YYYY, blank = now):", font=('Helvetica', 11),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=(15, 0))
+        effective_entry = tk.Entry(rule_frame, font=('Helvetica', 11), width=12)
+        effective_entry.pack(side='left', padx=5)
+        
+        # Preview
+        tree_frame = tk.Frame(window, bg=self.colors['card'])
+        tree_frame.pack(fill='both', expand=True, padx=20, pady=10)
+        columns = ('Name', 'Category', 'Price', 'New Price')
+        tree = ttk.Treeview(tree_frame, columns=columns, show='headings', height=12)
+        for col, width, anchor in zip(columns, (260, 150, 110, 110), ('w', 'w', 'e', 'e')):
+            tree.heading(col, text=col)
+            tree.column(col, width=width, anchor=anchor)
+        scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        summary_label = tk.Label(window, text="", font=('Helvetica', 10),
+                                fg=self.colors['light'], bg=self.colors['card'])
+        summary_label.pack()
+        
+        def revision():
+            """(rule, value, target) as entered; raises ValueError for bad numbers"""
+            target = {'selected': {'names': selected_names},
+                      'category': {'category': category_combo.get() or None},
+                      'contains': {'contains': contains_entry.get().strip()}}[target_var.get()]
+            return rules[rule_combo.get()], float(value_entry.get()), target
+        
+        def preview():
+            try:
+                rule, value, target = revision()
+                rows = preview_price_revision(self.cursor, rule, value, **target)
+            except PriceRevisionError as e:
+                messagebox.showerror("Error", str(e), parent=window)
+                return
+            except ValueError:
+                messagebox.showerror("Error", "Please enter a valid number!", parent=window)
+                return
+            finally:
+                # loading temp.revision_items opened a transaction; left open, its
+                # read lock would hold off every other writer, the draft writer too
+                self.conn.rollback()
+            tree.delete(*tree.get_children())
+            for name, category, price, new_price in rows:
+                tree.insert('', 'end', values=(name, category or '', f"Rs.{price:.2f}", f"Rs.{new_price:.2f}"))
+            summary_label.config(text=f"{len(rows)} items will be repriced")
+            return rows
+        
+        def apply():
+            rows = preview()
+            if not rows:
+                return
+            if not messagebox.askyesno("Confirm", f"Reprice {len(rows)} items?", parent=window):
+                return
+            try:
+                rule, value, target = revision()
+                effective = effective_entry.get().strip()
+                effective_from = local_day_to_utc(effective) if effective else None
+                revised = apply_price_revision(self.cursor, rule, value, effective_from, **target)
+                self.conn.commit()
+            except PriceRevisionError as e:
+                self.conn.rollback()
+                messagebox.showerror("Error", str(e), parent=window)
+                return
+            except ValueError:
+                self.conn.rollback()
+                messagebox.showerror("Error", "Please enter dates as DD-MM-YYYY!", parent=window)
+                return
+            on_applied()
+            self.load_inventory()
+            messagebox.showinfo("Success", f"{revised} prices revised", parent=window)
+            window.destroy()
+        
+        btn_frame = tk.Frame(window, bg=self.colors['card'])
+        btn_frame.pack(pady=10)
+        tk.Button(btn_frame, text="PREVIEW", command=preview,
+                 bg=self.colors['primary'], fg='white',
+                 font=('Helvetica', 10, 'bold'), padx=15).pack(side='left', padx=5)
+        tk.Button(btn_frame, text="APPLY", command=apply,
+                 bg=self.colors['success'], fg='white',
+                 font=('Helvetica', 10, 'bold'), padx=15).pack(side='left', padx=5)
     
     # ============ INVENTORY WINDOW ============
     def show_inventory_window(self):
@@ -997,10 +5173,10 @@ class FertilizerBillingApp:
                 return
             ids = [tree.item(s)['values'][0] for s in selected]
             for item_id in ids:
-                try:
-                    self.cursor.execute('UPDATE inventory SET stock = stock + ? WHERE id = ?', (qty, item_id))
-                except Exception:
-                    pass
+                self.cursor.execute('SELECT name FROM inventory WHERE id = ?', (item_id,))
+                row = self.cursor.fetchone()
+                if row:
+                    receive_stock(self.cursor, row[0], qty)
             self.conn.commit()
             load_data()
             self.load_inventory()
@@ -1016,14 +5192,32 @@ class FertilizerBillingApp:
                 return
             ids = [tree.item(s)['values'][0] for s in selected]
             for item_id in ids:
-                try:
-                    self.cursor.execute('UPDATE inventory SET stock = stock - ? WHERE id = ? AND stock >= ?', (qty, item_id, qty))
-                except Exception:
-                    pass
+                self.cursor.execute('SELECT name FROM inventory WHERE id = ?', (item_id,))
+                row = self.cursor.fetchone()
+                if row:
+                    remove_stock(self.cursor, row[0], qty)
             self.conn.commit()
             load_data()
             self.load_inventory()
             messagebox.showinfo("Success", f"Decreased {qty} units from {len(ids)} item(s)")
+            self.show_stock_alerts()
+
+        def set_reorder_level_selected():
+            selected = tree.selection()
+            if not selected:
+                messagebox.showwarning("Warning", "Select item(s) to set reorder level")
+                return
+            level = simpledialog.askinteger("Reorder Level", "Warn when stock falls below:",
+                                            minvalue=0, initialvalue=tree.item(selected[0])['values'][4])
+            if level is None:
+                return
+            ids = [tree.item(s)['values'][0] for s in selected]
+            self.cursor.executemany('UPDATE inventory SET reorder_level = ? WHERE id = ?',
+                                    [(level, item_id) for item_id in ids])
+            self.conn.commit()
+            load_data()
+            self.refresh_footer_stats()
+            self.show_stock_alerts()
 
 
         # Add Stock Button
@@ -1037,6 +5231,11 @@ class FertilizerBillingApp:
                  command=decrease_stock_selected,
                  bg=self.colors['danger'], fg='white',
                  font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+
+        tk.Button(btn_frame, text="Reorder Level",
+                 command=set_reorder_level_selected,
+                 bg=self.colors['warning'], fg='white',
+                 font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
         
         def refresh_data():
             load_data()
@@ -1052,6 +5251,16 @@ class FertilizerBillingApp:
                  bg=self.colors['secondary'], fg='white',
                  font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
 
+        tk.Button(btn_frame, text="Reorder Plan",
+                 command=self.show_reorder_window,
+                 bg=self.colors['purple'], fg='white',
+                 font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+
+        tk.Button(btn_frame, text="Expiring",
+                 command=self.show_expiring_window,
+                 bg=self.colors['danger'], fg='white',
+                 font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+
         # Removed separate Delete Selected button (now in combined menu)
 
         def print_inventory_table():
@@ -1060,7 +5269,7 @@ class FertilizerBillingApp:
             import platform
             temp = tempfile.NamedTemporaryFile(delete=False, suffix='.txt', mode='w', encoding='utf-8')
             # Write header
-            temp.write('ID\tName\tPrice\tStock\tCategory\tUnit\tDescription\tStatus\n')
+            temp.write('ID\tName\tPrice\tStock\tReorder\tCategory\tUnit\tDescription\tStatus\n')
             for row in tree.get_children():
                 vals = tree.item(row)['values']
                 temp.write('\t'.join(str(v) for v in vals) + '\n')
@@ -1073,20 +5282,18 @@ class FertilizerBillingApp:
             except Exception as e:
                 messagebox.showerror("Print Error", f"Could not print: {e}")
         
-        # Low stock warning
-        self.cursor.execute('SELECT COUNT(*) FROM inventory WHERE stock < 20')
-        low_stock_count = self.cursor.fetchone()[0]
-        if low_stock_count > 0:
-            tk.Label(btn_frame, text=f"Warning: {low_stock_count} items low on stock!",
+        # Low stock warning, counted from idx_inventory_low and kept current by load_data
+        low_stock_label = tk.Label(btn_frame, text="",
                     font=('Helvetica', 10, 'bold'),
                     fg=self.colors['danger'],
-                    bg=self.colors['card']).pack(side='right', padx=10)
+                    bg=self.colors['card'])
+        low_stock_label.pack(side='right', padx=10)
         
         # Treeview
         tree_frame = tk.Frame(window, bg=self.colors['card'])
         tree_frame.pack(fill='both', expand=True, padx=20, pady=10)
         
-        columns = ('ID', 'Name', 'Price', 'Stock', 'Category', 'Unit', 'Description', 'Status')
+        columns = ('ID', 'Name', 'Price', 'Stock', 'Reorder', 'Category', 'Unit', 'Description', 'Status')
         tree = ttk.Treeview(tree_frame, columns=columns, show='headings', height=18)
         
         for col in columns:
@@ -1096,6 +5303,7 @@ class FertilizerBillingApp:
         tree.column('Name', width=220)
         tree.column('Price', width=100, anchor='e')
         tree.column('Stock', width=80, anchor='center')
+        tree.column('Reorder', width=70, anchor='center')
         tree.column('Category', width=120)
         tree.column('Unit', width=60, anchor='center')
         tree.column('Description', width=220)
@@ -1112,24 +5320,28 @@ class FertilizerBillingApp:
                 tree.delete(item)
             # include description if present in table
             try:
-                self.cursor.execute('SELECT id, name, price, stock, category, unit, description FROM inventory ORDER BY name')
+                self.cursor.execute('SELECT id, name, price, stock, category, unit, description, reorder_level FROM inventory ORDER BY name')
                 rows = self.cursor.fetchall()
             except Exception:
                 # fallback if description column missing
-                self.cursor.execute('SELECT id, name, price, stock, category, unit FROM inventory ORDER BY name')
-                rows = [(*r, None) for r in self.cursor.fetchall()]
+                self.cursor.execute('SELECT id, name, price, stock, category, unit, NULL, reorder_level FROM inventory ORDER BY name')
+                rows = self.cursor.fetchall()
 
             for row in rows:
-                # row: id, name, price, stock, category, unit, description
+                # row: id, name, price, stock, category, unit, description, reorder_level
                 stock_val = row[3] or 0
-                if stock_val >= 20:
+                if stock_val >= row[7]:
                     status = "OK"
                 elif stock_val > 0:
                     status = "Low"
                 else:
                     status = "Out"
                 desc = row[6] if row[6] else 'None'
-                tree.insert('', 'end', values=(row[0], row[1], f"Rs.{row[2]:.2f}", row[3], row[4], row[5], desc, status))
+                tree.insert('', 'end', values=(row[0], row[1], f"Rs.{row[2]:.2f}", row[3], row[7], row[4], row[5], desc, status))
+            self.cursor.execute(LOW_STOCK_COUNT_SQL)
+            low_stock_count = self.cursor.fetchone()[0]
+            low_stock_label.config(text=f"Warning: {low_stock_count} items low on stock!" if low_stock_count else "")
+        load_data = self.instr.wrap('load_data', load_data)
 
         # add delete action for inventory window
         def delete_selected():
@@ -1153,23 +5365,30 @@ class FertilizerBillingApp:
         load_data()
         
         # Summary
-        self.cursor.execute('SELECT COUNT(*), SUM(stock), SUM(price * stock) FROM inventory')
-        summary = self.cursor.fetchone()
+        items, units, value, uncosted = stock_valuation(self.cursor)
+        summary = f"Total Items: {items} | Total Stock: {units} units | Stock Value (at cost): Rs.{value:.2f}"
+        if uncosted:
+            summary += f" | {uncosted} units without cost"
         
         summary_frame = tk.Frame(window, bg=self.colors['dark'])
         summary_frame.pack(fill='x', pady=10)
         
         tk.Label(summary_frame, 
-                text=f"Total Items: {summary[0]} | Total Stock: {summary[1] or 0} units | Inventory Value: Rs.{(summary[2] or 0):.2f}",
+                text=summary,
                 font=('Helvetica', 11, 'bold'),
                 fg=self.colors['light'],
                 bg=self.colors['dark']).pack(pady=10)
     
     # ============ OTHER METHODS ============
     def load_inventory(self):
-        self.cursor.execute('SELECT name, price, stock FROM inventory ORDER BY name')
+        # prices dated ahead that have since come into effect
+        if apply_due_prices(self.cursor):
+            self.conn.commit()
+        self.cursor.execute('SELECT name, price, stock, gst_rate, hsn, barcode FROM inventory ORDER BY name')
         items = self.cursor.fetchall()
-        self.inventory_data = {item[0]: {'price': item[1], 'stock': item[2]} for item in items}
+        self.inventory_data = {item[0]: {'price': item[1], 'stock': item[2], 'gst_rate': item[3], 'hsn': item[4] or ''}
+                               for item in items}
+        self.barcode_index = {item[5]: item[0] for item in items if item[5]}
         self.item_combo['values'] = list(self.inventory_data.keys())
     
     def on_item_selected(self, event):
@@ -1198,41 +5417,117 @@ class FertilizerBillingApp:
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid quantity!")
             return
-        if quantity > self.inventory_data[item_name]['stock']:
-            messagebox.showwarning("Low Stock", f"Only {self.inventory_data[item_name]['stock']} units available!")
+        error = self.merge_into_cart(item_name, quantity)
+        if error:
+            messagebox.showwarning("Low Stock", error)
             return
-        price = self.inventory_data[item_name]['price']
-        total = quantity * price
+        self.update_bill_preview()
+        self.quantity_var.set("1")
+    
+    def merge_into_cart(self, item_name, quantity):
+        """Put quantity of an inventory item in the cart, adding to its line if it has one.
+        
+        Only the cart and that one row of the cart tree change; the caller
+        redraws the bill. Returns a message instead when stock is short.
+        """
+        stock = self.inventory_data[item_name]['stock']
+        if quantity > stock:
+            return f"Only {stock} units available!"
+        item = self.inventory_data[item_name]
+        self.put_in_cart(item_name, quantity, item['price'], item['gst_rate'], item['hsn'])
+        return None
+    
+    def cart_row(self, line):
+        return (line['name'], line['quantity'], f"Rs.{line['price']:.2f}", f"Rs.{line['total']:.2f}")
+    
+    def put_in_cart(self, item_name, quantity, price, gst_rate, hsn):
+        """Add to the item's cart line, or start one, and journal the change"""
         # Remove duplicate: if item already in cart, update its quantity and total
         for idx, item in enumerate(self.cart_items):
             if item['name'] == item_name:
-                # Update quantity and total
-                self.cart_items[idx]['quantity'] += quantity
-                self.cart_items[idx]['total'] = self.cart_items[idx]['quantity'] * price
-                # Update treeview
-                for row in self.cart_tree.get_children():
-                    vals = self.cart_tree.item(row)['values']
-                    if vals[0] == item_name:
-                        new_qty = self.cart_items[idx]['quantity']
-                        new_total = self.cart_items[idx]['total']
-                        self.cart_tree.item(row, values=(item_name, new_qty, f"Rs.{price:.2f}", f"Rs.{new_total:.2f}"))
-                        break
-                self.update_bill_preview()
-                self.quantity_var.set("1")
-                self.cart_count_label.config(text=f"Items: {len(self.cart_items)}")
+                before = (item['quantity'], item['total'])
+                item['quantity'] += quantity
+                item['total'] = item['quantity'] * price
+                self.cart_journal.record(('set', idx, before, (item['quantity'], item['total'])))
+                # Update treeview; rows are kept in cart order
+                row = self.cart_tree.get_children()[idx]
+                self.cart_tree.item(row, values=(item_name, item['quantity'], f"Rs.{price:.2f}", f"Rs.{item['total']:.2f}"))
                 return
         # If not in cart, add new
-        self.cart_items.append({
+        line = {
             'name': item_name,
             'quantity': quantity,
             'price': price,
-            'total': total
-        })
-        self.cart_tree.insert('', 'end', values=(item_name, quantity, f"Rs.{price:.2f}", f"Rs.{total:.2f}"))
-        self.update_bill_preview()
-        self.quantity_var.set("1")
+            'total': quantity * price,
+            'gst_rate': gst_rate,
+            'hsn': hsn
+        }
+        self.cart_journal.record(('lines', True, [(len(self.cart_items), line)]))
+        self.cart_items.append(line)
+        self.cart_tree.insert('', 'end', values=self.cart_row(line))
         self.cart_count_label.config(text=f"Items: {len(self.cart_items)}")
     
+    def on_scan_key(self, event):
+        # first character of a scan: the clock for scan-to-cart starts here
+        if self.scan_started is None and event.char:
+            self.scan_started = time.perf_counter()
+    
+    def scan_barcode(self, event=None):
+        """Add the scanned item to the cart in one step.
+        
+        Scanners type the next code right behind the Enter, so nothing here may
+        take focus away (no dialogs; problems go to the status label) or hold
+        up the event queue: the cart row changes now and the bill is redrawn
+        once the queued keystrokes have been handled.
+        """
+        code = normalize_barcode(self.scan_entry.get())
+        self.scan_entry.delete(0, tk.END)
+        started, self.scan_started = self.scan_started, None
+        if not code:
+            return None
+        item_name = self.barcode_index.get(code)
+        if item_name is None:
+            # added since the last load_inventory, e.g. by a synced branch
+            item_name = find_by_barcode(self.cursor, code)
+            if item_name is not None:
+                self.load_inventory()
+        if item_name not in self.inventory_data:
+            self.scan_status.config(text=f"Unknown barcode {code}", fg=self.colors['danger'])
+            self.root.bell()
+            return 'break'
+        try:
+            quantity = max(1, int(self.quantity_var.get()))
+        except ValueError:
+            quantity = 1
+        error = self.merge_into_cart(item_name, quantity)
+        if error:
+            self.scan_status.config(text=f"{item_name}: {error}", fg=self.colors['danger'])
+            self.root.bell()
+            return 'break'
+        self.quantity_var.set("1")
+        self.schedule_bill_preview()
+        if started is not None:
+            micros = (time.perf_counter() - started) * 1e6
+            self.scan_latency.record(micros)
+            if self.instr.enabled:
+                self.instr.record('scan_to_cart', micros)
+            self.scan_status.config(text=f"{item_name} x{quantity}  ({micros / 1000:.1f} ms)", fg=self.colors['success'])
+        else:
+            self.scan_status.config(text=f"{item_name} x{quantity}", fg=self.colors['success'])
+        return 'break'
+    
+    def schedule_bill_preview(self):
+        """Redraw the bill once, after the events already queued (a burst of scans)"""
+        if self._preview_pending is None:
+            self._preview_pending = self.root.after_idle(self.flush_bill_preview)
+    
+    def flush_bill_preview(self):
+        """Run a scheduled bill redraw now, so calculated_values match the cart"""
+        if self._preview_pending is not None:
+            self.root.after_cancel(self._preview_pending)
+            self._preview_pending = None
+            self.update_bill_preview()
+    
     def add_custom_item(self):
         item_name = self.custom_item.get().strip()
         if item_name == "Item Name":
@@ -1250,37 +5545,7 @@ class FertilizerBillingApp:
         if not item_name or price <= 0 or quantity <= 0:
             messagebox.showerror("Error", "Fill all fields correctly!")
             return
-        total = quantity * price
-        # Remove duplicate: if item already in cart, update its quantity and total
-        for idx, item in enumerate(self.cart_items):
-            if item['name'] == item_name:
-                self.cart_items[idx]['quantity'] += quantity
-                self.cart_items[idx]['total'] = self.cart_items[idx]['quantity'] * price
-                # Update treeview
-                for row in self.cart_tree.get_children():
-                    vals = self.cart_tree.item(row)['values']
-                    if vals[0] == item_name:
-                        new_qty = self.cart_items[idx]['quantity']
-                        new_total = self.cart_items[idx]['total']
-                        self.cart_tree.item(row, values=(item_name, new_qty, f"Rs.{price:.2f}", f"Rs.{new_total:.2f}"))
-                        break
-                self.update_bill_preview()
-                self.custom_item.delete(0, tk.END)
-                self.custom_item.insert(0, "Item Name")
-                self.custom_price.delete(0, tk.END)
-                self.custom_price.insert(0, "Price")
-                self.custom_qty.delete(0, tk.END)
-                self.custom_qty.insert(0, "Qty")
-                self.cart_count_label.config(text=f"Items: {len(self.cart_items)}")
-                return
-        # If not in cart, add new
-        self.cart_items.append({
-            'name': item_name,
-            'quantity': quantity,
-            'price': price,
-            'total': total
-        })
-        self.cart_tree.insert('', 'end', values=(item_name, quantity, f"Rs.{price:.2f}", f"Rs.{total:.2f}"))
+        self.put_in_cart(item_name, quantity, price, None, '')
         self.update_bill_preview()
         self.custom_item.delete(0, tk.END)
         self.custom_item.insert(0, "Item Name")
@@ -1288,7 +5553,6 @@ class FertilizerBillingApp:
         self.custom_price.insert(0, "Price")
         self.custom_qty.delete(0, tk.END)
         self.custom_qty.insert(0, "Qty")
-        self.cart_count_label.config(text=f"Items: {len(self.cart_items)}")
     
     def remove_from_cart(self):
         selected = self.cart_tree.selection()
@@ -1296,11 +5560,14 @@ class FertilizerBillingApp:
             messagebox.showwarning("Warning", "Select an item to remove!")
             return
         
+        removed = []
         for item in selected:
             index = self.cart_tree.index(item)
             self.cart_tree.delete(item)
             if index < len(self.cart_items):
-                self.cart_items.pop(index)
+                removed.append((index, self.cart_items.pop(index)))
+        if removed:
+            self.cart_journal.record(('lines', False, removed))
         
         self.update_bill_preview()
         self.cart_count_label.config(text=f"Items: {len(self.cart_items)}")
@@ -1309,10 +5576,71 @@ class FertilizerBillingApp:
         if self.cart_items and messagebox.askyesno("Confirm", "Clear all items from cart?"):
             for item in self.cart_tree.get_children():
                 self.cart_tree.delete(item)
-            self.cart_items.clear()
+            # a fresh list, so undo can hand the old one back whole
+            cleared = []
+            self.cart_journal.record(('swap', self.cart_items, cleared))
+            self.cart_items = cleared
             self.update_bill_preview()
             self.cart_count_label.config(text="Items: 0")
     
+    def undo_cart(self):
+        step = self.cart_journal.undo()
+        if step is not None:
+            self.apply_cart_step(step, undo=True)
+    
+    def redo_cart(self):
+        step = self.cart_journal.redo()
+        if step is not None:
+            self.apply_cart_step(step)
+    
+    def apply_cart_step(self, step, undo=False):
+        """Replay a journalled cart change, or reverse it, touching only the lines it names"""
+        for edit in cart_step_edits(step, undo):
+            self.cart_items = apply_cart_edits(self.cart_items, [edit])
+            if edit[0] == 'set':
+                self.cart_tree.item(self.cart_tree.get_children()[edit[1]], values=self.cart_row(self.cart_items[edit[1]]))
+            elif edit[0] == 'insert':
+                self.cart_tree.insert('', edit[1], values=self.cart_row(edit[2]))
+            elif edit[0] == 'pop':
+                self.cart_tree.delete(self.cart_tree.get_children()[edit[1]])
+            else:
+                self.show_cart()
+        self.cart_count_label.config(text=f"Items: {len(self.cart_items)}")
+        self.schedule_bill_preview()
+    
+    def show_cart(self):
+        """Redraw every cart row from self.cart_items"""
+        self.cart_tree.delete(*self.cart_tree.get_children())
+        for line in self.cart_items:
+            self.cart_tree.insert('', 'end', values=self.cart_row(line))
+    
+    def restore_draft(self):
+        """Put back the cart the last session left unsaved, if any, and keep drafting"""
+        base, records = load_draft(self.cursor)
+        if base:
+            self.load_bill_for_edit(base)
+            if self.editing_bill_id is None:
+                # the bill is gone, and its draft with it
+                self.drafts.start()
+                return
+        try:
+            cart, journal = replay_draft(self.cart_items, records)
+        except (ValueError, LookupError, TypeError):
+            draft_log.exception('draft cart not restored')
+            self.new_bill()
+            return
+        journal.listener = self.drafts.log
+        self.cart_items, self.cart_journal = cart, journal
+        # rewritten from seq 1 with the same history
+        self.drafts.start(base, records)
+        if records:
+            self.show_cart()
+            self.update_bill_preview()
+            self.cart_count_label.config(text=f"Items: {len(self.cart_items)}")
+            if self.cart_items:
+                messagebox.showinfo("Draft Restored",
+                                    f"Restored the unsaved cart from last time ({len(self.cart_items)} items).")
+    
     def update_bill_preview(self):
         self.bill_text.delete(1.0, tk.END)
         
@@ -1320,130 +5648,30 @@ class FertilizerBillingApp:
             self.total_label.config(text="TOTAL: Rs. 0.00")
             return
         
-        # fetch settings including gst/licence if available
-        try:
-            self.cursor.execute('SELECT shop_name, shop_address, shop_phone, currency, gst_number, licence_number FROM settings WHERE id=1')
-            settings = self.cursor.fetchone() or ("Fertilizer Shop", "", "", "Rs.", "", "")
-            shop_name = settings[0]
-            shop_address = settings[1] or ""
-            shop_phone = settings[2] or ""
-            currency = settings[3] or "Rs."
-            gst_number = settings[4] or ""
-            licence_number = settings[5] or ""
-        except Exception:
-            # fallback if columns not present
-            self.cursor.execute('SELECT shop_name, shop_address, shop_phone, currency FROM settings WHERE id=1')
-            settings = self.cursor.fetchone() or ("Fertilizer Shop", "", "", "Rs.")
-            shop_name = settings[0]
-            shop_address = settings[1] or ""
-            shop_phone = settings[2] or ""
-            currency = settings[3] or "Rs."
-            gst_number = ""
-            licence_number = ""
-        
-        # Build a nicely aligned bill using fixed width font (48 chars)
-        width = 48
-        def center(s):
-            return s.center(width)
-
-        def wrap(s, w):
-            # simple wrap that returns list of lines
-            lines = []
-            while len(s) > w:
-                idx = s.rfind(' ', 0, w)
-                if idx == -1:
-                    idx = w
-                lines.append(s[:idx])
-                s = s[idx:].lstrip()
-            if s:
-                lines.append(s)
-            return lines
-
-        bill_lines = []
-        bill_lines.append('=' * width)
-        bill_lines.append(center(shop_name))
-        if shop_address:
-            for ln in wrap(shop_address, width - 6):
-                bill_lines.append(ln.center(width))
-        if shop_phone:
-            bill_lines.append(center(f"Phone: {shop_phone}"))
-        bill_lines.append('=' * width)
-        # moved GST/Licence to header area (instead of showing invoice here)
-        if gst_number:
-            bill_lines.append(center(f"GST No: {gst_number}"))
-        if licence_number:
-            bill_lines.append(center(f"Licence No: {licence_number}"))
-        bill_lines.append(f"Date: {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
-        # invoice number in header
-        bill_lines.append(f"Invoice: {self.invoice_number}")
-        customer_name = self.customer_name.get().strip()
-        if customer_name:
-            bill_lines.append(f"Customer: {customer_name}")
-        bill_lines.append('-' * width)
-        # columns: Item(22), Qty(4), Price(9), Total(9)
-        bill_lines.append(f"{'Item':<22} {'Qty':>4} {'Price':>9} {'Total':>9}")
-        bill_lines.append('-' * width)
-
-        subtotal = 0
-        for item in self.cart_items:
-            name = item['name'][:22]
-            qty = item['quantity']
-            price = item['price']
-            total = item['total']
-            subtotal += total
-            price_str = f"{currency}{price:,.2f}"
-            total_str = f"{currency}{total:,.2f}"
-            line = f"{name:<22} {str(qty):>4} {price_str:>9} {total_str:>9}"
-            bill_lines.append(line)
-
-        bill_lines.append('-' * width)
-        bill_lines.append(f"{'Subtotal:':<33} {currency}{subtotal:>8.2f}")
-
+        shop = shop_settings(self.cursor)
         try:
             discount_rate = float(self.discount_var.get())
         except ValueError:
             discount_rate = 0
 
-        discount_amount = (discount_rate / 100) * subtotal
-        discounted_total = subtotal - discount_amount
-
-        if discount_rate > 0:
-            bill_lines.append(f"{'Discount (' + str(discount_rate) + '%):':<33} -{currency}{discount_amount:>8.2f}")
-
         try:
             tax_rate = float(self.tax_var.get())
         except ValueError:
             tax_rate = 0
 
-        tax_amount = (tax_rate / 100) * discounted_total
-        final_total = discounted_total + tax_amount
-
-        if tax_rate > 0:
-            bill_lines.append(f"{'GST (' + str(tax_rate) + '%):':<33} +{currency}{tax_amount:>8.2f}")
-
-        bill_lines.append('=' * width)
-        bill_lines.append(f"{'GRAND TOTAL:':<33} {currency}{final_total:>8.2f}")
-        bill_lines.append('=' * width)
-
-        # GST/licence already shown in header; omit here to avoid duplication
-        bill_lines.append(f"Payment: {self.payment_var.get()}")
-        bill_lines.append("")
-        bill_lines.append(center('Thank you for your purchase!'))
-        bill_lines.append(center('Visit Again Soon!'))
-        bill_lines.append('=' * width)
+        # tax_rate applies only to lines without their own GST slab
+        values = price_bill(self.cart_items, discount_rate, tax_rate)
+        bill = {'date': datetime.now().strftime('%d-%m-%Y %H:%M:%S'), 'invoice': self.invoice_number,
+                'customer': self.customer_name.get().strip(), 'payment': self.payment_var.get()}
+        # Build a nicely aligned bill using fixed width font (48 chars)
+        layout = bill_heading(shop) + bill_body(shop, bill, self.cart_items, values)
 
-        bill = '\n'.join(bill_lines) + '\n'
-        self.bill_text.insert(1.0, bill)
-        self.total_label.config(text=f"TOTAL: {currency} {final_total:.2f}")
+        bill_text = '\n'.join(text for _, text in layout) + '\n'
+        self.bill_text.insert(1.0, bill_text)
+        self.total_label.config(text=f"TOTAL: {shop[3]} {values['total']:.2f}")
         
-        self.calculated_values = {
-            'subtotal': subtotal,
-            'discount_rate': discount_rate,
-            'discount_amount': discount_amount,
-            'tax_rate': tax_rate,
-            'tax_amount': tax_amount,
-            'total': final_total
-        }
+        self.calculated_values = values
+        self.printed_bill = (shop, bill)
     
     def generate_bill(self):
         if not self.cart_items:
@@ -1456,128 +5684,115 @@ class FertilizerBillingApp:
         if not self.cart_items:
             messagebox.showwarning("Warning", "Cart is empty!")
             return False
+        self.flush_bill_preview()
         
+        editing = getattr(self, 'editing_bill_id', None)
         try:
-            customer_id = None
-            customer_name = self.customer_name.get().strip()
-            customer_phone = self.customer_phone.get().strip()
-            
-            if customer_phone:
-                self.cursor.execute('SELECT id FROM customers WHERE phone = ?', (customer_phone,))
-                result = self.cursor.fetchone()
-                if result:
-                    customer_id = result[0]
-                else:
-                    self.cursor.execute('''
-                        INSERT INTO customers (name, phone, address)
-                        VALUES (?, ?, ?)
-                    ''', (customer_name, customer_phone, self.customer_address.get()))
-                    customer_id = self.cursor.lastrowid
-            # If editing an existing bill, update instead of insert
-            if getattr(self, 'editing_bill_id', None):
-                bill_id = self.editing_bill_id
-                # restore previous stock for that bill
-                self.cursor.execute('SELECT item_name, quantity FROM bill_items WHERE bill_id = ?', (bill_id,))
-                for item_name, qty in self.cursor.fetchall():
-                    try:
-                        self.cursor.execute('UPDATE inventory SET stock = stock + ? WHERE name = ?', (qty, item_name))
-                    except Exception:
-                        pass
-                # remove old items
-                self.cursor.execute('DELETE FROM bill_items WHERE bill_id = ?', (bill_id,))
-
-                # update bill header
-                self.cursor.execute('''
-                    UPDATE bills SET customer_id = ?, subtotal = ?, discount_rate = ?, discount_amount = ?,
-                        tax_rate = ?, tax_amount = ?, total_amount = ?, payment_method = ?, created_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (
-                    customer_id,
-                    self.calculated_values['subtotal'],
-                    self.calculated_values['discount_rate'],
-                    self.calculated_values['discount_amount'],
-                    self.calculated_values['tax_rate'],
-                    self.calculated_values['tax_amount'],
-                    self.calculated_values['total'],
-                    self.payment_var.get(),
-                    bill_id
-                ))
-
-                # insert new items and deduct stock
-                for item in self.cart_items:
-                    self.cursor.execute('''
-                        INSERT INTO bill_items (bill_id, item_name, quantity, price, total)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (bill_id, item['name'], item['quantity'], item['price'], item['total']))
-                    self.cursor.execute('UPDATE inventory SET stock = stock - ? WHERE name = ?', (item['quantity'], item['name']))
-
-                self.conn.commit()
-                messagebox.showinfo("Success", f"Bill {self.invoice_number} updated!")
-                # clear editing state
-                self.editing_bill_id = None
-                # regenerate invoice number for next new bill
-                self.invoice_number = self.generate_invoice_number()
-                self.invoice_label.config(text=f"Invoice: {self.invoice_number}")
-                self.load_inventory()
-                return True
-
-            # Normal insert for new bill
-            self.cursor.execute('''
-                INSERT INTO bills (invoice_number, customer_id, subtotal, 
-                                  discount_rate, discount_amount, tax_rate, 
-                                  tax_amount, total_amount, payment_method)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
+            _, self.invoice_number = save_bill(
+                self.cursor, self.cart_items, self.calculated_values, self.payment_var.get(),
                 self.invoice_number,
-                customer_id,
-                self.calculated_values['subtotal'],
-                self.calculated_values['discount_rate'],
-                self.calculated_values['discount_amount'],
-                self.calculated_values['tax_rate'],
-                self.calculated_values['tax_amount'],
-                self.calculated_values['total'],
-                self.payment_var.get()
-            ))
-
-            bill_id = self.cursor.lastrowid
-
-            for item in self.cart_items:
-                self.cursor.execute('''
-                    INSERT INTO bill_items (bill_id, item_name, quantity, price, total)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (bill_id, item['name'], item['quantity'], item['price'], item['total']))
-
-                self.cursor.execute('''
-                    UPDATE inventory SET stock = stock - ? WHERE name = ?
-                ''', (item['quantity'], item['name']))
-
+                (self.customer_name.get(), self.customer_phone.get(),
+                 self.customer_address.get(), self.customer_gstin.get()),
+                bill_id=editing)
+            discard_draft(self.cursor)
             self.conn.commit()
-            messagebox.showinfo("Success", f"Bill {self.invoice_number} saved!")
-            self.load_inventory()
-            return True
-            
+        except BillError as e:
+            self.conn.rollback()
+            self.pending_stock_alerts.clear()
+            messagebox.showwarning("Warning", str(e))
+            return False
         except Exception as e:
+            self.conn.rollback()
+            self.pending_stock_alerts.clear()
             messagebox.showerror("Error", f"Failed to save: {str(e)}")
             return False
+
+        self.drafts.discard()
+        if editing:
+            messagebox.showinfo("Success", f"Bill {self.invoice_number} updated!")
+            # clear editing state
+            self.editing_bill_id = None
+            # regenerate invoice number for next new bill
+            self.invoice_number = self.generate_invoice_number()
+            self.invoice_label.config(text=f"Invoice: {self.invoice_number}")
+        else:
+            messagebox.showinfo("Success", f"Bill {self.invoice_number} saved!")
+        self.load_inventory()
+        self.refresh_footer_stats()
+        self.show_stock_alerts()
+        return True
     
     def save_and_print(self):
         if self.save_bill_to_db():
-            self.save_as_text()
+            if not self.print_receipt():
+                self.save_as_text()
             self.new_bill()
     
+    def receipt_printer(self):
+        """(device or file, characters per line) from settings; the path is '' when none is set up"""
+        self.cursor.execute('SELECT receipt_printer, receipt_width FROM settings WHERE id = 1')
+        target, width = self.cursor.fetchone() or ('', BILL_WIDTH)
+        return (target or '').strip(), width or BILL_WIDTH
+    
+    def print_receipt(self):
+        """Send the bill on screen to the receipt printer; False when there is none"""
+        target, width = self.receipt_printer()
+        if not target:
+            return False
+        # redrawn so the receipt carries the number the bill was saved under
+        self.update_bill_preview()
+        shop, bill = self.printed_bill
+        receipts = self.take_receipt_buffer()
+        receipts.build(shop, bill, self.cart_items, self.calculated_values, width).release()
+        self.send_receipt(receipts, target)
+        return True
+    
+    def take_receipt_buffer(self):
+        """A ReceiptBuffer to build into and hand to send_receipt, which gives it back"""
+        return self.receipt_buffers.pop() if self.receipt_buffers else ReceiptBuffer()
+    
+    def send_receipt(self, receipts, target):
+        """Write a buffer's receipts off the UI thread, so a slow or missing printer never holds up the counter.
+
+        The writer reads the buffer in place; it is only built into again once
+        the write is over.
+        """
+        data = receipts.contents()
+
+        def give_back():
+            data.release()
+            self.receipt_buffers.append(receipts)
+
+        def done(seconds):
+            give_back()
+            if self.instr.enabled:
+                self.instr.record('receipt_write', seconds * 1e6)
+
+        def failed(error):
+            give_back()
+            messagebox.showerror("Printer", f"Receipt not printed on {target}:\n{error}")
+        self.run_in_background(lambda conn: write_receipt(data, target), done, failed)
+    
     def save_as_text(self):
         if not self.cart_items:
             return
+        self.flush_bill_preview()
         
         filename = filedialog.asksaveasfilename(
             defaultextension=".txt",
-            filetypes=[("Text files", "*.txt")],
+            filetypes=[("Text files", "*.txt"), ("PDF files", "*.pdf")],
             initialfilename=f"Bill_{self.invoice_number}.txt"
         )
         
         if filename:
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(self.bill_text.get(1.0, tk.END))
+            if filename.lower().endswith('.pdf'):
+                shop, bill = self.printed_bill
+                data, _ = invoice_pdf(shop, [(bill, self.cart_items, self.calculated_values)])
+                with open(filename, 'wb') as f:
+                    f.write(data)
+            else:
+                with open(filename, 'w', encoding='utf-8') as f:
+                    f.write(self.bill_text.get(1.0, tk.END))
             messagebox.showinfo("Success", f"Bill saved to {filename}")
             try:
                 os.startfile(filename)
@@ -1586,12 +5801,15 @@ class FertilizerBillingApp:
     
     def new_bill(self):
         self.cart_items.clear()
+        self.cart_journal.reset()
+        self.drafts.start()
         for item in self.cart_tree.get_children():
             self.cart_tree.delete(item)
         
         self.customer_name.delete(0, tk.END)
         self.customer_phone.delete(0, tk.END)
         self.customer_address.delete(0, tk.END)
+        self.customer_gstin.delete(0, tk.END)
         self.discount_var.set("0")
         self.tax_var.set("18")
         self.payment_var.set("Cash")
@@ -1610,7 +5828,7 @@ class FertilizerBillingApp:
             messagebox.showwarning("Warning", "Enter phone number to search")
             return
         
-        self.cursor.execute('SELECT name, address FROM customers WHERE phone = ?', (phone,))
+        self.cursor.execute('SELECT name, address, balance, gstin FROM customers WHERE phone = ?', (phone,))
         result = self.cursor.fetchone()
         
         if result:
@@ -1618,14 +5836,19 @@ class FertilizerBillingApp:
             self.customer_name.insert(0, result[0] or "")
             self.customer_address.delete(0, tk.END)
             self.customer_address.insert(0, result[1] or "")
-            messagebox.showinfo("Found", "Customer found!")
+            self.customer_gstin.delete(0, tk.END)
+            self.customer_gstin.insert(0, result[3] or "")
+            if (result[2] or 0) > 0.005:
+                messagebox.showinfo("Found", f"Customer found!\nCredit outstanding: Rs.{result[2]:.2f}")
+            else:
+                messagebox.showinfo("Found", "Customer found!")
         else:
             messagebox.showinfo("Not Found", "Customer not in database")
     
     def show_sales_report(self):
         window = tk.Toplevel(self.root)
         window.title("Sales Report")
-        window.geometry("600x500")
+        window.geometry("850x500")
         window.configure(bg=self.colors['card'])
         
         tk.Label(window, text="Sales Report",
@@ -1637,30 +5860,15 @@ class FertilizerBillingApp:
         stats_frame = tk.Frame(window, bg=self.colors['card'])
         stats_frame.pack(fill='x', padx=30, pady=10)
         
-        # Today
-        self.cursor.execute('''
-            SELECT COUNT(*), COALESCE(SUM(total_amount), 0)
-            FROM bills WHERE DATE(created_at) = DATE("now")
-        ''')
-        today = self.cursor.fetchone()
-        
-        # This Week
-        self.cursor.execute('''
-            SELECT COUNT(*), COALESCE(SUM(total_amount), 0)
-            FROM bills WHERE DATE(created_at) >= DATE("now", "-7 days")
-        ''')
-        week = self.cursor.fetchone()
-        
-        # This Month
-        self.cursor.execute('''
-            SELECT COUNT(*), COALESCE(SUM(total_amount), 0)
-            FROM bills WHERE strftime("%Y-%m", created_at) = strftime("%Y-%m", "now")
-        ''')
-        month = self.cursor.fetchone()
-        
-        # All Time
-        self.cursor.execute('SELECT COUNT(*), COALESCE(SUM(total_amount), 0) FROM bills')
-        total = self.cursor.fetchone()
+        # created_at is UTC; ranges stay sargable and archives are attached only if reached
+        utc_today = datetime.now(timezone.utc).date()
+        def day(d):
+            return d.strftime('%Y-%m-%d')
+
+        today = sales_summary(self.conn, day(utc_today), day(utc_today + timedelta(days=1)))
+        week = sales_summary(self.conn, day(utc_today - timedelta(days=7)))
+        month = sales_summary(self.conn, day(utc_today.replace(day=1)))
+        total = sales_summary(self.conn)
         
         periods = [
             ("Today", today, self.colors['success']),
@@ -1711,54 +5919,7 @@ class FertilizerBillingApp:
             if len(selected) > 1:
                 messagebox.showwarning("Warning", "Select only one bill to edit")
                 return
-            invoice = tree.item(selected[0])['values'][0]
-            # load bill data
-            self.cursor.execute('SELECT id, customer_id, subtotal, discount_rate, discount_amount, tax_rate, tax_amount, total_amount, payment_method, created_at FROM bills WHERE invoice_number = ?', (invoice,))
-            bill = self.cursor.fetchone()
-            if not bill:
-                messagebox.showerror("Error", "Bill not found in database")
-                return
-            bill_id = bill[0]
-            customer_id = bill[1]
-
-            # load customer
-            if customer_id:
-                self.cursor.execute('SELECT name, phone, address FROM customers WHERE id = ?', (customer_id,))
-                cust = self.cursor.fetchone()
-                if cust:
-                    self.customer_name.delete(0, tk.END)
-                    self.customer_name.insert(0, cust[0] or '')
-                    self.customer_phone.delete(0, tk.END)
-                    self.customer_phone.insert(0, cust[1] or '')
-                    self.customer_address.delete(0, tk.END)
-                    self.customer_address.insert(0, cust[2] or '')
-            else:
-                self.customer_name.delete(0, tk.END)
-                self.customer_phone.delete(0, tk.END)
-                self.customer_address.delete(0, tk.END)
-
-            # load bill items
-            self.cart_items.clear()
-            for it in self.cart_tree.get_children():
-                self.cart_tree.delete(it)
-
-            self.cursor.execute('SELECT item_name, quantity, price, total FROM bill_items WHERE bill_id = ?', (bill_id,))
-            items = self.cursor.fetchall()
-            for item in items:
-                name, qty, price, total = item
-                self.cart_items.append({'name': name, 'quantity': qty, 'price': price, 'total': total})
-                self.cart_tree.insert('', 'end', values=(name, qty, f"Rs.{price:.2f}", f"Rs.{total:.2f}"))
-
-            # load bill-level details
-            self.discount_var.set(str(bill[3] or 0))
-            self.tax_var.set(str(bill[5] or 0))
-            self.payment_var.set(bill[8] or 'Cash')
-            # set editing state
-            self.editing_bill_id = bill_id
-            # set invoice label to editing invoice
-            self.invoice_number = invoice
-            self.invoice_label.config(text=f"Invoice: {self.invoice_number} (Editing)")
-            self.update_bill_preview()
+            self.load_bill_for_edit(tree.item(selected[0])['values'][0])
 
         def delete_selected():
             selected = tree.selection()
@@ -1768,24 +5929,8 @@ class FertilizerBillingApp:
             invoices = [tree.item(s)['values'][0] for s in selected]
             if not messagebox.askyesno("Confirm", f"Delete {len(invoices)} selected bill(s)?"):
                 return
-            for inv in invoices:
-                # get bill id and items
-                self.cursor.execute('SELECT id FROM bills WHERE invoice_number = ?', (inv,))
-                row = self.cursor.fetchone()
-                if not row:
-                    continue
-                bill_id = row[0]
-                # restore stock from bill_items
-                self.cursor.execute('SELECT item_name, quantity FROM bill_items WHERE bill_id = ?', (bill_id,))
-                for item_name, qty in self.cursor.fetchall():
-                    try:
-                        self.cursor.execute('UPDATE inventory SET stock = stock + ? WHERE name = ?', (qty, item_name))
-                    except Exception:
-                        pass
-                # delete bill_items and bill
-                self.cursor.execute('DELETE FROM bill_items WHERE bill_id = ?', (bill_id,))
-                self.cursor.execute('DELETE FROM bills WHERE id = ?', (bill_id,))
-            self.conn.commit()
+            if not self.delete_bills(invoices):
+                return
             messagebox.showinfo("Deleted", "Selected bill(s) deleted")
             # refresh
             for it in tree.get_children():
@@ -1796,7 +5941,6 @@ class FertilizerBillingApp:
             ''')
             for row in self.cursor.fetchall():
                 tree.insert('', 'end', values=(row[0], row[1][:16], f"Rs.{row[2]:.2f}"))
-            self.load_inventory()
 
 
         def print_sales_report_table():
@@ -1822,11 +5966,689 @@ class FertilizerBillingApp:
                  bg=self.colors['secondary'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
         tk.Button(action_frame, text="Delete Selected", command=delete_selected,
                  bg=self.colors['danger'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+        tk.Button(action_frame, text="Search Bills", command=self.show_bill_search_window,
+                 bg=self.colors['primary'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+        tk.Button(action_frame, text="Item Analytics", command=self.show_analytics_window,
+                 bg=self.colors['warning'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+        tk.Button(action_frame, text="GST Summary", command=self.show_tax_summary_window,
+                 bg=self.colors['success'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+        tk.Button(action_frame, text="Archive Old Years", command=self.archive_old_years,
+                 bg=self.colors['purple'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='right', padx=5)
+
+    def archive_old_years(self):
+        """Move closed fiscal years into archive files on a worker thread"""
+        if not messagebox.askyesno("Archive",
+                                   "Move bills of all closed fiscal years into archive files?\n"
+                                   "Reports keep including them; archived bills can no longer be edited."):
+            return
+
+        def done(moved):
+            if not moved:
+                messagebox.showinfo("Archive", "Nothing to archive.")
+                return
+            lines = [f"FY {fy}-{(fy + 1) % 100:02d}: {n} bills" for fy, n in sorted(moved.items())]
+            messagebox.showinfo("Archive", "Archived:\n" + "\n".join(lines))
+            self.refresh_footer_stats()
+
+        self.run_in_background(archive_closed_years, done,
+                               lambda e: messagebox.showerror("Archive", f"Archiving failed: {e}"))
     
+    def load_bill_for_edit(self, invoice):
+        """Load a saved bill into the cart so the next save updates it in place"""
+        # load bill data
+        self.cursor.execute('SELECT id, customer_id, subtotal, discount_rate, discount_amount, tax_rate, tax_amount, total_amount, payment_method, created_at FROM bills WHERE invoice_number = ?', (invoice,))
+        bill = self.cursor.fetchone()
+        if not bill:
+            messagebox.showerror("Error", "Bill not found in database")
+            return
+        bill_id = bill[0]
+        customer_id = bill[1]
+
+        # load customer
+        if customer_id:
+            self.cursor.execute('SELECT name, phone, address, gstin FROM customers WHERE id = ?', (customer_id,))
+            cust = self.cursor.fetchone()
+            if cust:
+                self.customer_name.delete(0, tk.END)
+                self.customer_name.insert(0, cust[0] or '')
+                self.customer_phone.delete(0, tk.END)
+                self.customer_phone.insert(0, cust[1] or '')
+                self.customer_address.delete(0, tk.END)
+                self.customer_address.insert(0, cust[2] or '')
+                self.customer_gstin.delete(0, tk.END)
+                self.customer_gstin.insert(0, cust[3] or '')
+        else:
+            self.customer_name.delete(0, tk.END)
+            self.customer_phone.delete(0, tk.END)
+            self.customer_address.delete(0, tk.END)
+            self.customer_gstin.delete(0, tk.END)
+
+        # load bill items
+        self.cart_items.clear()
+        self.cart_journal.reset()
+        for it in self.cart_tree.get_children():
+            self.cart_tree.delete(it)
+
+        self.cursor.execute('SELECT item_name, quantity, price, total, gst_rate, hsn FROM bill_items WHERE bill_id = ?', (bill_id,))
+        items = self.cursor.fetchall()
+        for item in items:
+            # keep the slab the line was sold at, even if the item's rate changed since
+            name, qty, price, total, gst_rate, hsn = item
+            self.cart_items.append({'name': name, 'quantity': qty, 'price': price, 'total': total,
+                                    'gst_rate': gst_rate, 'hsn': hsn or ''})
+            self.cart_tree.insert('', 'end', values=(name, qty, f"Rs.{price:.2f}", f"Rs.{total:.2f}"))
+
+        # load bill-level details
+        self.discount_var.set(str(bill[3] or 0))
+        self.tax_var.set(str(bill[5] or 0))
+        self.payment_var.set(bill[8] or 'Cash')
+        # set editing state
+        self.editing_bill_id = bill_id
+        self.drafts.start(invoice)
+        # set invoice label to editing invoice
+        self.invoice_number = invoice
+        self.invoice_label.config(text=f"Invoice: {self.invoice_number} (Editing)")
+        self.update_bill_preview()
+
+    def delete_bills(self, invoices):
+        """Delete bills by invoice number, returning their items to stock; False if nothing changed"""
+        try:
+            count = delete_saved_bills(self.cursor, invoices)
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            messagebox.showerror("Error", f"Failed to delete: {str(e)}")
+            return False
+        if not count:
+            messagebox.showwarning("Warning", "The selected bills are no longer in the database")
+            return False
+        self.load_inventory()
+        self.refresh_footer_stats()
+        return True
+
+    # ============ CREDIT LEDGER WINDOW ============
+    def show_credit_window(self):
+        """Outstanding credit by customer with 30/60/90-day aging, repayments and statements"""
+        window = tk.Toplevel(self.root)
+        window.title("Customer Credit")
+        window.geometry("950x550")
+        window.configure(bg=self.colors['card'])
+
+        tk.Label(window, text="Customer Credit (Udhaar)",
+                font=('Helvetica', 18, 'bold'),
+                fg=self.colors['primary'],
+                bg=self.colors['card']).pack(pady=10)
+
+        total_label = tk.Label(window, text="", font=('Helvetica', 12, 'bold'),
+                              fg=self.colors['warning'], bg=self.colors['card'])
+        total_label.pack()
+
+        tree_frame = tk.Frame(window, bg=self.colors['card'])
+        tree_frame.pack(fill='both', expand=True, padx=20, pady=10)
+        columns = ('Customer', 'Phone', 'Balance', '0-30 days', '31-60 days', '61-90 days', '90+ days')
+        tree = ttk.Treeview(tree_frame, columns=columns, show='headings', height=15)
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=110, anchor='e')
+        tree.column('Customer', width=200, anchor='w')
+        tree.column('Phone', width=120, anchor='w')
+        scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+
+        def load_aging():
+            for it in tree.get_children():
+                tree.delete(it)
+            rows = aging_report(self.conn)
+            for customer_id, name, phone, balance, *buckets in rows:
+                tree.insert('', 'end', iid=str(customer_id),
+                            values=(name or '', phone or '', f"Rs.{balance:.2f}",
+                                    *(f"Rs.{b:.2f}" for b in buckets)))
+            total = sum(r[3] for r in rows)
+            total_label.config(text=f"Outstanding: Rs.{total:.2f} from {len(rows)} customer(s)")
+
+        def selected_customer():
+            selected = tree.selection()
+            if len(selected) != 1:
+                messagebox.showwarning("Warning", "Select one customer")
+                return None
+            return int(selected[0]), tree.item(selected[0])['values'][0]
+
+        def take_payment():
+            picked = selected_customer()
+            if not picked:
+                return
+            customer_id, name = picked
+            balance = customer_balance(self.conn, customer_id)
+            amount = simpledialog.askfloat("Record Payment",
+                                           f"Amount received from {name}\n(outstanding Rs.{balance:.2f}):",
+                                           parent=window, minvalue=0.01)
+            if not amount:
+                return
+            balance = record_payment(self.conn, customer_id, amount)
+            messagebox.showinfo("Success", f"Payment recorded. Balance now Rs.{balance:.2f}")
+            load_aging()
+
+        def show_statement():
+            picked = selected_customer()
+            if not picked:
+                return
+            customer_id, name = picked
+            stmt = tk.Toplevel(window)
+            stmt.title(f"Statement - {name}")
+            stmt.geometry("700x450")
+            stmt.configure(bg=self.colors['card'])
+            cols = ('Date', 'Entry', 'Invoice', 'Amount', 'Balance')
+            stmt_tree = ttk.Treeview(stmt, columns=cols, show='headings')
+            for col in cols:
+                stmt_tree.heading(col, text=col)
+                stmt_tree.column(col, width=120)
+            stmt_tree.column('Invoice', width=180)
+            stmt_tree.pack(fill='both', expand=True, padx=10, pady=10)
+            for created_at, kind, invoice, note, amount, running in customer_statement(self.conn, customer_id):
+                stmt_tree.insert('', 'end', values=((created_at or '')[:16], kind.title(), invoice or note or '',
+                                                    f"Rs.{amount:.2f}", f"Rs.{running:.2f}"))
+
+        action_frame = tk.Frame(window, bg=self.colors['card'])
+        action_frame.pack(fill='x', padx=20, pady=(0, 15))
+        tk.Button(action_frame, text="Record Payment", command=take_payment,
+                 bg=self.colors['success'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+        tk.Button(action_frame, text="Statement", command=show_statement,
+                 bg=self.colors['secondary'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+        tk.Button(action_frame, text="Refresh", command=load_aging,
+                 bg=self.colors['dark'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='right', padx=5)
+
+        load_aging()
+
+    # ============ BILL SEARCH WINDOW ============
+    def show_bill_search_window(self):
+        """Browse every bill with filters, one keyset page at a time"""
+        window = tk.Toplevel(self.root)
+        window.title("Search Bills")
+        window.geometry("950x600")
+        window.configure(bg=self.colors['card'])
+
+        tk.Label(window, text="Search Bills",
+                font=('Helvetica', 18, 'bold'),
+                fg=self.colors['primary'],
+                bg=self.colors['card']).pack(pady=10)
+
+        filter_frame = tk.Frame(window, bg=self.colors['card'])
+        filter_frame.pack(fill='x', padx=20, pady=5)
+        row1 = tk.Frame(filter_frame, bg=self.colors['card'])
+        row1.pack(fill='x', pady=3)
+        row2 = tk.Frame(filter_frame, bg=self.colors['card'])
+        row2.pack(fill='x', pady=3)
+
+        entries = {}
+        for row, label, key, width in [
+                (row1, "Invoice:", 'invoice', 18), (row1, "Customer (phone/name):", 'customer', 20),
+                (row2, "From (DD-MM-YYYY):", 'date_from', 11), (row2, "To:", 'date_to', 11),
+                (row2, "Min Rs.:", 'min_amount', 8), (row2, "Max Rs.:", 'max_amount', 8)]:
+            tk.Label(row, text=label, font=('Helvetica', 10),
+                    fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=(10, 2))
+            entry = tk.Entry(row, font=('Helvetica', 10), width=width)
+            entry.pack(side='left')
+            entries[key] = entry
+
+        tk.Label(row1, text="Payment:", font=('Helvetica', 10),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=(10, 2))
+        payment_var = tk.StringVar(value='')
+        ttk.Combobox(row1, textvariable=payment_var, width=8, state='readonly',
+                     values=['', 'Cash', 'Card', 'UPI', 'Credit']).pack(side='left')
+
+        tree_frame = tk.Frame(window, bg=self.colors['card'])
+        tree_frame.pack(fill='both', expand=True, padx=20, pady=10)
+        columns = ('Invoice', 'Date', 'Customer', 'Phone', 'Payment', 'Total')
+        tree = ttk.Treeview(tree_frame, columns=columns, show='headings', height=15)
+        for col in columns:
+            tree.heading(col, text=col)
+        tree.column('Invoice', width=160)
+        tree.column('Date', width=130)
+        tree.column('Customer', width=200)
+        tree.column('Phone', width=120)
+        tree.column('Payment', width=80, anchor='center')
+        tree.column('Total', width=100, anchor='e')
+        scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+
+        # page_starts[i] is the keyset cursor that page i begins after
+        state = {'filters': {}, 'page_starts': [None], 'next': None, 'schemas': {}}
+
+        def read_filters():
+            filters = {'payment': payment_var.get()}
+            for key in ('invoice', 'customer'):
+                filters[key] = entries[key].get().strip()
+            if entries['date_from'].get().strip():
+                filters['date_from'] = local_day_to_utc(entries['date_from'].get())
+            if entries['date_to'].get().strip():
+                filters['date_to'] = local_day_to_utc(entries['date_to'].get(), next_day=True)
+            for key in ('min_amount', 'max_amount'):
+                text = entries[key].get().strip()
+                filters[key] = float(text) if text else None
+            return filters
+
+        def show_page():
+            rows, state['next'] = search_bills(self.conn, state['filters'], state['page_starts'][-1])
+            for it in tree.get_children():
+                tree.delete(it)
+            state['schemas'].clear()
+            for schema, bill_id, invoice, created_at, name, phone, payment, total in rows:
+                iid = tree.insert('', 'end', values=(invoice, (created_at or '')[:16], name or '', phone or '',
+                                                     payment or '', f"Rs.{(total or 0):.2f}"))
+                state['schemas'][iid] = schema
+            page_label.config(text=f"Page {len(state['page_starts'])}"
+                                   + ("" if state['next'] else " (last)"))
+
+        def run_search():
+            try:
+                state['filters'] = read_filters()
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be DD-MM-YYYY and amounts numbers!")
+                return
+            state['page_starts'] = [None]
+            show_page()
+
+        def next_page():
+            if state['next']:
+                state['page_starts'].append(state['next'])
+                show_page()
+
+        def prev_page():
+            if len(state['page_starts']) > 1:
+                state['page_starts'].pop()
+                show_page()
+
+        def selected_live_invoices():
+            selected = tree.selection()
+            if any(state['schemas'].get(s) != 'main' for s in selected):
+                messagebox.showwarning("Archived", "Bills from archived fiscal years cannot be changed.")
+                return None
+            return [tree.item(s)['values'][0] for s in selected]
+
+        def edit_selected():
+            invoices = selected_live_invoices()
+            if invoices is None:
+                return
+            if len(invoices) != 1:
+                messagebox.showwarning("Warning", "Select one bill to edit")
+                return
+            self.load_bill_for_edit(invoices[0])
+
+        def reprint_range():
+            try:
+                filters = read_filters()
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be DD-MM-YYYY and amounts numbers!")
+                return
+            if 'date_from' not in filters or 'date_to' not in filters:
+                messagebox.showwarning("Reprint", "Enter the From and To dates of the bills to reprint")
+                return
+            out_dir = filedialog.askdirectory(title="Folder for the PDF invoices")
+            if not out_dir:
+                return
+            reprint_btn.config(state='disabled', text="Reprinting...")
+
+            def done(stats):
+                reprint_btn.config(state='normal', text="Reprint PDFs")
+                messagebox.showinfo("Reprint", f"{stats['bills']} invoices ({stats['pages']} pages) "
+                                               f"in {stats['seconds']:.1f}s\nSaved to {out_dir}")
+
+            def failed(error):
+                reprint_btn.config(state='normal', text="Reprint PDFs")
+                messagebox.showerror("Error", f"Reprint failed: {error}")
+
+            # the pool does the rendering; this thread only waits for it
+            self.run_in_background(
+                lambda conn: reprint_bills_pdf(DB_PATH, out_dir, filters['date_from'], filters['date_to']),
+                done, failed)
+
+        def receipt_selected():
+            selected = tree.selection()
+            if not selected:
+                messagebox.showwarning("Warning", "Select the bills to print")
+                return
+            target, width = self.receipt_printer()
+            if not target:
+                messagebox.showwarning("Printer", "Set the receipt printer in Settings first")
+                return
+            shop = shop_settings(self.cursor)
+            receipts = self.take_receipt_buffer()
+            try:
+                receipts.clear()
+                for iid in selected:
+                    schema = state['schemas'][iid]
+                    row = self.conn.execute(f'SELECT id FROM {schema}.bills WHERE invoice_number = ?',
+                                            (tree.item(iid)['values'][0],)).fetchone()
+                    if row is None:
+                        continue  # deleted since the search
+                    for bill, items, values in saved_bills(self.conn, schema, [row[0]]):
+                        receipts.add(shop, bill, items, values, width)
+                if not receipts.pos:
+                    messagebox.showwarning("Warning", "The selected bills have been deleted")
+                    return
+                self.send_receipt(receipts, target)
+                receipts = None  # send_receipt gives it back
+            finally:
+                if receipts is not None:
+                    self.receipt_buffers.append(receipts)
+
+        def delete_selected():
+            invoices = selected_live_invoices()
+            if not invoices:
+                return
+            if not messagebox.askyesno("Confirm", f"Delete {len(invoices)} selected bill(s)?"):
+                return
+            if self.delete_bills(invoices):
+                show_page()
+
+        tk.Button(row2, text="SEARCH", command=run_search,
+                 bg=self.colors['primary'], fg='white',
+                 font=('Helvetica', 10, 'bold'), padx=15).pack(side='left', padx=15)
+        for entry in entries.values():
+            entry.bind('<Return>', lambda e: run_search())
+
+        action_frame = tk.Frame(window, bg=self.colors['card'])
+        action_frame.pack(fill='x', padx=20, pady=(0, 15))
+        tk.Button(action_frame, text="< Prev", command=prev_page,
+                 bg=self.colors['dark'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+        page_label = tk.Label(action_frame, text="", font=('Helvetica', 10),
+                              fg=self.colors['light'], bg=self.colors['card'])
+        page_label.pack(side='left', padx=5)
+        tk.Button(action_frame, text="Next >", command=next_page,
+                 bg=self.colors['dark'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+        tk.Button(action_frame, text="Delete Selected", command=delete_selected,
+                 bg=self.colors['danger'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='right', padx=5)
+        tk.Button(action_frame, text="Edit Selected", command=edit_selected,
+                 bg=self.colors['secondary'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='right', padx=5)
+        reprint_btn = tk.Button(action_frame, text="Reprint PDFs", command=reprint_range,
+                                bg=self.colors['purple'], fg='white', font=('Helvetica', 10, 'bold'))
+        reprint_btn.pack(side='right', padx=5)
+        tk.Button(action_frame, text="Print Receipt", command=receipt_selected,
+                 bg=self.colors['warning'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='right', padx=5)
+
+        run_search()
+
+    # ============ ITEM ANALYTICS WINDOW ============
+    def show_analytics_window(self):
+        """Top items and category share for a date range, compared with the period before it"""
+        window = tk.Toplevel(self.root)
+        window.title("Item Analytics")
+        window.geometry("900x650")
+        window.configure(bg=self.colors['card'])
+
+        tk.Label(window, text="Item Analytics",
+                font=('Helvetica', 18, 'bold'),
+                fg=self.colors['primary'],
+                bg=self.colors['card']).pack(pady=10)
+
+        filter_frame = tk.Frame(window, bg=self.colors['card'])
+        filter_frame.pack(fill='x', padx=20, pady=5)
+        today = datetime.now().date()
+        entries = {}
+        for label, key, value in [("From (DD-MM-YYYY):", 'from', today - timedelta(days=29)),
+                                  ("To:", 'to', today)]:
+            tk.Label(filter_frame, text=label, font=('Helvetica', 10),
+                    fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=(10, 2))
+            entry = tk.Entry(filter_frame, font=('Helvetica', 10), width=11)
+            entry.insert(0, value.strftime('%d-%m-%Y'))
+            entry.pack(side='left')
+            entries[key] = entry
+        tk.Label(filter_frame, text="Top:", font=('Helvetica', 10),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left', padx=(10, 2))
+        top_var = tk.StringVar(value='10')
+        ttk.Combobox(filter_frame, textvariable=top_var, width=5, state='readonly',
+                     values=['10', '25', '50', '100']).pack(side='left')
+
+        status_label = tk.Label(window, text="", font=('Helvetica', 10),
+                               fg=self.colors['light'], bg=self.colors['card'])
+        status_label.pack()
+
+        def make_tree(title, columns, height):
+            tk.Label(window, text=title, font=('Helvetica', 12, 'bold'),
+                    fg=self.colors['light'], bg=self.colors['card']).pack(pady=(10, 2))
+            tree = ttk.Treeview(window, columns=columns, show='headings', height=height)
+            for col in columns:
+                tree.heading(col, text=col)
+                tree.column(col, width=100, anchor='e')
+            tree.pack(fill='x', padx=20)
+            return tree
+
+        items_tree = make_tree("Top Items", ('#', 'Item', 'Category', 'Qty', 'Sales', 'Previous', 'Change'), 10)
+        items_tree.column('#', width=40, anchor='center')
+        items_tree.column('Item', width=200, anchor='w')
+        items_tree.column('Category', width=120, anchor='w')
+        category_tree = make_tree("Categories", ('Category', 'Sales', 'Share', 'Previous', 'Change'), 6)
+        category_tree.column('Category', width=200, anchor='w')
+
+        def change_text(current, previous):
+            change = percent_change(current, previous)
+            return 'new' if change is None else f"{change:+.1f}%"
+
+        def load():
+            try:
+                start = datetime.strptime(entries['from'].get().strip(), '%d-%m-%Y').date()
+                end = datetime.strptime(entries['to'].get().strip(), '%d-%m-%Y').date() + timedelta(days=1)
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be DD-MM-YYYY!")
+                return
+            if end <= start:
+                messagebox.showerror("Error", "'To' must not be before 'From'")
+                return
+            began = time.perf_counter()
+            items = item_sales(self.conn, start, end, int(top_var.get()))
+            categories = category_sales(self.conn, start, end)
+            elapsed = (time.perf_counter() - began) * 1000.0
+
+            for tree in (items_tree, category_tree):
+                for it in tree.get_children():
+                    tree.delete(it)
+            for rank, (name, category, qty, amount, previous) in enumerate(items, 1):
+                items_tree.insert('', 'end', values=(rank, name, category or '', f"{qty:g}", f"Rs.{amount:.2f}",
+                                                     f"Rs.{previous:.2f}", change_text(amount, previous)))
+            total = sum(c[1] for c in categories)
+            for category, amount, previous in categories:
+                share = amount * 100.0 / total if total else 0.0
+                category_tree.insert('', 'end', values=(category or 'Other', f"Rs.{amount:.2f}", f"{share:.1f}%",
+                                                        f"Rs.{previous:.2f}", change_text(amount, previous)))
+            status_label.config(text=f"Sales Rs.{total:.2f} over {(end - start).days} day(s), "
+                                     f"compared with the {(end - start).days} day(s) before | {elapsed:.1f}ms")
+
+        tk.Button(filter_frame, text="SHOW", command=load,
+                 bg=self.colors['primary'], fg='white',
+                 font=('Helvetica', 10, 'bold'), padx=15).pack(side='left', padx=15)
+        for entry in entries.values():
+            entry.bind('<Return>', lambda e: load())
+
+        load()
+
+    # ============ GST SUMMARY WINDOW ============
+    def show_tax_summary_window(self):
+        """Month-by-month taxable value and CGST/SGST per slab, read from tax_monthly"""
+        window = tk.Toplevel(self.root)
+        window.title("GST Summary")
+        window.geometry("700x560")
+        window.configure(bg=self.colors['card'])
+
+        tk.Label(window, text="GST Summary (last 12 months)",
+                font=('Helvetica', 18, 'bold'),
+                fg=self.colors['primary'],
+                bg=self.colors['card']).pack(pady=10)
+
+        tree_frame = tk.Frame(window, bg=self.colors['card'])
+        tree_frame.pack(fill='both', expand=True, padx=20, pady=10)
+        columns = ('Month', 'GST %', 'Taxable', 'CGST', 'SGST', 'Total Tax')
+        tree = ttk.Treeview(tree_frame, columns=columns, show='headings', height=15)
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=100, anchor='e')
+        tree.column('Month', width=90, anchor='center')
+        tree.column('GST %', width=60, anchor='center')
+        scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+
+        today = datetime.now().date()
+        since = f"{today.year - 1:04d}-{today.month:02d}"
+        for month, rate, taxable, cgst, sgst in monthly_tax(self.conn, since):
+            tree.insert('', 'end', values=(month, f"{rate:g}", f"Rs.{taxable:.2f}", f"Rs.{cgst:.2f}",
+                                           f"Rs.{sgst:.2f}", f"Rs.{cgst + sgst:.2f}"))
+
+        status_label = tk.Label(window, text="Select a month to export its GSTR-1", font=('Helvetica', 10),
+                               fg=self.colors['light'], bg=self.colors['card'])
+        status_label.pack()
+
+        def export():
+            selected = tree.selection()
+            if not selected:
+                messagebox.showwarning("Warning", "Select a month to export")
+                return
+            month = tree.item(selected[0])['values'][0]
+            filename = filedialog.asksaveasfilename(defaultextension=".json",
+                                                    filetypes=[("JSON files", "*.json")],
+                                                    initialfile=f"GSTR1_{month}.json")
+            if not filename:
+                return
+            status_label.config(text=f"Exporting GSTR-1 for {month}...")
+            self.run_in_background(
+                lambda conn: export_gstr1(conn, filename, month),
+                lambda stats: status_label.config(
+                    text=f"{stats['invoices']} invoices ({stats['b2b']} B2B) saved to "
+                         f"{os.path.basename(filename)} in {stats['seconds']:.2f}s"),
+                lambda error: status_label.config(text=f"GSTR-1 export failed: {error}"))
+
+        action_frame = tk.Frame(window, bg=self.colors['card'])
+        action_frame.pack(fill='x', padx=20, pady=(0, 15))
+        tk.Button(action_frame, text="Export GSTR-1", command=export,
+                 bg=self.colors['success'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='right', padx=5)
+
+    # ============ REORDER PLAN WINDOW ============
+    def show_reorder_window(self):
+        """Ranked reorder suggestions from the sales forecast, computed off the UI thread"""
+        window = tk.Toplevel(self.root)
+        window.title("Reorder Plan")
+        window.geometry("1100x550")
+        window.configure(bg=self.colors['card'])
+
+        tk.Label(window, text="Reorder Plan",
+                font=('Helvetica', 18, 'bold'),
+                fg=self.colors['primary'],
+                bg=self.colors['card']).pack(pady=10)
+        status_label = tk.Label(window, text="Forecasting...", font=('Helvetica', 10),
+                               fg=self.colors['light'], bg=self.colors['card'])
+        status_label.pack()
+
+        tree_frame = tk.Frame(window, bg=self.colors['card'])
+        tree_frame.pack(fill='both', expand=True, padx=20, pady=10)
+        tree = ttk.Treeview(tree_frame, columns=FORECAST_COLUMNS, show='headings', height=15)
+        for col in FORECAST_COLUMNS:
+            tree.heading(col, text=col)
+            tree.column(col, width=95, anchor='e')
+        tree.column('Item', width=200, anchor='w')
+        tree.column('Category', width=110, anchor='w')
+        scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+
+        state = {'rows': []}
+
+        def show(result):
+            rows, elapsed = result
+            state['rows'] = rows
+            for it in tree.get_children():
+                tree.delete(it)
+            for row in rows:
+                tree.insert('', 'end', values=[('-' if v is None else v) for v in row])
+            status_label.config(text=f"{len(rows)} item(s) to reorder | lead time {FORECAST_LEAD_DAYS} days, "
+                                     f"cover {FORECAST_TARGET_DAYS} days | computed in {elapsed * 1000:.0f}ms")
+
+        def failed(error):
+            if isinstance(error, ImportError):
+                status_label.config(text="NumPy is required for forecasting: pip install numpy")
+            else:
+                status_label.config(text=f"Forecast failed: {error}")
+
+        def work(conn):
+            start = time.perf_counter()
+            rows = reorder_suggestions(conn)
+            return rows, time.perf_counter() - start
+
+        def export():
+            if not state['rows']:
+                messagebox.showwarning("Warning", "Nothing to export")
+                return
+            filename = filedialog.asksaveasfilename(defaultextension=".csv",
+                                                    filetypes=[("CSV files", "*.csv")],
+                                                    initialfile=f"reorder_{datetime.now().strftime('%Y%m%d')}.csv")
+            if filename:
+                export_reorder_csv(state['rows'], filename)
+                messagebox.showinfo("Success", f"Reorder plan saved to {filename}")
+
+        action_frame = tk.Frame(window, bg=self.colors['card'])
+        action_frame.pack(fill='x', padx=20, pady=(0, 15))
+        tk.Button(action_frame, text="Export CSV", command=export,
+                 bg=self.colors['success'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='right', padx=5)
+
+        self.run_in_background(work, show, failed)
+
+    # ============ EXPIRING STOCK WINDOW ============
+    def show_expiring_window(self):
+        """Lots with stock that expire within a chosen number of days, soonest first"""
+        window = tk.Toplevel(self.root)
+        window.title("Expiring Stock")
+        window.geometry("760x500")
+        window.configure(bg=self.colors['card'])
+
+        tk.Label(window, text="Expiring Stock",
+                font=('Helvetica', 18, 'bold'),
+                fg=self.colors['danger'],
+                bg=self.colors['card']).pack(pady=10)
+
+        filter_frame = tk.Frame(window, bg=self.colors['card'])
+        filter_frame.pack(fill='x', padx=20)
+        tk.Label(filter_frame, text="Expiring within (days):", font=('Helvetica', 10),
+                fg=self.colors['light'], bg=self.colors['card']).pack(side='left')
+        days_var = tk.StringVar(value=str(EXPIRY_WARN_DAYS))
+        ttk.Combobox(filter_frame, textvariable=days_var, width=5, state='readonly',
+                     values=('7', '15', '30', '60', '90', '180')).pack(side='left', padx=5)
+        status_label = tk.Label(filter_frame, text="", font=('Helvetica', 10),
+                               fg=self.colors['light'], bg=self.colors['card'])
+        status_label.pack(side='right')
+
+        tree_frame = tk.Frame(window, bg=self.colors['card'])
+        tree_frame.pack(fill='both', expand=True, padx=20, pady=10)
+        tree = ttk.Treeview(tree_frame, columns=EXPIRING_COLUMNS, show='headings', height=15)
+        for col in EXPIRING_COLUMNS:
+            tree.heading(col, text=col)
+            tree.column(col, width=100, anchor='center')
+        tree.column('Item', width=240, anchor='w')
+        scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+
+        def load(*args):
+            tree.delete(*tree.get_children())
+            rows = expiring_lots(self.cursor, int(days_var.get()))
+            for item, batch, expiry, quantity, days_left in rows:
+                expiry = datetime.strptime(expiry, '%Y-%m-%d').strftime('%d-%m-%Y')
+                tree.insert('', 'end', values=(item, batch or '-', expiry, quantity,
+                                               'Expired' if days_left < 0 else days_left))
+            expired = sum(1 for row in rows if row[4] < 0)
+            status_label.config(text=f"{len(rows)} lot(s), {expired} already expired")
+
+        days_var.trace('w', load)
+        load()
+
     def show_settings(self):
         dialog = tk.Toplevel(self.root)
         dialog.title("Shop Settings")
-        dialog.geometry("450x350")
+        dialog.geometry("450x720")
         dialog.configure(bg=self.colors['card'])
         dialog.transient(self.root)
         dialog.grab_set()
@@ -1852,6 +6674,11 @@ class FertilizerBillingApp:
             ('GST Number:', settings[6] if settings and len(settings) > 6 else ''),
             ('Licence Number:', settings[7] if settings and len(settings) > 7 else '')
         ]
+        receipt_target, receipt_width = self.receipt_printer()
+        labels += [
+            ('Receipt Printer (device or file):', receipt_target),
+            ('Receipt Width (32 = 58mm, 48 = 80mm):', str(receipt_width))
+        ]
         
         for label, value in labels:
             tk.Label(form_frame, text=label, fg=self.colors['light'],
@@ -1902,6 +6729,16 @@ class FertilizerBillingApp:
                     fields['GST Number:'].get() if 'GST Number:' in fields else '',
                     fields['Licence Number:'].get() if 'Licence Number:' in fields else ''
                 ))
+            try:
+                width = int(fields['Receipt Width (32 = 58mm, 48 = 80mm):'].get() or BILL_WIDTH)
+                if width not in RECEIPT_WIDTHS:
+                    raise ValueError
+            except ValueError:
+                self.conn.rollback()
+                messagebox.showerror("Error", "Receipt width must be 32 or 48 characters!")
+                return
+            self.cursor.execute('UPDATE settings SET receipt_printer = ?, receipt_width = ? WHERE id = 1',
+                                (fields['Receipt Printer (device or file):'].get().strip(), width))
             self.conn.commit()
             messagebox.showinfo("Success", "Settings saved!")
             dialog.destroy()
@@ -1909,14 +6746,279 @@ class FertilizerBillingApp:
         tk.Button(dialog, text="Save Settings", command=save_settings,
                  bg=self.colors['success'], fg='white',
                  font=('Helvetica', 11, 'bold')).pack(pady=20)
-    
+
+        tk.Button(dialog, text="Backup Now", command=self.backup_now,
+                 bg=self.colors['secondary'], fg='white',
+                 font=('Helvetica', 10, 'bold')).pack()
+
+    def backup_now(self):
+        self.run_in_background(backup_database,
+                               lambda path: messagebox.showinfo("Backup", f"Backup verified and saved:\n{path}"),
+                               lambda e: messagebox.showerror("Backup", f"Backup failed: {e}"))
+
+    def scheduled_backup(self):
+        """Periodic online backup; runs off the UI thread and reschedules itself"""
+        self.run_in_background(backup_database, None,
+                               lambda e: backup_log.error('scheduled backup failed: %s', e))
+        self.root.after(BACKUP_INTERVAL_MS, self.scheduled_backup)
+
+    # ============ DIAGNOSTICS WINDOW ============
+    def show_diagnostics_window(self):
+        """Show handler latency percentiles and the ranked query profile"""
+        if not self.instr.enabled and not self.query_profiler:
+            messagebox.showinfo("Diagnostics",
+                                "Diagnostics are off.\nStart the app with FERTILIZER_INSTRUMENT=1 to time handlers "
+                                "and FERTILIZER_QUERY_LOG=1 to profile SQL.")
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title("Diagnostics")
+        window.geometry("1000x650")
+        window.configure(bg=self.colors['card'])
+
+        def make_tree(title, columns, widths):
+            tk.Label(window, text=title,
+                    font=('Helvetica', 14, 'bold'),
+                    fg=self.colors['primary'],
+                    bg=self.colors['card']).pack(pady=(10, 2))
+            tree_frame = tk.Frame(window, bg=self.colors['card'])
+            tree_frame.pack(fill='both', expand=True, padx=20, pady=5)
+            tree = ttk.Treeview(tree_frame, columns=columns, show='headings', height=10)
+            for col, width in zip(columns, widths):
+                tree.heading(col, text=col)
+                tree.column(col, width=width, anchor='w' if width > 100 else 'e')
+            scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=tree.yview)
+            tree.configure(yscrollcommand=scrollbar.set)
+            tree.pack(side='left', fill='both', expand=True)
+            scrollbar.pack(side='right', fill='y')
+            return tree
+
+        handler_tree = None
+        if self.instr.enabled:
+            handler_tree = make_tree("Handler Latency (ms)",
+                                     ('Handler', 'Count', 'p50', 'p95', 'p99', 'Max'),
+                                     (480, 70, 70, 70, 70, 70))
+        query_tree = None
+        if self.query_profiler:
+            query_tree = make_tree("Queries (ranked by total time)",
+                                   ('Statement', 'Count', 'Total ms', 'Max ms', 'VM Steps', 'Plan'),
+                                   (520, 60, 80, 70, 90, 60))
+
+        def load_stats():
+            if handler_tree:
+                for it in handler_tree.get_children():
+                    handler_tree.delete(it)
+                # slowest tail first
+                stats = sorted(self.instr.summary().items(), key=lambda kv: kv[1]['p99_ms'], reverse=True)
+                for name, s in stats:
+                    handler_tree.insert('', 'end', values=(name, s['count'], f"{s['p50_ms']:.2f}",
+                                                           f"{s['p95_ms']:.2f}", f"{s['p99_ms']:.2f}", f"{s['max_ms']:.2f}"))
+            if query_tree:
+                for it in query_tree.get_children():
+                    query_tree.delete(it)
+                for r in self.query_profiler.ranked(limit=200):
+                    query_tree.insert('', 'end', values=(r['statement'], r['count'], f"{r['total_ms']:.1f}",
+                                                         f"{r['max_ms']:.2f}", r['vm_steps'],
+                                                         'SCAN' if r['full_scan'] else ''))
+
+        def reset_stats():
+            self.instr.reset()
+            if self.query_profiler:
+                self.query_profiler.stats.clear()
+            load_stats()
+
+        def dump_stats():
+            saved = []
+            if self.instr.enabled:
+                self.instr.dump()
+                saved.append(LATENCY_DUMP_PATH)
+            if self.query_profiler:
+                self.query_profiler.write_summary()
+                saved.append(SLOW_QUERY_LOG_PATH)
+            messagebox.showinfo("Saved", "Written to " + ", ".join(saved))
+
+        load_stats()
+
+        btn_frame = tk.Frame(window, bg=self.colors['card'])
+        btn_frame.pack(fill='x', padx=20, pady=10)
+        tk.Button(btn_frame, text="Refresh", command=load_stats,
+                 bg=self.colors['secondary'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+        tk.Button(btn_frame, text="Reset", command=reset_stats,
+                 bg=self.colors['warning'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+        tk.Button(btn_frame, text="Save", command=dump_stats,
+                 bg=self.colors['primary'], fg='white', font=('Helvetica', 10, 'bold')).pack(side='left', padx=5)
+
     def __del__(self):
         if hasattr(self, 'conn'):
             self.conn.close()
 
 
+# ============ COMMAND LINE ============
+def run_cli(argv):
+    """Maintenance commands that run without the UI, e.g. `fertilizer_billing.py archive --closed`"""
+    import argparse
+    parser = argparse.ArgumentParser(prog='fertilizer_billing.py')
+    parser.add_argument('--db', default=DB_PATH, help='database file (default: %(default)s)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('archive', help='move closed fiscal years into archive files')
+    which = p.add_mutually_exclusive_group(required=True)
+    which.add_argument('--year', type=int, help='fiscal year by starting year, e.g. 2023 for FY 2023-24')
+    which.add_argument('--closed', action='store_true', help='every fiscal year before the current one')
+    p.add_argument('--chunk', type=int, default=ARCHIVE_CHUNK, help='bills moved per transaction')
+    p.add_argument('--vacuum', action='store_true', help='VACUUM afterwards to shrink the live file')
+
+    p = sub.add_parser('backup', help='online backup with integrity check and rotation')
+    p.add_argument('--dir', default=None, help='backup directory (default: backups/ next to the database)')
+    p.add_argument('--keep', type=int, default=BACKUP_KEEP, help='backups to retain')
+
+    p = sub.add_parser('forecast', help='reorder suggestions from sales history (needs NumPy)')
+    p.add_argument('--out', help='write CSV here instead of printing')
+    p.add_argument('--all', action='store_true', help='include items that need no reorder')
+
+    sub.add_parser('rollup', help='rebuild the per-day item sales rollup from all bills')
+
+    p = sub.add_parser('gstr1', help='GSTR-1 return data (B2B, B2C small, HSN summary)')
+    p.add_argument('--from', dest='first', required=True, help='first month, YYYY-MM')
+    p.add_argument('--to', dest='last', help='last month, YYYY-MM (default: --from)')
+    p.add_argument('--format', choices=('json', 'csv'), default='json')
+    p.add_argument('--out', required=True, help='JSON file, or folder for the CSV files')
+
+    p = sub.add_parser('margins', help='sales, cost and margin per item and month')
+    p.add_argument('--from', dest='first', required=True, help='first month, YYYY-MM')
+    p.add_argument('--to', dest='last', help='last month, YYYY-MM (default: --from)')
+    p.add_argument('--out', help='write CSV here instead of printing')
+
+    p = sub.add_parser('cogs', help='FIFO cost of goods sold and margin per month')
+    p.add_argument('--from', dest='first', required=True, help='first month, YYYY-MM')
+    p.add_argument('--to', dest='last', help='last month, YYYY-MM (default: --from)')
+    p.add_argument('--out', help='write CSV here instead of printing')
+
+    sub.add_parser('valuation', help='stock on hand valued at FIFO cost')
+
+    p = sub.add_parser('expiring', help='lots with stock expiring soon or already expired')
+    p.add_argument('--days', type=int, default=EXPIRY_WARN_DAYS, help='look ahead this many days (default: %(default)s)')
+
+    p = sub.add_parser('reprint', help='a PDF invoice for every bill in a date range')
+    p.add_argument('--from', dest='first', required=True, help='first day, DD-MM-YYYY')
+    p.add_argument('--to', dest='last', help='last day, DD-MM-YYYY (default: --from)')
+    p.add_argument('--out', required=True, help='folder for the PDF files')
+    p.add_argument('--workers', type=int, default=None, help='processes (default: one per CPU)')
+
+    p = sub.add_parser('sync', help='exchange changes with other branches through delta files')
+    sync_sub = p.add_subparsers(dest='sync_command', required=True)
+    q = sync_sub.add_parser('init', help='name this branch and start capturing changes')
+    q.add_argument('--node', required=True, help='1-8 letters or digits, e.g. B1')
+    q = sync_sub.add_parser('export', help='write the changes a branch has not been sent yet')
+    q.add_argument('--peer', required=True, help='node name of the branch the file is for')
+    q.add_argument('--out', required=True)
+    q.add_argument('--resend', action='store_true', help='start again from the first change')
+    q = sync_sub.add_parser('apply', help='apply a delta file from another branch')
+    q.add_argument('file')
+    sync_sub.add_parser('status', help='node name, sequence numbers and unsent changes')
+
+    p = sub.add_parser('serve', help='JSON API for counter tablets (inventory, cart pricing, bill save)')
+    p.add_argument('--host', default=API_HOST, help='0.0.0.0 to accept tablets on the LAN (default: %(default)s)')
+    p.add_argument('--port', type=int, default=API_PORT, help='0 picks a free port (default: %(default)s)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'backup' and args.keep < 1:
+        parser.error('--keep must be at least 1')
+    conn = open_database(args.db)
+    try:
+        if args.command == 'archive':
+            archive_dir = os.path.join(os.path.dirname(os.path.abspath(args.db)), ARCHIVE_DIR)
+            if args.closed:
+                moved = archive_closed_years(conn, archive_dir, args.chunk)
+            else:
+                moved = {args.year: archive_fiscal_year(conn, args.year, archive_dir, args.chunk)}
+            for fy, n in sorted(moved.items()):
+                print(f"FY {fy}-{(fy + 1) % 100:02d}: archived {n} bills")
+            if args.vacuum:
+                conn.execute('VACUUM')
+        elif args.command == 'backup':
+            backup_dir = args.dir or os.path.join(os.path.dirname(os.path.abspath(args.db)), BACKUP_DIR)
+            print(backup_database(conn, backup_dir, args.keep))
+        elif args.command == 'rollup':
+            rebuild_sales_rollup(conn)
+            print(f"{conn.execute('SELECT COUNT(*) FROM sales_daily').fetchone()[0]} item-days")
+        elif args.command == 'forecast':
+            rows = reorder_suggestions(conn, include_all=args.all)
+            if args.out:
+                export_reorder_csv(rows, args.out)
+            else:
+                writer = csv.writer(sys.stdout)
+                writer.writerow(FORECAST_COLUMNS)
+                writer.writerows(rows)
+        elif args.command == 'gstr1':
+            stats = export_gstr1(conn, args.out, args.first, args.last, args.format)
+            print(f"{stats['invoices']} invoices ({stats['b2b']} B2B), {stats.get('lines', 0)} lines "
+                  f"in {stats['seconds']:.2f}s -> {args.out}")
+        elif args.command == 'margins':
+            rows = margin_report(conn, *month_bounds(args.first, args.last))
+            if args.out:
+                export_margins_csv(rows, args.out)
+            else:
+                writer = csv.writer(sys.stdout)
+                writer.writerow(MARGIN_COLUMNS)
+                writer.writerows(rows)
+        elif args.command == 'cogs':
+            rows = cogs_report(conn, args.first, args.last)
+            if args.out:
+                export_cogs_csv(rows, args.out)
+            else:
+                writer = csv.writer(sys.stdout)
+                writer.writerow(COGS_COLUMNS)
+                writer.writerows(rows)
+        elif args.command == 'valuation':
+            items, units, value, uncosted = stock_valuation(conn.cursor())
+            print(f"{items} items, {units} units, Rs.{value:.2f} at cost ({uncosted} units without cost)")
+        elif args.command == 'expiring':
+            writer = csv.writer(sys.stdout)
+            writer.writerow(EXPIRING_COLUMNS)
+            writer.writerows(expiring_lots(conn.cursor(), args.days))
+        elif args.command == 'reprint':
+            stats = reprint_bills_pdf(args.db, args.out, local_day_to_utc(args.first),
+                                      local_day_to_utc(args.last or args.first, next_day=True), args.workers)
+            print(f"{stats['bills']} invoices, {stats['pages']} pages, {stats['bytes'] / 1024:.0f} KB "
+                  f"in {stats['seconds']:.2f}s on {stats['workers']} processes -> {args.out}")
+        elif args.command == 'sync':
+            if args.sync_command == 'init':
+                print(f"This database is node {init_sync_node(conn, args.node)}")
+            elif args.sync_command == 'export':
+                stats = export_changes(conn, args.peer, args.out, args.resend)
+                print(f"{stats['changes']} changed rows, {stats['bytes']} bytes "
+                      f"in {stats['seconds'] * 1000:.0f}ms -> {args.out}")
+            elif args.sync_command == 'apply':
+                stats = apply_changes(conn, args.file)
+                print(f"{stats['applied']} applied, {stats['skipped']} already here or older "
+                      f"in {stats['seconds'] * 1000:.0f}ms")
+                for conflict in stats['conflicts']:
+                    print(f"  {conflict}")
+            else:
+                node, seq, seen, pending = sync_status(conn)
+                print(f"node {node}, {seq} local changes")
+                for origin, top in seen.items():
+                    print(f"  received from {origin} up to {top}")
+                for peer, count in pending.items():
+                    print(f"  {count} changes not yet sent to {peer}")
+        elif args.command == 'serve':
+            conn.close()
+            serve_counter_api(args.db, args.host, args.port)
+    except SyncError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
 # Run Application
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     root = tk.Tk()
     app = FertilizerBillingApp(root)
+    if os.environ.get('FERTILIZER_STARTUP_BENCH') == '1':
+        root.after_idle(app.report_first_frame)
     root.mainloop()
\ No newline at end of file
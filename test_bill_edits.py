@@ -0,0 +1,152 @@
+"""Randomised check that editing saved bills in place (update_bill_lines) leaves
+stock, lots, cost layers, rollups and credit balances exactly where rebuilding
+them from the bills that remain would put them.
+
+    python -m pytest -q test_bill_edits.py
+"""
+import random
+
+import pytest
+
+import fertilizer_billing as fb
+
+CUSTOMERS = [('Ravi', '9000000001', '', ''), ('Meena', '9000000002', '', ''), None]
+
+
+def recount(cur, sql, params=()):
+    return {row[0]: tuple(round(v, 6) if isinstance(v, float) else v for v in row[1:])
+            for row in cur.execute(sql, params).fetchall()}
+
+
+def rollup_rows(cur, table):
+    """A rollup's rows, rounded, leaving out the ones edits have taken back to nothing"""
+    rows = [tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+            for row in cur.execute(f'SELECT * FROM {table}').fetchall()]
+    # both rollups end in their two measures
+    return sorted(row for row in rows if any(row[-2:]))
+
+
+def check_against_rebuild(conn, start_stock, received):
+    cur = conn.cursor()
+    sold = dict(cur.execute('SELECT item_name, SUM(quantity) FROM bill_items GROUP BY item_name').fetchall())
+    for name, stock in cur.execute('SELECT name, stock FROM inventory').fetchall():
+        assert stock == start_stock[name] + received.get(name, 0) - sold.get(name, 0), name
+
+    # every unit on hand sits in a lot and a cost layer, and every unit sold by a
+    # costed bill came out of them
+    assert not cur.execute('''
+        SELECT name FROM inventory i
+        WHERE stock != (SELECT IFNULL(SUM(quantity), 0) FROM stock_lots WHERE item_name = i.name)
+           OR stock != (SELECT IFNULL(SUM(quantity), 0) FROM cost_layers WHERE item_name = i.name)
+    ''').fetchall()
+    for table, fk, parent in (('lot_allocations', 'lot_id', 'stock_lots'), ('cogs_entries', 'layer_id', 'cost_layers')):
+        assert not cur.execute(f'''
+            SELECT bi.bill_id, bi.item_name FROM bill_items bi
+            WHERE bi.bill_id NOT IN (SELECT bill_id FROM uncosted_bills)
+            GROUP BY bi.bill_id, bi.item_name
+            HAVING SUM(bi.quantity) != (SELECT IFNULL(SUM(a.quantity), 0) FROM {table} a
+                                        JOIN {parent} p ON p.id = a.{fk}
+                                        WHERE a.bill_id = bi.bill_id AND p.item_name = bi.item_name)
+        ''').fetchall(), table
+
+    assert cur.execute('SELECT items, units, ROUND(value, 6), uncosted FROM stock_totals').fetchone() == \
+        cur.execute('''SELECT (SELECT COUNT(*) FROM inventory), (SELECT SUM(stock) FROM inventory),
+                              ROUND(SUM(quantity * IFNULL(unit_cost, 0)), 6),
+                              SUM(IIF(unit_cost IS NULL, quantity, 0))
+                       FROM cost_layers''').fetchone()
+    assert recount(cur, '''SELECT month, sales, cogs, uncosted FROM cogs_monthly
+                           WHERE ABS(sales) > 1e-9 OR ABS(cogs) > 1e-9 OR uncosted''') == \
+        recount(cur, '''SELECT strftime('%Y-%m', b.created_at, 'localtime'),
+                               SUM((SELECT SUM(taxable) FROM bill_items WHERE bill_id = b.id)), SUM(c.cogs), SUM(c.uncosted)
+                        FROM (SELECT e.bill_id, SUM(e.quantity * IFNULL(l.unit_cost, 0)) AS cogs,
+                                     SUM(IIF(l.unit_cost IS NULL, e.quantity, 0)) AS uncosted
+                              FROM cogs_entries e JOIN cost_layers l ON l.id = e.layer_id
+                              GROUP BY e.bill_id) AS c
+                        JOIN bills b ON b.id = c.bill_id
+                        GROUP BY 1''')
+
+    # credit: one sale row per credit bill, balances the sum of their rows
+    assert recount(cur, "SELECT bill_id, customer_id, amount FROM ledger WHERE kind = 'sale'") == \
+        recount(cur, "SELECT id, customer_id, total_amount FROM bills WHERE payment_method = 'Credit'")
+    assert recount(cur, 'SELECT id, balance FROM customers') == \
+        recount(cur, 'SELECT c.id, IFNULL(SUM(l.amount), 0.0) FROM customers c LEFT JOIN ledger l '
+                     'ON l.customer_id = c.id GROUP BY c.id')
+
+    rollups = {table: rollup_rows(cur, table) for table, _ in fb.ROLLUPS}
+    fb.rebuild_sales_rollup(conn)
+    for table, _ in fb.ROLLUPS:
+        assert rollups[table] == rollup_rows(cur, table), table
+
+
+def forget_costing(cur, bill_id):
+    """Make a saved bill look like one from before lots and costing began"""
+    sales, cogs, uncosted = cur.execute('''
+        SELECT (SELECT SUM(taxable) FROM bill_items WHERE bill_id = ?),
+               SUM(e.quantity * IFNULL(l.unit_cost, 0)), SUM(IIF(l.unit_cost IS NULL, e.quantity, 0))
+        FROM cogs_entries e JOIN cost_layers l ON l.id = e.layer_id WHERE e.bill_id = ?
+    ''', (bill_id, bill_id)).fetchone()
+    cur.execute(fb.COGS_DELTA, (-sales, -cogs, -uncosted, bill_id))
+    cur.execute('DELETE FROM cogs_entries WHERE bill_id = ?', (bill_id,))
+    cur.execute('DELETE FROM lot_allocations WHERE bill_id = ?', (bill_id,))
+    cur.execute('INSERT INTO uncosted_bills VALUES (?)', (bill_id,))
+
+
+def random_lines(rnd, names):
+    lines = [{'name': name, 'quantity': rnd.randint(1, 6), 'price': rnd.choice([250.0, 99.5, 1200.0]),
+              'gst_rate': rnd.choice([0, 5, 18]), 'hsn': '3102'}
+             for name in rnd.sample(names, min(len(names), rnd.randint(1, 4)))]
+    for line in lines:
+        line['total'] = line['quantity'] * line['price']
+    return lines
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_random_edits_match_rebuild(tmp_path, seed):
+    rnd = random.Random(seed)
+    conn = fb.open_database(str(tmp_path / 'edits.db'))
+    cur = conn.cursor()
+    cur.execute('UPDATE inventory SET cost = price * 0.8')
+    names = [row[0] for row in cur.execute('SELECT name FROM inventory')]
+    received = {}
+    for name in names:
+        fb.receive_stock(cur, name, 1000, 'B1', None, rnd.choice([None, 55.0]))
+        received[name] = 1000
+    start_stock = {name: stock - received[name] for name, stock in cur.execute('SELECT name, stock FROM inventory')}
+    cur.execute('CREATE TEMP TABLE uncosted_bills (bill_id INTEGER PRIMARY KEY)')
+    conn.commit()
+
+    for _ in range(150):
+        bills = [row[0] for row in cur.execute('SELECT id FROM bills')]
+        op = rnd.random()
+        if op < 0.3 or not bills:
+            lines = random_lines(rnd, names)
+            bill_id, _ = fb.save_bill(cur, lines, fb.price_bill(lines, rnd.choice([0, 5]), 18), 'Cash')
+            if rnd.random() < 0.2:
+                forget_costing(cur, bill_id)
+        elif op < 0.85:
+            bill_id = rnd.choice(bills)
+            lines = [{'name': name, 'quantity': quantity, 'price': price, 'total': quantity * price,
+                      'gst_rate': rate, 'hsn': hsn}
+                     for name, quantity, price, rate, hsn in cur.execute(
+                         'SELECT item_name, quantity, price, gst_rate, hsn FROM bill_items WHERE bill_id = ?',
+                         (bill_id,)).fetchall()]
+            for line in lines:
+                if rnd.random() < 0.5:
+                    line['quantity'] = max(1, line['quantity'] + rnd.randint(-3, 3))
+                    line['total'] = line['quantity'] * line['price']
+            if len(lines) > 1 and rnd.random() < 0.3:
+                lines.pop(rnd.randrange(len(lines)))
+            if rnd.random() < 0.3:
+                extra = random_lines(rnd, [n for n in names if n not in {line['name'] for line in lines}])
+                lines += extra[:1]
+            customer = rnd.choice(CUSTOMERS)
+            payment = 'Credit' if customer and rnd.random() < 0.6 else 'Cash'
+            fb.save_bill(cur, lines, fb.price_bill(lines, rnd.choice([0, 5, 10]), 18), payment,
+                         customer=customer, bill_id=bill_id)
+        else:
+            invoices = [row[0] for row in cur.execute('SELECT invoice_number FROM bills')]
+            fb.delete_saved_bills(cur, rnd.sample(invoices, min(len(invoices), rnd.randint(1, 3))))
+            cur.execute('DELETE FROM uncosted_bills WHERE bill_id NOT IN (SELECT id FROM bills)')
+        conn.commit()
+        check_against_rebuild(conn, start_stock, received)
+    conn.close()